@@ -0,0 +1,297 @@
+"""
+Measures the throughput of the collect, read and write stages, and of the
+`collectstaticsite` command as a whole, against the synthetic site in
+`benchmarks.site`. Run from the repository root::
+
+    python -m benchmarks.run --pages 5000 --output before.json
+    # ... make changes ...
+    python -m benchmarks.run --pages 5000 --compare before.json
+
+Comparing exits non-zero if any stage got slower by more than `--tolerance`.
+"""
+
+from argparse import ArgumentParser
+from collections import namedtuple
+from contextlib import nullcontext
+from io import StringIO
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from time import perf_counter
+
+try:
+    import resource
+except ImportError:  # pragma: no cover ... Windows
+    resource = None
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Result(namedtuple("Result", "stage pages seconds pages_per_second peak_rss")):
+    __slots__ = ()
+
+
+def peak_rss():
+    """
+    The peak resident set size, in KiB, of this process or any of its
+    (finished) children, eg: pool workers.
+    """
+    if resource is None:  # pragma: no cover
+        return None
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    if sys.platform == "darwin":  # pragma: no cover ... reported in bytes
+        peak = peak // 1024
+    return peak
+
+
+def timed(stage, func, repeat=1, setup=None):
+    """
+    Calls `func` `repeat` times, keeping the fastest run. `func` should return
+    the number of pages it dealt with. If given, `setup(attempt)` returns a
+    context manager to call it in, which isn't timed.
+    """
+    best = None
+    for attempt in range(1, repeat + 1):
+        with setup(attempt) if setup is not None else nullcontext():
+            started = perf_counter()
+            pages = func()
+            seconds = perf_counter() - started
+        if best is None or seconds < best[1]:
+            best = (pages, seconds)
+    pages, seconds = best
+    return Result(
+        stage=stage,
+        pages=pages,
+        seconds=round(seconds, 4),
+        pages_per_second=round(pages / seconds, 2) if seconds else None,
+        peak_rss=peak_rss(),
+    )
+
+
+def isolated(stage, directory):
+    """
+    Gives each attempt at a stage a storage, manifest and journal of its own
+    beneath `directory`, so that it builds the whole site, rather than finding
+    what an earlier one wrote and measuring only leaving that be.
+    """
+    from django.conf import settings
+    from django.test.utils import override_settings
+
+    def setup(attempt):
+        path = os.path.join(
+            directory, "{stage}-{attempt}".format(stage=stage, attempt=attempt)
+        )
+        storage = settings.STORAGES["staticpub"]
+        options = dict(storage.get("OPTIONS", {}), location=os.path.join(path, "site"))
+        return override_settings(
+            STORAGES=dict(settings.STORAGES, staticpub=dict(storage, OPTIONS=options)),
+            STATICPUB_MANIFEST=os.path.join(path, "staticpub-manifest.json"),
+            STATICPUB_JOURNAL=os.path.join(path, "staticpub-journal.jsonl"),
+        )
+
+    return setup
+
+
+def run_benchmarks(processes=1, repeat=1, directory=None):
+    from django.conf import settings
+    from django.core.management import call_command
+    from staticpub.models import URLCollector, URLReader, URLWriter
+
+    if directory is None:
+        directory = settings.BASE_DIR
+
+    state = {}
+
+    def collect():
+        state["urls"] = tuple(URLCollector()())
+        return len(state["urls"])
+
+    def read():
+        state["read"] = tuple(URLReader(urls=state["urls"])())
+        return len(state["read"])
+
+    def write():
+        return len(tuple(URLWriter(data=state["read"])()))
+
+    def command():
+        call_command(
+            "collectstaticsite",
+            interactive=False,
+            verbosity=0,
+            processes=processes,
+            stdout=StringIO(),
+        )
+        return len(state["urls"])
+
+    return [
+        timed("collect", collect, repeat=repeat),
+        timed("read", read, repeat=repeat),
+        timed("write", write, repeat=repeat, setup=isolated("write", directory)),
+        timed(
+            "collectstaticsite",
+            command,
+            repeat=repeat,
+            setup=isolated("collectstaticsite", directory),
+        ),
+    ]
+
+
+def compare(results, previous, tolerance):
+    """
+    Yields a line per stage comparing pages/s against a previous run, and
+    whether it regressed by more than `tolerance` (a fraction).
+    """
+    before = {result["stage"]: result for result in previous["results"]}
+    for result in results:
+        old = before.get(result.stage)
+        if old is None or not old["pages_per_second"]:
+            continue
+        change = (result.pages_per_second - old["pages_per_second"]) / (
+            old["pages_per_second"]
+        )
+        yield (
+            "{stage:>18}: {old} -> {new} pages/s ({change:+.1%})".format(
+                stage=result.stage,
+                old=old["pages_per_second"],
+                new=result.pages_per_second,
+                change=change,
+            ),
+            change < -tolerance,
+        )
+
+
+def get_revision():
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL
+            )
+            .decode("ascii")
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_settings(options, directory):
+    """
+    The settings to benchmark with, keeping everything written, from the
+    database to the built site and its manifest, in `directory`.
+    """
+    if options.storage == "locmem":
+        staticpub_storage = {"BACKEND": "django.core.files.storage.InMemoryStorage"}
+    else:
+        staticpub_storage = {
+            "BACKEND": "django.core.files.storage.FileSystemStorage",
+            "OPTIONS": {"location": os.path.join(directory, "staticpub")},
+        }
+    return dict(
+        BASE_DIR=directory,
+        DEBUG=False,
+        SECRET_KEY="benchmarking_only",
+        ALLOWED_HOSTS=["testserver"],
+        ROOT_URLCONF="benchmarks.site",
+        DATABASES={
+            "default": {
+                "ENGINE": "django.db.backends.sqlite3",
+                "NAME": os.path.join(directory, "db.sqlite3"),
+            }
+        },
+        INSTALLED_APPS=("staticpub",),
+        MIDDLEWARE=("django.middleware.common.CommonMiddleware",),
+        TEMPLATES=[
+            {
+                "BACKEND": "django.template.backends.django.DjangoTemplates",
+                "APP_DIRS": True,
+                "DIRS": [os.path.join(ROOT_DIR, "test_templates")],
+            },
+        ],
+        STATICPUB_PRODUCERS=("benchmarks.site.producer",),
+        STATICPUB_BENCHMARK={
+            "pages": options.pages,
+            "page_size": options.page_size,
+            "queries": options.queries,
+        },
+        STORAGES={"staticpub": staticpub_storage},
+        STATICPUB_MANIFEST=os.path.join(directory, "staticpub-manifest.json"),
+        STATICPUB_JOURNAL=os.path.join(directory, "staticpub-journal.jsonl"),
+    )
+
+
+def configure(options, directory):
+    import django
+    from django.conf import settings
+
+    settings.configure(**get_settings(options, directory=directory))
+    django.setup()
+
+
+def get_parser():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pages", type=int, default=1000)
+    parser.add_argument("--page-size", type=int, default=10000)
+    parser.add_argument("--queries", type=int, default=2)
+    parser.add_argument("--storage", choices=("tmpdir", "locmem"), default="tmpdir")
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--compare", help="Compare the results against this JSON file")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="Fraction any stage's pages/s may drop by before --compare fails",
+    )
+    return parser
+
+
+def main(argv=None):
+    options = get_parser().parse_args(argv)
+    if options.storage == "locmem" and options.processes > 1:
+        raise SystemExit("locmem storage can't be shared between processes")
+
+    with tempfile.TemporaryDirectory(prefix="staticpub-benchmark-") as directory:
+        configure(options, directory=directory)
+        results = run_benchmarks(
+            processes=options.processes, repeat=options.repeat, directory=directory
+        )
+
+    for result in results:
+        print(
+            "{stage:>18}: {pages} pages in {seconds}s, {pages_per_second} pages/s, "
+            "peak RSS {peak_rss} KiB".format(**result._asdict())
+        )
+
+    output = {
+        "meta": {
+            "revision": get_revision(),
+            "python": platform.python_version(),
+            "options": vars(options),
+        },
+        "results": [result._asdict() for result in results],
+    }
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump(output, f, indent=2)
+
+    if options.compare:
+        with open(options.compare) as f:
+            previous = json.load(f)
+        regressed = False
+        for line, is_regression in compare(results, previous, options.tolerance):
+            print(line + (" REGRESSION" if is_regression else ""))
+            regressed = regressed or is_regression
+        if regressed:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
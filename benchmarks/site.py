@@ -0,0 +1,44 @@
+"""
+A synthetic site for benchmarking, shaped by `settings.STATICPUB_BENCHMARK`:
+
+- `pages` is the number of URLs the producer yields.
+- `page_size` is the approximate size of each response, in bytes.
+- `queries` is the number of database queries each view makes.
+"""
+
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse
+from django.urls import path
+
+DEFAULTS = {
+    "pages": 1000,
+    "page_size": 10000,
+    "queries": 2,
+}
+
+
+def get_option(name):
+    return getattr(settings, "STATICPUB_BENCHMARK", {}).get(name, DEFAULTS[name])
+
+
+def producer():
+    for number in range(get_option("pages")):
+        yield "/page/{number}/".format(number=number)
+
+
+def page(request, number):
+    with connection.cursor() as cursor:
+        for query in range(get_option("queries")):
+            cursor.execute("SELECT %s", [number + query])
+            cursor.fetchone()
+    line = "<p>Page {number} of the synthetic benchmark site.</p>\n".format(
+        number=number
+    )
+    body = line * max(1, get_option("page_size") // len(line))
+    return HttpResponse("<html><body>\n{body}</body></html>".format(body=body))
+
+
+urlpatterns = [
+    path("page/<int:number>/", page, name="benchmark_page"),
+]
@@ -4,9 +4,11 @@ from django.core.exceptions import PermissionDenied
 from django.template.response import TemplateResponse
 from django.utils.encoding import force_str
 from django.utils.translation import gettext_lazy as _
+from staticpub.models import BuildChanges
 from staticpub.models import ModelProducer
 from staticpub.models import URLReader
 from staticpub.models import URLWriter
+from staticpub.signals import build_finished
 
 
 def build_selected(modeladmin, request, queryset):
@@ -32,6 +34,10 @@ def build_selected(modeladmin, request, queryset):
         # backtrack at some point ... this would be it.
         read = tuple(URLReader(urls=instance_urls)())
         written = tuple(URLWriter(data=read)())
+        build_finished.send(
+            sender=build_selected,
+            changes=BuildChanges.from_write_results(written),
+        )
 
         n = len(written)
         modeladmin.message_user(
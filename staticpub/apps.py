@@ -8,6 +8,20 @@ class StaticpubAppConfig(AppConfig):
 
     def ready(self):
         from .checks import check_producers_setting, check_staticpub_storage_setting
+        from .checks import check_read_database_router
+        from .checks import PERFORMANCE_TAG
+        from .checks import check_debug
+        from .checks import check_dummy_cache
+        from .checks import check_slow_middleware
+        from .checks import check_template_loaders
 
         registry.register(check_producers_setting)
         registry.register(check_staticpub_storage_setting)
+        registry.register(check_read_database_router)
+        for check in (
+            check_debug,
+            check_template_loaders,
+            check_slow_middleware,
+            check_dummy_cache,
+        ):
+            registry.register(check, PERFORMANCE_TAG, deploy=True)
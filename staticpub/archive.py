@@ -0,0 +1,167 @@
+import hashlib
+from io import BytesIO
+import json
+import os
+import tarfile
+import threading
+import time
+import zipfile
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import Storage
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+from staticpub.manifest import MANIFEST_NAME
+
+__all__ = [
+    "ArchiveStorage",
+]
+
+FORMATS = (
+    (".tar.gz", "tar.gz"),
+    (".tgz", "tar.gz"),
+    (".tar.zst", "tar.zst"),
+    (".tar", "tar"),
+    (".zip", "zip"),
+)
+
+# already compressed, so not worth deflating again in a zip.
+STORED_EXTENSIONS = (".gz", ".br", ".zst")
+
+
+def guess_format(path):
+    """
+    >>> guess_format('site.tar.gz')
+    'tar.gz'
+    >>> guess_format('site.zip')
+    'zip'
+    """
+    for extension, archive_format in FORMATS:
+        if path.endswith(extension):
+            return archive_format
+    raise ImproperlyConfigured(
+        "Can't tell what sort of archive {path} should be, from its extension. "
+        "Use one of {extensions}".format(
+            path=path, extensions=", ".join(x for x, y in FORMATS)
+        )
+    )
+
+
+class ArchiveStorage(Storage):
+    """
+    A write-only storage which streams every file saved to it into a single
+    tar (optionally gzip or zstd compressed) or zip archive, in the order they
+    are saved, rather than writing each to disk separately.
+
+    The archive is written to `path` with `.partial` appended, and only moved
+    into place by `close`, which also adds the manifest to it. A file saved
+    more than once is added more than once; the last one wins when extracted.
+    """
+
+    def __init__(self, path, archive_format=None):
+        self.path = os.fspath(path)
+        self.archive_format = archive_format or guess_format(self.path)
+        if self.archive_format == "tar.zst" and zstandard is None:
+            raise ImproperlyConfigured(
+                "You need `zstandard` installed to write .tar.zst archives"
+            )
+        self.md5s = {}
+        self._lock = threading.Lock()
+        self._files = []
+        self._archive = self.open_archive()
+
+    def __repr__(self):
+        return "<%(mod)s.%(cls)s path=%(path)r files=%(files)d>" % {
+            "mod": self.__module__,
+            "cls": self.__class__.__name__,
+            "path": self.path,
+            "files": len(self.md5s),
+        }
+
+    @property
+    def partial_path(self):
+        return "{path}.partial".format(path=self.path)
+
+    def open_archive(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        if self.archive_format == "zip":
+            return zipfile.ZipFile(self.partial_path, "w", zipfile.ZIP_DEFLATED)
+        fileobj = open(self.partial_path, "wb")
+        self._files.append(fileobj)
+        if self.archive_format == "tar.zst":
+            fileobj = zstandard.ZstdCompressor().stream_writer(fileobj)
+            self._files.append(fileobj)
+            return tarfile.open(fileobj=fileobj, mode="w|")
+        if self.archive_format == "tar.gz":
+            return tarfile.open(fileobj=fileobj, mode="w|gz")
+        return tarfile.open(fileobj=fileobj, mode="w|")
+
+    def add(self, name, data):
+        if self.archive_format == "zip":
+            info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+            info.external_attr = 0o644 << 16
+            info.compress_type = zipfile.ZIP_DEFLATED
+            if name.endswith(STORED_EXTENSIONS):
+                info.compress_type = zipfile.ZIP_STORED
+            self._archive.writestr(info, data)
+        else:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = time.time()
+            info.mode = 0o644
+            self._archive.addfile(info, fileobj=BytesIO(data))
+
+    def _save(self, name, content):
+        data = content.read()
+        with self._lock:
+            self.add(name, data)
+            self.md5s[name] = hashlib.md5(data).hexdigest()
+        return name
+
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def exists(self, name):
+        return name in self.md5s
+
+    def get_md5(self, name):
+        return self.md5s[name]
+
+    def link(self, existing, name):
+        # a tar may record a hard link to a member already in it; a zip can't.
+        if self.archive_format == "zip":
+            return False
+        with self._lock:
+            if existing not in self.md5s:
+                return False
+            info = tarfile.TarInfo(name)
+            info.type = tarfile.LNKTYPE
+            info.linkname = existing
+            info.mtime = time.time()
+            info.mode = 0o644
+            self._archive.addfile(info)
+            self.md5s[name] = self.md5s[existing]
+        return True
+
+    def delete(self, name):
+        # it can't be taken out again, but a replacement may be added.
+        self.md5s.pop(name, None)
+
+    def close(self, manifest=None):
+        """
+        Adds the manifest, finishes the archive and moves it into place.
+        """
+        with self._lock:
+            if manifest is not None:
+                data = json.dumps(manifest.as_dict(), indent=1).encode("utf-8")
+                self.add(MANIFEST_NAME, data)
+            self._archive.close()
+            for fileobj in reversed(self._files):
+                if not fileobj.closed:
+                    fileobj.close()
+        os.replace(self.partial_path, self.path)
+        return self.path
@@ -0,0 +1,95 @@
+"""
+Many of the files a build writes have exactly the same content as another,
+eg: the same empty listing on every paginated URL, or the same page in each
+language. `URLWriter` remembers the first file it wrote with each distinct
+content, and links any other file with that content to it, where the storage
+allows, rather than writing (or uploading, or compressing) the same bytes
+again.
+"""
+
+from contextlib import suppress
+import os
+
+from staticpub.utils import build_scoped
+
+__all__ = [
+    "BlobIndex",
+    "link_file",
+]
+
+
+class BlobIndex(object):
+    """
+    The first file written with each distinct content (by its md5) during a
+    build, and the (extension, md5) of each compressed sibling of it.
+    """
+
+    __slots__ = ("names", "written", "siblings")
+
+    def __init__(self):
+        self.names = {}
+        self.written = {}
+        self.siblings = {}
+
+    def __repr__(self):
+        return "<%(mod)s.%(cls)s blobs=%(blobs)d files=%(files)d>" % {
+            "mod": self.__module__,
+            "cls": self.__class__.__name__,
+            "blobs": len(self.names),
+            "files": len(self.written),
+        }
+
+    @classmethod
+    def for_build(cls, build_id):
+        """
+        The index shared by every writer in this process during one build,
+        so that a process writing several chunks of a build may link to
+        files it wrote for an earlier one.
+        """
+        return build_scoped(cls, build_id)
+
+    def find(self, md5, name):
+        """
+        Another file with the same content as `name` is to have, if any.
+        """
+        existing = self.names.get(md5)
+        if existing == name:
+            return None
+        return existing
+
+    def add(self, md5, name):
+        previous = self.written.get(name)
+        if previous is not None and previous != md5:
+            # its old content can't be linked to any more.
+            if self.names.get(previous) == name:
+                del self.names[previous]
+        self.written[name] = md5
+        self.names.setdefault(md5, name)
+
+
+def link_file(storage, existing, name):
+    """
+    Makes `name` a copy of `existing` without writing its content again, if
+    the storage can, returning whether it did. A storage with a
+    `link(existing, name)` method (eg: one which can copy objects on the
+    server) is asked to; a storage of local files gets a hard link.
+    """
+    link = getattr(storage, "link", None)
+    if link is not None:
+        return bool(link(existing, name))
+    try:
+        source = storage.path(existing)
+        target = storage.path(name)
+    except (AttributeError, NotImplementedError):
+        return False
+    # linked beside the target and moved over it, so that it's never missing.
+    partial = "{target}.link".format(target=target)
+    try:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.link(source, partial)
+        os.replace(partial, target)
+    except OSError:
+        with suppress(OSError):
+            os.remove(partial)
+        return False
+    return True
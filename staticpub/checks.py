@@ -1,3 +1,5 @@
+from time import perf_counter
+
 from django.core.checks import Warning
 from django.core.checks import Error
 
@@ -68,3 +70,147 @@ def check_staticpub_storage_setting(app_configs, **kwargs):
                 )
             )
     return errors
+
+
+def check_read_database_router(app_configs, **kwargs):
+    from django.conf import settings
+    from staticpub.db import is_router_installed
+
+    errors = []
+    alias = getattr(settings, "STATICPUB_READ_DATABASE", None)
+    if alias is not None and not is_router_installed():
+        errors.append(
+            Error(
+                msg="STATICPUB_READ_DATABASE is set, but reads can't be sent to "
+                "%r without staticpub's router" % alias,
+                hint="Put 'staticpub.db.BuildRouter' first in DATABASE_ROUTERS",
+                id="staticpub.E005",
+            )
+        )
+    return errors
+
+
+# checks for settings which don't break a build, but make it slower than it
+# needs to be. Being deployment checks, `manage.py check` only runs them with
+# `--deploy --tag staticpub_performance`; collectstaticsite always does.
+PERFORMANCE_TAG = "staticpub_performance"
+
+# middleware which is known to do a lot of work for every page.
+SLOW_MIDDLEWARE = {
+    "debug_toolbar.middleware.DebugToolbarMiddleware": "renders a toolbar into "
+    "every page, and records every query and template to do so",
+    "silk.middleware.SilkyMiddleware": "saves every request, and each query it "
+    "made, to the database",
+}
+
+
+def check_debug(app_configs, **kwargs):
+    from django.conf import settings
+
+    errors = []
+    if settings.DEBUG:
+        errors.append(
+            Warning(
+                msg="DEBUG is True, so every query made while building is logged",
+                hint="Set DEBUG = False in the settings used to build the site",
+                id="staticpub.W101",
+            )
+        )
+    return errors
+
+
+def check_template_loaders(app_configs, **kwargs):
+    from django.template import engines
+    from django.template.backends.django import DjangoTemplates
+    from django.template.loaders.cached import Loader as CachedLoader
+
+    errors = []
+    for backend in engines.all():
+        if not isinstance(backend, DjangoTemplates):
+            continue
+        loaders = backend.engine.template_loaders
+        if not any(isinstance(loader, CachedLoader) for loader in loaders):
+            errors.append(
+                Warning(
+                    msg="The %s template engine doesn't cache templates, so "
+                    "they're compiled again for every page" % backend.name,
+                    hint="Wrap its OPTIONS['loaders'] in "
+                    "django.template.loaders.cached.Loader, or leave them unset",
+                    id="staticpub.W102",
+                )
+            )
+    return errors
+
+
+def check_slow_middleware(app_configs, **kwargs):
+    from django.conf import settings
+
+    errors = []
+    for middleware in settings.MIDDLEWARE:
+        if middleware in SLOW_MIDDLEWARE:
+            errors.append(
+                Warning(
+                    msg="%s %s" % (middleware, SLOW_MIDDLEWARE[middleware]),
+                    hint="Remove it from MIDDLEWARE in the settings used to "
+                    "build the site",
+                    id="staticpub.W103",
+                )
+            )
+    return errors
+
+
+def check_dummy_cache(app_configs, **kwargs):
+    from django.conf import settings
+
+    errors = []
+    for alias, config in settings.CACHES.items():
+        if config.get("BACKEND") == "django.core.cache.backends.dummy.DummyCache":
+            errors.append(
+                Warning(
+                    msg="The %r cache is a dummy, so anything cached with it is "
+                    "worked out again for every page" % alias,
+                    hint="Use another backend while building, or cache what "
+                    "every page shares with staticpub.memo.build_cached",
+                    id="staticpub.W104",
+                )
+            )
+    return errors
+
+
+def time_reads(urls, repeat=3):
+    """
+    The fewest seconds it took to read all of `urls`, out of `repeat` tries,
+    after reading them once to warm up.
+    """
+    from staticpub.models import URLReader
+
+    tuple(URLReader(urls=urls)())
+    fastest = None
+    for attempt in range(repeat):
+        started = perf_counter()
+        tuple(URLReader(urls=urls)())
+        duration = perf_counter() - started
+        if fastest is None or duration < fastest:
+            fastest = duration
+    return fastest
+
+
+def time_middleware(urls, repeat=3):
+    """
+    Yields each of `MIDDLEWARE`, how long reading `urls` took with all of it,
+    and how long without that one, or None if the pages couldn't be read
+    without it.
+    """
+    from django.conf import settings
+    from django.test.utils import override_settings
+
+    middlewares = tuple(settings.MIDDLEWARE)
+    baseline = time_reads(urls, repeat=repeat)
+    for middleware in middlewares:
+        others = [x for x in middlewares if x != middleware]
+        with override_settings(MIDDLEWARE=others):
+            try:
+                without = time_reads(urls, repeat=repeat)
+            except Exception:
+                without = None
+        yield middleware, baseline, without
@@ -0,0 +1,98 @@
+import gzip
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+__all__ = [
+    "Precompressor",
+]
+
+
+def gzip_compress(content):
+    # a fixed mtime, so the same content always compresses to the same bytes.
+    return gzip.compress(content, compresslevel=9, mtime=0)
+
+
+def brotli_compress(content):
+    return brotli.compress(content)
+
+
+ENCODINGS = {
+    "gzip": (".gz", gzip_compress),
+    "br": (".br", brotli_compress),
+}
+
+
+def get_default_encodings():
+    if brotli is None:  # pragma: no cover
+        return ("gzip",)
+    return ("gzip", "br")
+
+
+class Precompressor(object):
+    """
+    Compresses pages as they are written, so that they may be served with
+    nginx's `gzip_static` and `brotli_static`. Pages smaller than `min_size`
+    bytes, or which would get no smaller, are left alone.
+    """
+
+    __slots__ = ("encodings", "min_size", "threads")
+
+    def __init__(self, encodings=None, min_size=1024, threads=4):
+        if encodings is None:
+            encodings = get_default_encodings()
+        for encoding in encodings:
+            if encoding not in ENCODINGS:
+                raise ImproperlyConfigured(
+                    "Can't precompress using {encoding!r}, only {known}".format(
+                        encoding=encoding, known=", ".join(sorted(ENCODINGS))
+                    )
+                )
+            if encoding == "br" and brotli is None:  # pragma: no cover
+                raise ImproperlyConfigured(
+                    "You need `brotli` installed to precompress using 'br'"
+                )
+        self.encodings = tuple(encodings)
+        self.min_size = min_size
+        self.threads = threads
+
+    def __repr__(self):
+        return "<%(mod)s.%(cls)s encodings=%(encodings)r min_size=%(size)d>" % {
+            "mod": self.__module__,
+            "cls": self.__class__.__name__,
+            "encodings": self.encodings,
+            "size": self.min_size,
+        }
+
+    @classmethod
+    def from_settings(cls):
+        """
+        `STATICPUB_PRECOMPRESS` may be True, or a dictionary of arguments.
+        """
+        value = getattr(settings, "STATICPUB_PRECOMPRESS", None)
+        if not value:
+            return None
+        if value is True:
+            return cls()
+        return cls(**value)
+
+    def extensions(self):
+        return tuple(ENCODINGS[encoding][0] for encoding in self.encodings)
+
+    def compress(self, content):
+        """
+        Yields the extension and compressed content for each encoding which
+        is worth having.
+        """
+        if len(content) < self.min_size:
+            return
+        for encoding in self.encodings:
+            extension, func = ENCODINGS[encoding]
+            compressed = func(content)
+            if len(compressed) < len(content):
+                yield extension, compressed
@@ -0,0 +1,296 @@
+"""
+A long running process which builds pages on request, so that rebuilding a
+few of them doesn't pay for starting Django, and warming up, every time.
+
+Requests and responses are lines of JSON, over a Unix socket. A request names
+`urls` to build, and/or `objects`, as `app_label.model_name:pk`, whose URLs
+should be built:
+
+    {"urls": ["/about/"], "objects": ["blog.post:12"]}
+
+Each file written is sent back as it's written, as is each URL which failed,
+followed by what changed:
+
+    {"event": "written", "name": "about/index.html", "created": false, ...}
+    {"event": "failed", "url": "/blog/12/", "error": "..."}
+    {"event": "done", "changes": {"created": [], ...}, "duration": 0.04}
+
+A request which can't be understood gets an `error` event instead.
+`{"ping": true}` gets a `pong`.
+"""
+
+from contextlib import closing
+from contextlib import suppress
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import socketserver
+import threading
+from time import perf_counter
+
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import close_old_connections
+from django.db import connections
+
+from staticpub.models import BuildChanges
+from staticpub.models import InstanceProducer
+from staticpub.models import URLReader
+from staticpub.models import URLWriter
+from staticpub.signals import build_finished
+from staticpub.utils import chunked
+from staticpub.utils import max_tasks_per_process
+from staticpub.warmup import initialize_worker
+from staticpub.warmup import warm_up
+
+__all__ = [
+    "BuildDaemon",
+    "DaemonError",
+    "get_default_socket_path",
+    "request_build",
+]
+
+logger = logging.getLogger(__name__)
+
+
+class DaemonError(ValueError):
+    pass
+
+
+def get_default_socket_path():
+    path = getattr(settings, "STATICPUB_DAEMON_SOCKET", None)
+    if path is None:
+        base_dir = getattr(settings, "BASE_DIR", os.getcwd())
+        path = os.path.join(base_dir, "var", "staticpubd.sock")
+    return os.fspath(path)
+
+
+def get_instances(references):
+    """
+    The model instances referred to as `app_label.model_name:pk`.
+    """
+    for reference in references:
+        try:
+            label, pk = reference.rsplit(":", 1)
+            model = apps.get_model(label)
+        except (AttributeError, ValueError, LookupError):
+            raise DaemonError(
+                "{reference!r} isn't a model instance, which should look like "
+                "app_label.model_name:pk".format(reference=reference)
+            )
+        try:
+            yield model._default_manager.get(pk=pk)
+        except (ObjectDoesNotExist, ValueError):
+            raise DaemonError(
+                "There's no {reference!r} to build".format(reference=reference)
+            )
+
+
+def build_urls(urls):
+    """
+    Reads and writes some URLs, as done in the daemon's process or one of its
+    pool, returning what was written, and the URLs which couldn't be read.
+    """
+    reader = URLReader(urls=urls, fail_soft=True)
+    read = tuple(x for x in reader() if x is not None)
+    written = tuple(URLWriter(data=read)())
+    return written, tuple(reader.failures)
+
+
+class BuildDaemon(object):
+    """
+    Builds the URLs it's asked to, `chunk_size` at a time, in this process or
+    a pool of `processes`, which are warmed up once and kept, until each has
+    built `max_pages`, if that's set.
+    """
+
+    __slots__ = (
+        "path",
+        "processes",
+        "chunk_size",
+        "max_pages",
+        "pool",
+        "server",
+        "_lock",
+    )
+
+    def __init__(self, path=None, processes=1, chunk_size=10, max_pages=None):
+        self.path = os.fspath(path or get_default_socket_path())
+        self.processes = processes
+        self.chunk_size = chunk_size
+        self.max_pages = max_pages
+        self.pool = None
+        self.server = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "<%(mod)s.%(cls)s path=%(path)r processes=%(processes)d>" % {
+            "mod": self.__module__,
+            "cls": self.__class__.__name__,
+            "path": self.path,
+            "processes": self.processes,
+        }
+
+    def start(self):
+        """
+        Warms up, starts the pool, if there is one, and listens on the socket.
+        """
+        warmup = warm_up()
+        if self.processes > 1:
+            # forked processes mustn't share the connections of this one.
+            connections.close_all()
+            self.pool = multiprocessing.get_context().Pool(
+                processes=self.processes,
+                initializer=initialize_worker,
+                maxtasksperchild=max_tasks_per_process(self.max_pages, self.chunk_size),
+            )
+        self.server = DaemonServer(self.path, daemon=self)
+        return warmup
+
+    def serve_forever(self):
+        try:
+            self.server.serve_forever()
+        finally:
+            self.close()
+
+    def close(self):
+        if self.server is not None:
+            self.server.server_close()
+            with suppress(FileNotFoundError):
+                os.remove(self.path)
+            self.server = None
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def build(self, urls):
+        """
+        Yields an event for each file written, and each URL which couldn't be
+        read, as soon as the chunk they were in is done, then what changed.
+        """
+        started = perf_counter()
+        chunks = tuple(chunked(urls, self.chunk_size))
+        if self.pool is not None:
+            results = self.pool.imap_unordered(build_urls, chunks)
+        else:
+            results = (build_urls(chunk) for chunk in chunks)
+        write_results = []
+        for written, failures in results:
+            for write_result in written:
+                write_results.append(write_result)
+                yield {
+                    "event": "written",
+                    "name": write_result.name,
+                    "created": write_result.created,
+                    "modified": write_result.modified,
+                    "md5": write_result.md5,
+                }
+            for failure in failures:
+                yield {"event": "failed", "url": failure.url, "error": failure.error}
+        changes = BuildChanges.from_write_results(write_results)
+        build_finished.send(sender=self.__class__, changes=changes)
+        yield {
+            "event": "done",
+            "changes": {key: list(names) for key, names in changes._asdict().items()},
+            "duration": perf_counter() - started,
+        }
+
+    def handle(self, request):
+        """
+        Yields the events in response to a request; only one is built at a
+        time.
+        """
+        if not isinstance(request, dict):
+            yield {"event": "error", "error": "A request should be a JSON object"}
+            return
+        if request.get("ping"):
+            yield {"event": "pong"}
+            return
+        with self._lock:
+            close_old_connections()
+            try:
+                urls = list(request.get("urls", ()))
+                instances = tuple(get_instances(request.get("objects", ())))
+                if instances:
+                    urls.extend(InstanceProducer(instances=instances)())
+            except DaemonError as e:
+                yield {"event": "error", "error": str(e)}
+                return
+            try:
+                yield from self.build(urls)
+            finally:
+                close_old_connections()
+
+
+class DaemonRequestHandler(socketserver.StreamRequestHandler):
+    def send(self, event):
+        self.wfile.write(json.dumps(event).encode("utf-8") + b"\n")
+        self.wfile.flush()
+
+    def handle(self):
+        # a client may send several requests, one line each, before closing.
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line.decode("utf-8"))
+            except ValueError as e:
+                self.send({"event": "error", "error": "Not JSON: %s" % e})
+                continue
+            try:
+                for event in self.server.daemon.handle(request):
+                    self.send(event)
+            except (BrokenPipeError, ConnectionResetError):
+                # nobody is listening any more.
+                return
+            except Exception as e:
+                logger.error("Unable to build {line!r}".format(line=line), exc_info=1)
+                self.send({"event": "error", "error": str(e)})
+
+
+class DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, daemon):
+        self.daemon = daemon
+        if os.path.exists(path):
+            if is_listening(path):
+                raise DaemonError(
+                    "Something is already listening on {path}".format(path=path)
+                )
+            # left behind by a daemon which didn't shut down cleanly.
+            os.remove(path)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        super().__init__(path, DaemonRequestHandler)
+        os.chmod(path, 0o600)
+
+
+def is_listening(path):
+    with closing(socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)) as sock:
+        try:
+            sock.connect(path)
+        except OSError:
+            return False
+    return True
+
+
+def request_build(urls=(), objects=(), path=None, timeout=None):
+    """
+    Asks a running daemon to build some URLs and/or model instances, yielding
+    each event it sends back until it's done.
+    """
+    request = {"urls": list(urls), "objects": list(objects)}
+    with closing(socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path or get_default_socket_path())
+        sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        with sock.makefile("rb") as responses:
+            for line in responses:
+                event = json.loads(line.decode("utf-8"))
+                yield event
+                if event["event"] in ("done", "error"):
+                    return
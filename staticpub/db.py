@@ -0,0 +1,130 @@
+"""
+A full build reads every page of a site, and so makes a lot of queries, which
+may be better sent to a read replica than to the database the site is being
+edited on. While `read_from` is in use, `BuildRouter` sends every read which
+hasn't been given a database to the one named, and leaves writes to the
+routers after it in `DATABASE_ROUTERS`, where it must be put first. Only the
+thread using `read_from` is affected, so that any other (eg: one serving
+requests) reads from wherever it did.
+
+Processes forked to read pages also start with the connections their parent
+had open, which mustn't be used by both; `forget_connections` leaves those to
+the parent, so that each process opens its own, and keeps it for as long as
+it lives.
+"""
+
+from contextlib import contextmanager
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS
+from django.db import connections as default_connections
+from django.db import router
+
+__all__ = [
+    "BuildRouter",
+    "get_read_database",
+    "is_router_installed",
+    "read_from",
+    "forget_connections",
+]
+
+_local = threading.local()
+
+# the connections inherited from a parent process, which are kept from being
+# garbage collected, as some drivers would tell the server they're closing.
+_inherited = []
+
+
+def get_read_database():
+    """
+    The `STATICPUB_READ_DATABASE` setting, which names the database alias in
+    `DATABASES` to read from while building, if not the usual one.
+    """
+    return getattr(settings, "STATICPUB_READ_DATABASE", None)
+
+
+def get_active():
+    """
+    The databases being read from in this thread, innermost last.
+    """
+    try:
+        return _local.active
+    except AttributeError:
+        _local.active = []
+        return _local.active
+
+
+class BuildRouter(object):
+    """
+    Sends reads to the database being built from, if there is one. Goes first
+    in `DATABASE_ROUTERS`, so it may decide before any other router does.
+    """
+
+    def db_for_read(self, model, **hints):
+        active = get_active()
+        if not active:
+            return None
+        return active[-1]
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # an object read from the replica may be related to one written to
+        # the primary, as they're the same data.
+        active = get_active()
+        if not active:
+            return None
+        databases = {active[-1], router.db_for_write(obj1.__class__)}
+        if {obj1._state.db, obj2._state.db} <= databases:
+            return True
+        return None
+
+
+def is_router_installed():
+    return any(isinstance(x, BuildRouter) for x in router.routers)
+
+
+@contextmanager
+def read_from(alias):
+    """
+    Sends reads made inside the block, in this thread, to the database
+    `alias`, or, if it's None, wherever they'd go anyway.
+    """
+    if alias is None:
+        yield None
+        return
+    if not is_router_installed():
+        raise ImproperlyConfigured(
+            "Reading from {alias!r} needs 'staticpub.db.BuildRouter' first in "
+            "DATABASE_ROUTERS".format(alias=alias)
+        )
+    active = get_active()
+    active.append(alias)
+    try:
+        yield alias
+    finally:
+        active.pop()
+
+
+def is_in_memory(connection):
+    is_in_memory_db = getattr(connection, "is_in_memory_db", None)
+    return is_in_memory_db is not None and is_in_memory_db()
+
+
+def forget_connections(connections=None):
+    """
+    Run in a process which was forked, so that any connection open in the
+    parent is left for it to use, rather than shared, and a new one is opened
+    when it's next needed. An in-memory SQLite database only exists in the
+    connection to it, so that is kept.
+    """
+    if connections is None:
+        connections = default_connections
+    forgotten = 0
+    for connection in connections.all(initialized_only=True):
+        if connection.connection is None or is_in_memory(connection):
+            continue
+        _inherited.append(connection.connection)
+        connection.connection = None
+        forgotten += 1
+    return forgotten
@@ -0,0 +1,196 @@
+from collections import namedtuple
+from contextlib import contextmanager
+import cProfile
+import hashlib
+import os
+import re
+import sys
+import tracemalloc
+
+from staticpub.signals import read_page
+
+__all__ = [
+    "PageProfiler",
+    "MemoryTracker",
+    "ProcessMemory",
+    "get_rss",
+]
+
+
+def profile_filename(url):
+    """
+    Named after the URL, readably, and with a short hash of it, as different
+    URLs may read the same, eg: /a/b/ and /a_b/.
+
+    >>> profile_filename('/')
+    'index-6666cd76.prof'
+    >>> profile_filename('/a/b c/feed.xml')
+    'a__b_c__feed.xml-79873ade.prof'
+    """
+    name = url.strip("/").replace("/", "__")
+    name = re.sub(r"[^\w.-]+", "_", name)
+    digest = hashlib.md5(url.encode("utf-8")).hexdigest()[:8]
+    return "{name}-{digest}.prof".format(name=name or "index", digest=digest)
+
+
+class PageProfiler(object):
+    """
+    While in use as a context manager, any page which took longer than
+    `threshold` seconds to read is read once more under cProfile, and the
+    profile saved into `directory` as a .prof file named after the URL.
+    """
+
+    __slots__ = ("threshold", "directory", "profiled")
+
+    def __init__(self, threshold, directory):
+        self.threshold = threshold
+        self.directory = directory
+        self.profiled = []
+
+    def __repr__(self):
+        return "<%(mod)s.%(cls)s threshold=%(threshold)r directory=%(dir)r>" % {
+            "mod": self.__module__,
+            "cls": self.__class__.__name__,
+            "threshold": self.threshold,
+            "dir": self.directory,
+        }
+
+    def __enter__(self):
+        read_page.connect(self.record_read, weak=False)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        read_page.disconnect(self.record_read)
+
+    def profile(self, reader, url):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, profile_filename(url))
+        profile = cProfile.Profile()
+        profile.runcall(
+            reader.client.get, url, follow=True, **{"HTTP_USER_AGENT": "staticpub"}
+        )
+        profile.dump_stats(path)
+        self.profiled.append(path)
+        return path
+
+    def record_read(self, sender, instance, url, response, filename, **kwargs):
+        duration = kwargs.get("duration")
+        if url is None or duration is None or duration < self.threshold:
+            return None
+        return self.profile(reader=instance, url=url)
+
+
+class MemoryTracker(object):
+    """
+    Records the peak memory traced by tracemalloc during each named stage.
+    """
+
+    __slots__ = ("peaks",)
+
+    def __init__(self, peaks=None):
+        self.peaks = dict(peaks or {})
+
+    def __repr__(self):
+        return "<%(mod)s.%(cls)s peaks=%(peaks)r>" % {
+            "mod": self.__module__,
+            "cls": self.__class__.__name__,
+            "peaks": self.peaks,
+        }
+
+    @contextmanager
+    def stage(self, name):
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        elif hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        try:
+            yield self
+        finally:
+            current, peak = tracemalloc.get_traced_memory()
+            self.peaks[name] = max(self.peaks.get(name, 0), peak)
+            if started:
+                tracemalloc.stop()
+
+    def update(self, peaks):
+        """
+        Merges peaks recorded elsewhere, eg: in another process, keeping the
+        largest for each stage.
+        """
+        for name, peak in dict(peaks).items():
+            self.peaks[name] = max(self.peaks.get(name, 0), peak)
+        return self
+
+    def report(self):
+        for name, peak in self.peaks.items():
+            yield "Peak memory while {stage}: {size:.1f} MiB".format(
+                stage=name, size=peak / (1024 * 1024)
+            )
+
+
+def get_rss():
+    """
+    The resident memory of this process in bytes, or, where that can't be
+    read (ie: without /proc), the most it has been, or None on platforms
+    with neither.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:  # pragma: no cover
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # in kilobytes, except on macOS.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class ProcessUsage(namedtuple("ProcessUsage", "rss peak pages")):
+    __slots__ = ()
+
+
+class ProcessMemory(object):
+    """
+    The resident memory of each process which read or wrote pages, as of the
+    last chunk it finished, the most it was seen to be, and how many pages
+    it had done, by process id.
+    """
+
+    __slots__ = ("processes",)
+
+    def __init__(self, processes=None):
+        self.processes = dict(processes or {})
+
+    def __repr__(self):
+        return "<%(mod)s.%(cls)s processes=%(processes)d>" % {
+            "mod": self.__module__,
+            "cls": self.__class__.__name__,
+            "processes": len(self.processes),
+        }
+
+    def __len__(self):
+        return len(self.processes)
+
+    def record(self, pid, rss, pages):
+        if rss is None:
+            return self
+        previous = self.processes.get(pid, ProcessUsage(rss=0, peak=0, pages=0))
+        self.processes[pid] = ProcessUsage(
+            rss=rss, peak=max(previous.peak, rss), pages=previous.pages + pages
+        )
+        return self
+
+    def report(self):
+        for pid, usage in sorted(self.processes.items()):
+            yield (
+                "Process {pid}: {rss:.1f} MiB resident after {pages} pages "
+                "(peak {peak:.1f} MiB)".format(
+                    pid=pid,
+                    rss=usage.rss / (1024 * 1024),
+                    pages=usage.pages,
+                    peak=usage.peak / (1024 * 1024),
+                )
+            )
@@ -0,0 +1,85 @@
+import json
+import logging
+import os
+
+from django.conf import settings
+
+from staticpub.manifest import pages_written
+
+__all__ = [
+    "BuildJournal",
+]
+logger = logging.getLogger(__name__)
+
+
+def get_default_journal_path():
+    path = getattr(settings, "STATICPUB_JOURNAL", None)
+    if path is None:
+        base_dir = getattr(settings, "BASE_DIR", os.getcwd())
+        path = os.path.join(base_dir, "var", "staticpub-journal.jsonl")
+    return os.fspath(path)
+
+
+class BuildJournal(object):
+    """
+    An append-only record of the URLs which have been both read and written,
+    one JSON object per line, so that an interrupted build may be resumed
+    without reading and writing them all over again.
+    """
+
+    __slots__ = ("path",)
+
+    def __init__(self, path=None):
+        if path is None:
+            path = get_default_journal_path()
+        self.path = os.fspath(path)
+
+    def __repr__(self):
+        return "<%(mod)s.%(cls)s path=%(path)r>" % {
+            "mod": self.__module__,
+            "cls": self.__class__.__name__,
+            "path": self.path,
+        }
+
+    def entries(self):
+        try:
+            f = open(self.path, "r")
+        except FileNotFoundError:
+            return
+        with f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # most likely the last line, written as the build died.
+                    logger.warning(
+                        "Ignoring unreadable line in {path}".format(path=self.path)
+                    )
+
+    def reset(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "w"):
+            pass
+
+    def record(self, urls, write_results):
+        entry = {
+            "urls": sorted(urls),
+            "written": sorted([x.name, x.md5] for x in write_results),
+            "pages": {
+                url: sorted(names)
+                for url, names in sorted(pages_written(write_results).items())
+            },
+        }
+        # eg: when resuming a build which died before it started one.
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "a") as f:
+            f.write(json.dumps(entry))
+            f.write("\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def delete(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
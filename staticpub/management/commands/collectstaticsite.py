@@ -1,44 +1,124 @@
 from collections import namedtuple
+from contextlib import ExitStack
+from contextlib import contextmanager
+from contextlib import nullcontext
+from functools import partial
 
+import hashlib
 from itertools import chain
+import json
 import multiprocessing
+import os
 import sys
+import time
+from time import perf_counter
+from uuid import uuid4
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import FileSystemStorage
+from django.core.files.storage import storages
 from django.core.management import BaseCommand
 from django.core.management import CommandError
 from django.core.management.base import OutputWrapper
+from django.db import connections
 from django.test.utils import override_settings
+from django.urls import re_path
+from django.utils.encoding import force_bytes
 from django.utils.encoding import force_str
 from django.utils import timezone
 
+from staticpub.archive import ArchiveStorage
+from staticpub.blobs import BlobIndex
+from staticpub.checks import PERFORMANCE_TAG
+from staticpub.checks import time_middleware
+from staticpub.compression import Precompressor
+from staticpub.db import get_read_database
+from staticpub.db import is_router_installed
+from staticpub.db import read_from
+from staticpub.diagnostics import MemoryTracker
+from staticpub.diagnostics import PageProfiler
+from staticpub.diagnostics import ProcessMemory
+from staticpub.diagnostics import get_rss
+from staticpub.journal import BuildJournal
+from staticpub.journal import get_default_journal_path
+from staticpub.manifest import Manifest
+from staticpub.manifest import ManifestError
+from staticpub.manifest import delete_orphans
+from staticpub.manifest import describe_storage
+from staticpub.manifest import Shard
+from staticpub.manifest import get_default_manifest_path
+from staticpub.manifest import pages_written
+from staticpub.manifest import urls_digest
+from staticpub.memo import BuildCache
+from staticpub.metrics import BuildMetrics
 from staticpub.models import (
     URLCollector,
     URLReader,
     URLWriter,
     ErrorReader,
     CollectionError,
+    BuildChanges,
+    RedirectPages,
 )
+from staticpub.preview import PreviewIndex
+from staticpub.progress import Progress
+from staticpub.preview import StoragePreview
 from staticpub.signals import build_started
 from staticpub.signals import build_finished
+from staticpub.signals import read_page_failed
+from staticpub.subset import SubsetError
+from staticpub.subset import URLFilter
+from staticpub.subset import read_url_file
+from staticpub.subset import select_producers
+from staticpub.utils import chunked
+from staticpub.utils import end_build
+from staticpub.utils import is_url_usable
+from staticpub.utils import max_tasks_per_process
+from staticpub.warmup import FORKSERVER_PRELOAD
+from staticpub.warmup import initialize_worker
+from staticpub.warmup import warm_up
 
 
-def multiprocess_reader(urls, stdout=None):
+def multiprocess_reader(
+    urls, stdout=None, verbosity=2, fail_soft=False, timeout=None, build_id=None
+):
     stdout = OutputWrapper(stdout or sys.stdout)
-    result = URLReader(urls=urls)()
+    redirects = cache = None
+    if build_id is not None:
+        redirects = RedirectPages.for_build(build_id)
+        cache = BuildCache.for_build(build_id)
+    result = URLReader(
+        urls=urls,
+        fail_soft=fail_soft,
+        timeout=timeout,
+        redirects=redirects,
+        cache=cache,
+    )()
     out = set()
     for built_result in result:
         out.add(built_result)
-        stdout.write("Read {}".format(built_result.url))
+        if verbosity > 1:
+            stdout.write("Read {}".format(built_result.url))
     return out
 
 
-def multiprocess_writer(data, stdout=None):
+def multiprocess_writer(
+    data, stdout=None, verbosity=2, storage=None, build_id=None, previous=None
+):
+    """
+    Writes `data`, comparing it against the files listed in the `previous`
+    build's manifest (a path), if given, rather than reading them back.
+    """
     stdout = OutputWrapper(stdout or sys.stdout)
-    result = URLWriter(data=data)()
+    blobs = BlobIndex.for_build(build_id) if build_id is not None else None
+    if previous is not None:
+        previous = Manifest.for_build(previous, build_id).files
+    result = URLWriter(data=data, storage=storage, blobs=blobs, previous=previous)()
     out = set()
     for built_result in result:
         out.add(built_result)
+        if verbosity < 2:
+            continue
         if built_result.created:
             stdout.write("Created {}".format(built_result.name))
         elif built_result.modified:
@@ -46,6 +126,157 @@ def multiprocess_writer(data, stdout=None):
     return out
 
 
+def content_size(read_results):
+    return sum(len(x.content) for x in read_results if x is not None)
+
+
+@contextmanager
+def phase(name, timings, memory=None):
+    """
+    Adds the time taken by the block to `timings[name]`, and, if given a
+    MemoryTracker, traces its peak memory as the stage `name`.
+    """
+    started = perf_counter()
+    with memory.stage(name) if memory is not None else nullcontext():
+        yield
+    timings[name] = timings.get(name, 0) + perf_counter() - started
+
+
+def run_stage(
+    stage,
+    data,
+    stdout=None,
+    verbosity=2,
+    fail_soft=False,
+    timeout=None,
+    build_id=None,
+    previous=None,
+    timings=None,
+    memory=None,
+):
+    """
+    Reads URLs, writes ReadResults, or both reads and writes URLs, returning
+    the results and the number of bytes of content dealt with. The time
+    spent reading and writing is added to `timings`, and their peak memory
+    traced by `memory`, if given.
+    """
+    if timings is None:
+        timings = {}
+    if stage == "writing":
+        with phase("writing", timings, memory):
+            written = multiprocess_writer(
+                data,
+                stdout=stdout,
+                verbosity=verbosity,
+                build_id=build_id,
+                previous=previous,
+            )
+        return written, content_size(data)
+    with phase("reading", timings, memory):
+        read = multiprocess_reader(
+            data,
+            stdout=stdout,
+            verbosity=verbosity,
+            fail_soft=fail_soft,
+            timeout=timeout,
+            build_id=build_id,
+        )
+    if stage == "reading":
+        return read, content_size(read)
+    with phase("writing", timings, memory):
+        written = multiprocess_writer(
+            read,
+            stdout=stdout,
+            verbosity=verbosity,
+            build_id=build_id,
+            previous=previous,
+        )
+    return written, content_size(read)
+
+
+def run_chunk(worker, chunk):
+    """
+    Runs a worker over a chunk, returning the chunk along with what it
+    returned, as chunks run in a pool may finish in any order.
+    """
+    return chunk, worker(chunk)
+
+
+class WorkerReport(
+    namedtuple(
+        "WorkerReport",
+        "metrics memory timings profiles failures count size busy pid rss",
+    )
+):
+    __slots__ = ()
+
+
+def diagnosed_worker(
+    stage,
+    data,
+    stdout=None,
+    verbosity=2,
+    measure=False,
+    profile=None,
+    trace_memory=False,
+    fail_soft=False,
+    timeout=None,
+    build_id=None,
+    read_database=None,
+    previous=None,
+):
+    """
+    Runs a stage over `data`, as would be done by a pool, returning both the
+    results and a WorkerReport of whatever diagnostics were requested, for
+    merging into the parent process. Pages are read from `read_database`, if
+    given, and compared against the `previous` manifest, if given.
+    """
+    metrics = BuildMetrics()
+    memory = MemoryTracker()
+    timings = {}
+    profiler = PageProfiler(*profile) if profile is not None else None
+    failures = []
+
+    def record_failure(sender, failure, **kwargs):
+        failures.append(failure)
+
+    with ExitStack() as stack:
+        read_page_failed.connect(record_failure, weak=False)
+        stack.callback(read_page_failed.disconnect, record_failure)
+        if measure:
+            stack.enter_context(metrics)
+        if profiler is not None:
+            stack.enter_context(profiler)
+        stack.enter_context(read_from(read_database))
+        started = perf_counter()
+        results, size = run_stage(
+            stage=stage,
+            data=data,
+            stdout=stdout,
+            verbosity=verbosity,
+            fail_soft=fail_soft,
+            timeout=timeout,
+            build_id=build_id,
+            previous=previous,
+            timings=timings,
+            memory=memory if trace_memory else None,
+        )
+        busy = perf_counter() - started
+    report = WorkerReport(
+        metrics=tuple(metrics),
+        memory=memory.peaks,
+        timings=timings,
+        profiles=tuple(profiler.profiled) if profiler is not None else (),
+        failures=tuple(failures),
+        count=len(data),
+        size=size,
+        busy=busy,
+        pid=os.getpid(),
+        rss=get_rss(),
+    )
+    return results, report
+
+
 class FakeURLConf(namedtuple("FakeURLConf", "urlpatterns")):
     def __repr__(self):
         return "<%(cls)s [%(count)d]>" % {
@@ -74,12 +305,288 @@ class Command(BaseCommand):
             type=int,
             help="Number of processes to spawn",
         )
+        parser.add_argument(
+            "--chunk-size",
+            action="store",
+            dest="chunk_size",
+            default=50,
+            type=int,
+            help="Maximum number of URLs to hand to a process at a time",
+        )
+        parser.add_argument(
+            "--start-method",
+            action="store",
+            dest="start_method",
+            default=None,
+            choices=multiprocessing.get_all_start_methods(),
+            help="How to start processes, when using more than one. Defaults "
+            "to the platform's default",
+        )
+        parser.add_argument(
+            "--max-pages-per-process",
+            action="store",
+            dest="max_pages_per_process",
+            default=None,
+            type=int,
+            help="Replace each process with a new one once it has read this "
+            "many pages, so that memory it has leaked is given back",
+        )
+        parser.add_argument(
+            "--no-warmup",
+            action="store_false",
+            dest="warmup",
+            default=True,
+            help="Don't compile templates, populate the URL resolvers and load "
+            "translations before starting processes",
+        )
+        parser.add_argument(
+            "--read-database",
+            action="store",
+            dest="read_database",
+            default=get_read_database(),
+            help="The database alias to send reads to while collecting and "
+            "reading pages, eg: a replica. Defaults to the "
+            "STATICPUB_READ_DATABASE setting",
+        )
+        parser.add_argument(
+            "--progress-interval",
+            action="store",
+            dest="progress_interval",
+            default=2.0,
+            type=float,
+            help="Seconds between progress reports. Each file read or written "
+            "is only listed at verbosity 2 or above",
+        )
+        parser.add_argument(
+            "--producer",
+            action="append",
+            dest="producers",
+            default=None,
+            help="Only run this producer from STATICPUB_PRODUCERS, by its "
+            "dotted path or class name. May be given more than once",
+        )
+        parser.add_argument(
+            "--url",
+            action="append",
+            dest="urls",
+            default=None,
+            help="Build this URL, rather than running the producers. May be "
+            "given more than once",
+        )
+        parser.add_argument(
+            "--url-file",
+            action="store",
+            dest="url_file",
+            default=None,
+            help="Build the URLs listed in this file, one per line, rather "
+            "than running the producers. Use - to read them from stdin",
+        )
+        parser.add_argument(
+            "--include",
+            action="append",
+            dest="include",
+            default=None,
+            help="Only build URLs matching this glob, or regular expression "
+            "if prefixed with re:. May be given more than once",
+        )
+        parser.add_argument(
+            "--exclude",
+            action="append",
+            dest="exclude",
+            default=None,
+            help="Don't build URLs matching this glob, or regular expression "
+            "if prefixed with re:. May be given more than once",
+        )
+        parser.add_argument(
+            "--shard",
+            action="store",
+            dest="shard",
+            default=None,
+            help="Only build the Kth of N slices of the collected URLs, given "
+            "as K/N, so that several machines may build a site between them",
+        )
+        parser.add_argument(
+            "--manifest",
+            action="store",
+            dest="manifest",
+            default=None,
+            help="File to record every file written, and its md5, into. "
+            "Defaults to the STATICPUB_MANIFEST setting, suffixed with the "
+            "shard if there is one",
+        )
+        parser.add_argument(
+            "--prune",
+            action="store_true",
+            dest="prune",
+            default=False,
+            help="Delete any files in the previous manifest which this build "
+            "didn't write. With --dry-run, only list them",
+        )
+        parser.add_argument(
+            "--prune-batch-size",
+            action="store",
+            dest="prune_batch_size",
+            default=1000,
+            type=int,
+            help="How many orphaned files to delete at a time",
+        )
+        parser.add_argument(
+            "--changes-file",
+            action="store",
+            dest="changes_file",
+            default=None,
+            help="Write the files this build created, modified or deleted to "
+            "the given file as JSON, eg: for invalidating a CDN",
+        )
+        parser.add_argument(
+            "--archive",
+            action="store",
+            dest="archive",
+            default=None,
+            help="Write every file into a single .tar, .tar.gz, .tar.zst or "
+            ".zip archive, along with the manifest, instead of into the "
+            "staticpub storage",
+        )
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            dest="resume",
+            default=False,
+            help="Skip any URLs already read and written by an interrupted build",
+        )
+        parser.add_argument(
+            "--journal",
+            action="store",
+            dest="journal",
+            default=None,
+            help="File recording the URLs read and written so far, for --resume. "
+            "Defaults to the STATICPUB_JOURNAL setting",
+        )
+        parser.add_argument(
+            "--timeout",
+            action="store",
+            dest="timeout",
+            default=None,
+            type=float,
+            help="Abandon reading any URL which takes longer than this many "
+            "seconds. With --keep-going it's recorded as a failure, otherwise "
+            "the build stops",
+        )
+        parser.add_argument(
+            "--keep-going",
+            action="store_true",
+            dest="keep_going",
+            default=False,
+            help="Record any URL which can't be read, and carry on with the "
+            "rest of the build, retrying failures at the end",
+        )
+        parser.add_argument(
+            "--retries",
+            action="store",
+            dest="retries",
+            default=2,
+            type=int,
+            help="With --keep-going, how many times to retry failed URLs",
+        )
+        parser.add_argument(
+            "--retry-delay",
+            action="store",
+            dest="retry_delay",
+            default=1.0,
+            type=float,
+            help="With --keep-going, seconds to wait before the first retry, "
+            "doubling for each subsequent retry",
+        )
+        parser.add_argument(
+            "--max-failures",
+            action="store",
+            dest="max_failures",
+            default=0,
+            type=int,
+            help="With --keep-going, how many URLs may still be failing after "
+            "retrying before the command exits with an error",
+        )
         parser.add_argument(
             "--dry-run",
             action="store_true",
             dest="dry_run",
             default=False,
-            help="Read all files and run the preview server",
+            help="Read all files and run the preview server, or with --prune, "
+            "list what would be deleted and exit",
+        )
+        parser.add_argument(
+            "--serve",
+            action="store_true",
+            dest="serve",
+            default=False,
+            help="Run the preview server against the staticpub storage, "
+            "without reading anything first",
+        )
+        parser.add_argument(
+            "--serve-root",
+            action="store",
+            dest="serve_root",
+            default=None,
+            help="Run the preview server against a scratch build directory "
+            "instead of the staticpub storage. Implies --serve",
+        )
+        parser.add_argument(
+            "--render-missing",
+            action="store_true",
+            dest="render_missing",
+            default=False,
+            help="When serving, read and write pages which don't exist yet on "
+            "the first request for them",
+        )
+        parser.add_argument(
+            "--report",
+            action="store",
+            dest="report",
+            default=0,
+            type=int,
+            help="Print the N slowest and heaviest pages after building",
+        )
+        parser.add_argument(
+            "--check-performance",
+            action="store",
+            dest="check_performance",
+            default=0,
+            type=int,
+            help="Instead of building, check for settings which slow builds "
+            "down, and time reading the first N URLs with and without each "
+            "middleware",
+        )
+        parser.add_argument(
+            "--metrics-file",
+            action="store",
+            dest="metrics_file",
+            default=None,
+            help="Export the render time, query count, size and write time of "
+            "every page to the given .csv or .json file",
+        )
+        parser.add_argument(
+            "--profile-threshold",
+            action="store",
+            dest="profile_threshold",
+            default=None,
+            type=float,
+            help="Read any page slower than this many seconds once more under "
+            "cProfile, and save the profile",
+        )
+        parser.add_argument(
+            "--profile-dir",
+            action="store",
+            dest="profile_dir",
+            default="staticpub-diagnostics",
+            help="Directory to save .prof files into",
+        )
+        parser.add_argument(
+            "--trace-memory",
+            action="store_true",
+            dest="trace_memory",
+            default=False,
+            help="Use tracemalloc to record peak memory while collecting, "
+            "reading and writing",
         )
 
     def set_options(self, **options):
@@ -90,82 +597,387 @@ class Command(BaseCommand):
         self.verbosity = options["verbosity"]
         self.processes = options["processes"]
         self.multiprocess = options["processes"] > 1
+        self.chunk_size = options["chunk_size"]
+        self.start_method = options["start_method"]
+        self.max_pages_per_process = options["max_pages_per_process"]
+        self.warmup = options["warmup"]
+        self.read_database = options["read_database"]
+        if self.read_database is not None and self.read_database not in connections:
+            raise CommandError(
+                "There's no {alias!r} in DATABASES to read from".format(
+                    alias=self.read_database
+                )
+            )
+        if self.read_database is not None and not is_router_installed():
+            raise CommandError(
+                "Reading from {alias!r} needs 'staticpub.db.BuildRouter' first "
+                "in DATABASE_ROUTERS".format(alias=self.read_database)
+            )
+        self.resume = options["resume"]
+        # lets each process share what it has read and written, during a build.
+        self.build_id = uuid4().hex
+        self.shard = None
+        if options["shard"] is not None:
+            try:
+                self.shard = Shard.parse(options["shard"])
+            except ManifestError as e:
+                raise CommandError(force_str(e))
+        self.prune = options["prune"]
+        self.prune_batch_size = options["prune_batch_size"]
+        if self.prune and self.shard is not None:
+            raise CommandError(
+                "--prune can't be used with --shard, as another shard may now "
+                "write a file this one used to. Use mergestaticsite --prune "
+                "once every shard has been built"
+            )
+        self.changes_file = options["changes_file"]
+        self.archive = options["archive"]
+        if self.archive is not None and (self.resume or self.prune):
+            raise CommandError(
+                "--archive can't be used with --resume or --prune, as each "
+                "build writes a new archive"
+            )
+        self.producer_names = tuple(options["producers"] or ())
+        self.urls = tuple(options["urls"] or ())
+        try:
+            if options["url_file"] is not None:
+                self.urls += tuple(read_url_file(options["url_file"]))
+            self.include = tuple(options["include"] or ())
+            self.exclude = tuple(options["exclude"] or ())
+            self.url_filter = URLFilter.parse(
+                include=self.include, exclude=self.exclude
+            )
+        except (OSError, SubsetError) as e:
+            raise CommandError(force_str(e))
+        for url in self.urls:
+            if not is_url_usable(url=url):
+                raise CommandError(
+                    "The URL '{url}' doesn't end in a forward-slash ('/'), nor "
+                    "does it have a file extension".format(url=url)
+                )
+        # only part of the site is to be built.
+        self.subset = bool(
+            self.producer_names or self.urls or not self.url_filter.empty
+        )
+        if self.subset and (self.prune or self.archive is not None):
+            raise CommandError(
+                "--prune and --archive need the whole site to be built, so "
+                "can't be used with --producer, --url, --url-file, --include "
+                "or --exclude"
+            )
+        self.manifest_path = options["manifest"]
+        if self.manifest_path is None:
+            self.manifest_path = get_default_manifest_path()
+            if self.shard is not None:
+                self.manifest_path = self.shard.path(self.manifest_path)
+        # the previous build's manifest, if pages may be compared against it.
+        self.previous_manifest = None
+        self.keep_going = options["keep_going"]
+        self.timeout = options["timeout"]
+        self.retries = options["retries"]
+        self.retry_delay = options["retry_delay"]
+        self.max_failures = options["max_failures"]
+        self.failures = []
+        self.retries_left = self.retries
+        self.journal_path = options["journal"]
+        if self.journal_path is None and self.shard is not None:
+            self.journal_path = self.shard.path(get_default_journal_path())
+        self.progress_interval = options["progress_interval"]
         self.dry_run = options["dry_run"]
+        self.serve_root = options["serve_root"]
+        self.serve = options["serve"] or self.serve_root is not None
+        self.render_missing = options["render_missing"]
+        self.report = options["report"]
+        self.check_performance = options["check_performance"]
+        self.metrics_file = options["metrics_file"]
+        self.measure = self.report > 0 or self.metrics_file is not None
+        self.metrics = BuildMetrics()
+        self.profile = None
+        if options["profile_threshold"] is not None:
+            self.profile = (options["profile_threshold"], options["profile_dir"])
+        self.profiles = []
+        self.trace_memory = options["trace_memory"]
+        self.memory = MemoryTracker()
+        self.process_memory = ProcessMemory()
+        # seconds spent reading and writing, summed across every process.
+        self.timings = {}
 
-    def handle_preview(self, read_results):
+    def get_worker(self, stage):
+        return partial(
+            diagnosed_worker,
+            stage,
+            verbosity=self.verbosity,
+            measure=self.measure,
+            profile=self.profile,
+            trace_memory=self.trace_memory,
+            fail_soft=self.keep_going,
+            timeout=self.timeout,
+            build_id=self.build_id,
+            read_database=self.read_database,
+            previous=self.previous_manifest,
+        )
+
+    def get_chunk_size(self, items):
+        """
+        Small enough that every process gets several chunks, so that progress
+        is reported regularly and a slow chunk doesn't hold up the others.
+        """
+        per_process = -(-len(items) // (self.processes * 4))
+        return max(1, min(self.chunk_size, per_process))
+
+    def merge_report(self, report):
+        self.metrics.update(report.metrics)
+        self.memory.update(report.memory)
+        for name, seconds in report.timings.items():
+            self.timings[name] = self.timings.get(name, 0) + seconds
+        self.profiles.extend(report.profiles)
+        self.failures.extend(report.failures)
+        self.process_memory.record(report.pid, report.rss, report.count)
+
+    def get_context(self):
+        context = multiprocessing.get_context(self.start_method)
+        if context.get_start_method() == "forkserver":
+            context.set_forkserver_preload(list(FORKSERVER_PRELOAD))
+        return context
+
+    def get_pool(self, chunk_size=None):
+        return self.get_context().Pool(
+            processes=self.processes,
+            initializer=initialize_worker,
+            initargs=(self.warmup,),
+            maxtasksperchild=max_tasks_per_process(
+                self.max_pages_per_process, chunk_size or self.chunk_size
+            ),
+        )
+
+    def warm_up(self):
+        """
+        Forked processes start with whatever the parent had, so that's warmed
+        up once, before any are started. Otherwise each warms itself up.
+        """
+        if not self.multiprocess or not self.warmup:
+            return None
+        if self.get_context().get_start_method() != "fork":
+            return None
+        warmup = warm_up()
+        if self.verbosity > 0:
+            self.stdout.write("Warmed up {warmup}".format(warmup=warmup))
+        return warmup
+
+    def run_workers(self, stage, chunks, total, on_result=None):
+        """
+        Runs a stage over each of the chunks, in a pool if we're using more
+        than one process, merging each worker's diagnostics and reporting
+        progress as each chunk completes.
+        """
+        chunks = tuple(chunks)
+        worker = self.get_worker(stage=stage)
+        progress = Progress(
+            stdout=self.stdout if self.verbosity > 0 else None,
+            label=stage.capitalize(),
+            total=total,
+            processes=self.processes,
+            interval=self.progress_interval,
+        )
+        if self.multiprocess:  # pragma: no cover
+            pool = self.get_pool(chunk_size=max((len(x) for x in chunks), default=None))
+            # each chunk is recorded as soon as it's done, in whatever order,
+            # so a slow chunk doesn't hold back those after it.
+            outputs = pool.imap_unordered(partial(run_chunk, worker), chunks)
+        else:
+            outputs = (
+                (chunk, worker(chunk, stdout=self.stdout._out)) for chunk in chunks
+            )
+        results = []
+        try:
+            for chunk, (result, report) in outputs:
+                self.merge_report(report)
+                if on_result is not None:
+                    result = on_result(chunk, result, report)
+                results.append(result)
+                progress.update(count=report.count, size=report.size, busy=report.busy)
+        except BaseException:
+            # eg: too many URLs failed, so the chunks still running aren't
+            # needed.
+            if self.multiprocess:  # pragma: no cover
+                pool.terminate()
+            raise
+        if self.multiprocess:  # pragma: no cover
+            pool.close()
+            pool.join()
+        progress.finish()
+        return results
+
+    def run_preview_server(self, view):
         if "django.contrib.staticfiles" in settings.INSTALLED_APPS:
             from django.contrib.staticfiles.management.commands import runserver
         else:
             from django.core.management.commands import runserver
 
-        def filename_len(res):
-            return len(res.filename)
-
-        sorted_views = sorted(
-            (read_result for read_result in read_results), key=filename_len
+        urlconf = FakeURLConf(
+            urlpatterns=(re_path(r"^(?P<path>.*)$", view, name="staticpub_preview"),)
         )
-        fake_views = chain.from_iterable(
-            read_result.as_urls() for read_result in sorted_views
-        )
-        urlconf = FakeURLConf(urlpatterns=tuple(fake_views))
         with override_settings(ROOT_URLCONF=urlconf):
             return runserver.Command().handle(use_reloader=False)
 
+    def handle_preview(self, read_results):
+        return self.run_preview_server(view=PreviewIndex(read_results=read_results))
+
+    def handle_serve(self):
+        storage = None
+        if self.serve_root is not None:
+            storage = FileSystemStorage(location=self.serve_root)
+        view = StoragePreview(storage=storage, render_missing=self.render_missing)
+        return self.run_preview_server(view=view)
+
     def handle(self, **options):
         self.set_options(**options)
+        if self.serve:
+            return self.handle_serve()
+        if self.check_performance > 0:
+            return self.handle_check_performance()
+        if self.verbosity > 0:
+            # warns about settings which slow builds down, eg: DEBUG.
+            self.check(tags=[PERFORMANCE_TAG], include_deployment_checks=True)
+
+        stage = self.memory.stage("collecting") if self.trace_memory else nullcontext()
+        with stage:
+            collected_urls = self.collect()
+
+        build_started.send(sender=self.__class__)
         try:
-            collector = URLCollector()
-        except ImproperlyConfigured as e:
-            raise CommandError(force_str(e))
+            return self.build(collected_urls=collected_urls)
+        finally:
+            # forget what this process kept for the build, eg: fragments it
+            # cached, if it did any of the reading itself.
+            end_build(self.build_id)
 
+    def get_producers(self):
+        """
+        The producers chosen with --producer, or None for all of them.
+        """
+        if not self.producer_names:
+            return None
+        producers = getattr(settings, "STATICPUB_PRODUCERS", None)
+        if producers is None:
+            # left for URLCollector to complain about.
+            return None
         try:
-            collected_urls = collector()
-        except CollectionError as e:
+            return select_producers(self.producer_names, producers)
+        except SubsetError as e:
             raise CommandError(force_str(e))
 
+    def collect(self):
+        collected_urls = set(self.urls)
+        # given URLs are built instead of running the producers, unless
+        # some were chosen too.
+        if self.producer_names or not collected_urls:
+            try:
+                collector = URLCollector(producers=self.get_producers())
+            except ImproperlyConfigured as e:
+                raise CommandError(force_str(e))
+
+            try:
+                with read_from(self.read_database):
+                    collected_urls.update(collector())
+            except CollectionError as e:
+                raise CommandError(force_str(e))
+
+        if not self.url_filter.empty:
+            collected_urls = set(self.url_filter.select(collected_urls))
+
+        if not collected_urls and self.subset:
+            raise CommandError("No URLs were selected to build")
         if not collected_urls:
             raise CommandError(
                 "No URLs found after running all defined `STATICPUB_PRODUCERS`"
             )
 
-        build_started.send(sender=self.__class__)
-        reading_started = timezone.now()
+        return collected_urls
 
-        if self.multiprocess:  # pragma: no cover
-            reader_pool = multiprocessing.Pool(processes=self.processes)
-            collected_urls = tuple(collected_urls)
-            new_urls = tuple(
-                collected_urls[i :: self.processes] for i in range(0, self.processes)
-            )
-            read = reader_pool.map(multiprocess_reader, new_urls)
-            reader_pool.close()
-            reader_pool.join()
-            read_results = tuple(chain.from_iterable(read))
-        else:
-            read_results = multiprocess_reader(
-                urls=collected_urls, stdout=self.stdout._out
+    def handle_check_performance(self):
+        self.check(
+            tags=[PERFORMANCE_TAG],
+            include_deployment_checks=True,
+            display_num_errors=True,
+        )
+        urls = tuple(sorted(self.collect()))[: self.check_performance]
+        self.stdout.write(
+            "Timing {num} URLs with and without each middleware".format(num=len(urls))
+        )
+        for middleware, baseline, without in time_middleware(urls):
+            if without is None:
+                self.stdout.write(
+                    "{middleware}: the pages can't be read without it".format(
+                        middleware=middleware
+                    )
+                )
+                continue
+            self.stdout.write(
+                "{middleware}: {cost:.1f}ms of {total:.1f}ms per page".format(
+                    middleware=middleware,
+                    cost=(baseline - without) * 1000 / len(urls),
+                    total=baseline * 1000 / len(urls),
+                )
             )
 
-        reading_finished = timezone.now()
-        reading_duration = reading_finished - reading_started
-
-        self.stdout.write(
-            self.style.HTTP_REDIRECT(
-                "Read {num} URLs in {time} seconds".format(
-                    time=reading_duration.total_seconds(),
-                    num=len(read_results),
+    def handle_report(self):
+        for line in self.memory.report():
+            self.stdout.write(line)
+        if self.multiprocess and self.verbosity > 0:
+            for line in self.process_memory.report():
+                self.stdout.write(line)
+        if self.profiles:
+            self.stdout.write(
+                "Profiled {num} slow pages into {path}".format(
+                    num=len(self.profiles), path=self.profile[1]
+                )
+            )
+        if self.report > 0:
+            for line in self.metrics.report(count=self.report):
+                self.stdout.write(line)
+        if self.metrics_file is not None:
+            self.metrics.export(self.metrics_file)
+            self.stdout.write(
+                "Wrote metrics for {num} pages to {path}".format(
+                    num=len(self.metrics), path=self.metrics_file
                 )
             )
-        )
 
-        if self.dry_run:
-            return self.handle_preview(read_results=read_results)
+    def describe_selection(self, urls):
+        """
+        Which URLs were chosen to build, in words.
+        """
+        if not self.subset:
+            return "all defined `STATICPUB_PRODUCERS`"
+        if self.producer_names:
+            selection = "the URLs of the producers {names}".format(
+                names=", ".join(self.producer_names)
+            )
+            if self.urls:
+                selection += " and {num} given URLs".format(num=len(self.urls))
+        elif self.urls:
+            selection = "{num} given URLs".format(num=len(self.urls))
+        else:
+            selection = "the URLs of all defined `STATICPUB_PRODUCERS`"
+        if self.include:
+            selection += " matching {patterns}".format(
+                patterns=" or ".join(self.include)
+            )
+        if self.exclude:
+            selection += " except those matching {patterns}".format(
+                patterns=" or ".join(self.exclude)
+            )
+        return "{selection}, {num} URLs in all,".format(
+            selection=selection, num=len(urls)
+        )
 
+    def confirm(self, urls):
         message = ["\n"]
         message.append(
-            "You have requested to collect all defined `STATICPUB_PRODUCERS` "
-            "at the destination\n"
-            "location as specified in your settings via `STORAGES['staticpub']`\n"
+            "You have requested to collect {selection} at the destination\n"
+            "location as specified in your settings via "
+            "`STORAGES['staticpub']`\n".format(selection=self.describe_selection(urls))
         )
         message.append(
             "Are you sure you want to do this?\n\n" "Type 'yes' or 'y' to continue: "
@@ -173,44 +985,366 @@ class Command(BaseCommand):
         if self.interactive and input("".join(message)).lower() not in ("yes", "y"):
             raise CommandError("Collecting cancelled.")
 
-        writing_started = timezone.now()
-        if self.multiprocess:  # pragma: no cover
-            writer_pool = multiprocessing.Pool(self.processes)
-            # noinspection PyUnboundLocalVariable
-            written = writer_pool.map(multiprocess_writer, read)
-            writer_pool.close()
-            writer_pool.join()
-            write_results = chain.from_iterable(written)
+    def build(self, collected_urls):
+        collected_urls = tuple(collected_urls)
+        manifest = Manifest(
+            shard=self.shard,
+            collected={
+                "count": len(collected_urls),
+                "digest": urls_digest(collected_urls),
+            },
+            storage=(
+                describe_storage(storages["staticpub"])
+                if self.archive is None
+                else None
+            ),
+        )
+        previous = self.read_previous_manifest()
+        if self.subset and previous is not None:
+            # the rest of the site is as the previous build left it.
+            manifest.add(
+                urls=previous.urls, files=previous.files.items(), pages=previous.pages
+            )
+            manifest.fail(previous.failed)
+        if self.shard is not None:
+            everything = collected_urls
+            collected_urls = self.shard.select(everything)
+            self.stdout.write(
+                "Building shard {shard}: {num} of {total} URLs".format(
+                    shard=self.shard, num=len(collected_urls), total=len(everything)
+                )
+            )
+        if self.dry_run:
+            return self.build_preview(collected_urls=collected_urls)
+
+        self.confirm(urls=collected_urls)
+        self.warm_up()
+        building_started = timezone.now()
+
+        journal = BuildJournal(path=self.journal_path)
+        self.mark_previous_manifest(previous, journal)
+        if self.resume:
+            completed = set()
+            for entry in journal.entries():
+                completed.update(entry["urls"])
+                manifest.add(
+                    urls=entry["urls"],
+                    files=entry["written"],
+                    pages=entry.get("pages"),
+                )
+            urls = tuple(url for url in collected_urls if url not in completed)
+            self.stdout.write(
+                "Resuming: skipping {num} URLs already built".format(
+                    num=len(collected_urls) - len(urls)
+                )
+            )
         else:
-            write_results = multiprocess_writer(
-                data=read_results, stdout=self.stdout._out
+            journal.reset()
+            urls = collected_urls
+
+        archive = None
+        stage = "building"
+        if self.archive is not None:
+            # pages are only read by the workers, and written into the
+            # archive one chunk at a time, here.
+            archive = ArchiveStorage(path=self.archive)
+            stage = "reading"
+
+        def record(chunk, write_results, report):
+            if archive is not None:
+                write_results = self.write_archive(archive, write_results)
+            failed = set(failure.url for failure in report.failures)
+            built = [url for url in chunk if url not in failed]
+            journal.record(urls=built, write_results=write_results)
+            manifest.add(
+                urls=built,
+                files=((x.name, x.md5) for x in write_results),
+                pages=pages_written(write_results),
             )
+            self.check_failures()
+            return write_results
 
-        error_reader = ErrorReader()
-        error_results = error_reader()
-        written_errors = multiprocess_writer(
-            data=error_results, stdout=self.stdout._out
+        self.retries_left = self.retries
+
+        written = self.run_workers(
+            stage=stage,
+            chunks=chunked(urls, self.get_chunk_size(urls)),
+            total=len(urls),
+            on_result=record,
         )
+        written.extend(self.retry_failures(stage=stage, on_result=record))
+        write_results = chain.from_iterable(written)
+
+        written_errors = ()
+        # the error pages aren't part of a subset.
+        if not self.subset and (self.shard is None or self.shard.index == 1):
+            # every shard would otherwise write the same error pages.
+            error_results = tuple(ErrorReader()())
+            if archive is not None:
+                written_errors = self.write_archive(archive, error_results)
+            else:
+                written_errors, report = self.get_worker(stage="writing")(
+                    error_results, stdout=self.stdout._out
+                )
+                self.merge_report(report)
+            manifest.add(files=((x.name, x.md5) for x in written_errors))
 
-        writing_finished = timezone.now()
-        writing_duration = writing_finished - writing_started
+        building_finished = timezone.now()
+        building_duration = building_finished - building_started
 
         all_written = tuple(chain(write_results, written_errors))
 
         self.stdout.write(
             self.style.HTTP_REDIRECT(
-                "Wrote {num} files in {time} seconds".format(
-                    time=writing_duration.total_seconds(),
+                "Read {urls} URLs and wrote {num} files in {time} seconds".format(
+                    urls=len(urls),
+                    time=building_duration.total_seconds(),
                     num=len(all_written),
                 )
             )
         )
-        complete_duration = writing_finished - reading_started
+        self.stdout.write(
+            "Spent {reading:.2f} seconds reading and {writing:.2f} seconds "
+            "writing, across every process".format(
+                reading=self.timings.get("reading", 0),
+                writing=self.timings.get("writing", 0),
+            )
+        )
+        self.handle_report()
+        manifest.fail(failure.url for failure in self.failures)
+        deleted = ()
+        if self.prune:
+            deleted = self.prune_orphans(manifest)
+        if archive is not None:
+            archive.close(manifest=manifest)
+            self.stdout.write(
+                "Wrote {num} files into {path}".format(
+                    num=len(archive.md5s), path=self.archive
+                )
+            )
+        manifest.write(self.manifest_path)
+        self.stdout.write(
+            "Wrote a manifest of {num} files to {path}".format(
+                num=len(manifest), path=self.manifest_path
+            )
+        )
+        changes = BuildChanges.from_write_results(all_written, deleted=deleted)
+        if self.changes_file is not None:
+            self.write_changes(changes)
+        self.handle_failures()
+        journal.delete()
+        build_finished.send(sender=self.__class__, changes=changes)
+
+    def read_previous_manifest(self):
+        """
+        The previous build's manifest, if there is one. Pages are compared
+        against the files it lists, rather than reading each back from the
+        storage, if it was written to the same storage, by a build which
+        finished.
+        """
+        if not os.path.exists(self.manifest_path):
+            return None
+        try:
+            previous = Manifest.read(self.manifest_path)
+        except ManifestError as e:
+            self.stderr.write("Ignoring the previous manifest: {e}".format(e=e))
+            return None
+        if (
+            self.archive is None
+            and not previous.dirty
+            and previous.storage == describe_storage(storages["staticpub"])
+        ):
+            self.previous_manifest = self.manifest_path
+        return previous
+
+    def mark_previous_manifest(self, previous, journal):
+        """
+        Marks the previous build's manifest as dirty until this build replaces
+        it, so that if this one dies, the next doesn't believe it. The md5s of
+        any files listed in a leftover journal are forgotten, as they were
+        written since, so those are read back.
+        """
+        if previous is None:
+            return None
+        written = set()
+        for entry in journal.entries():
+            written.update(name for name, md5 in entry["written"])
+        previous.forget(written)
+        previous.dirty = True
+        return previous.write(self.manifest_path)
+
+    def write_changes(self, changes):
+        with open(self.changes_file, "w") as f:
+            json.dump(changes._asdict(), f, indent=1)
+        self.stdout.write(
+            "Wrote {created} created, {modified} modified and {deleted} deleted "
+            "files to {path}".format(
+                created=len(changes.created),
+                modified=len(changes.modified),
+                deleted=len(changes.deleted),
+                path=self.changes_file,
+            )
+        )
+
+    def write_archive(self, archive, read_results):
+        measuring = self.metrics if self.measure else nullcontext()
+        memory = self.memory if self.trace_memory else None
+        with measuring, phase("writing", self.timings, memory):
+            return multiprocess_writer(
+                tuple(x for x in read_results if x is not None),
+                stdout=self.stdout._out,
+                verbosity=self.verbosity,
+                storage=archive,
+                build_id=self.build_id,
+            )
+
+    def retry_failures(self, stage="building", on_result=None):
+        written = []
+        for attempt in range(self.retries):
+            if not self.failures:
+                break
+            delay = self.retry_delay * (2**attempt)
+            urls = tuple(sorted(set(failure.url for failure in self.failures)))
+            self.stdout.write(
+                "Retrying {num} failed URLs in {delay:g} seconds".format(
+                    num=len(urls), delay=delay
+                )
+            )
+            time.sleep(delay)
+            self.failures = []
+            self.retries_left = self.retries - attempt - 1
+            written.extend(
+                self.run_workers(
+                    stage=stage,
+                    chunks=chunked(urls, self.get_chunk_size(urls)),
+                    total=len(urls),
+                    on_result=on_result,
+                )
+            )
+        return written
+
+    def check_failures(self):
+        """
+        Stops the build as soon as more URLs have failed than --max-failures
+        allows, once there are no retries left which might fix them, rather
+        than reading every other page first.
+        """
+        if self.retries_left > 0 or len(self.failures) <= self.max_failures:
+            return None
+        self.stderr.write(
+            "Stopping, as {num} URLs have failed".format(num=len(self.failures))
+        )
+        return self.handle_failures()
+
+    def handle_failures(self):
+        if not self.failures:
+            return None
+        for failure in self.failures:
+            self.stderr.write(
+                "Failed to read {url}: {error}".format(
+                    url=failure.url, error=failure.error
+                )
+            )
+            if self.verbosity > 1:
+                self.stderr.write(failure.traceback)
+        if len(self.failures) > self.max_failures:
+            raise CommandError(
+                "{num} URLs could not be read, which is more than the {max} "
+                "allowed by --max-failures".format(
+                    num=len(self.failures), max=self.max_failures
+                )
+            )
+
+    def prune_orphans(self, manifest):
+        """
+        Deletes (or with --dry-run, lists) whatever the previous build wrote
+        which this one didn't. Nothing is deleted if any URL failed, as the
+        files it would have written can't be known.
+        """
+        try:
+            previous = Manifest.read(self.manifest_path)
+        except FileNotFoundError:
+            self.stdout.write(
+                "Not pruning, as there's no previous manifest at {path}".format(
+                    path=self.manifest_path
+                )
+            )
+            return ()
+        except ManifestError as e:
+            raise CommandError(force_str(e))
+        if manifest.failed:
+            self.stdout.write(
+                "Not pruning, as {num} URLs failed to build".format(
+                    num=len(manifest.failed)
+                )
+            )
+            return ()
+
+        orphans = manifest.orphans(previous)
+        if self.dry_run:
+            for name in orphans:
+                self.stdout.write("Would delete {name}".format(name=name))
+            return orphans
+
+        deleted = []
+        storage = storages["staticpub"]
+        for batch in delete_orphans(storage, orphans, batch_size=self.prune_batch_size):
+            deleted.extend(batch)
+            if self.verbosity >= 2:
+                for name in batch:
+                    self.stdout.write("Deleted {name}".format(name=name))
+        self.stdout.write("Deleted {num} orphaned files".format(num=len(deleted)))
+        return deleted
+
+    def build_preview(self, collected_urls):
+        reading_started = timezone.now()
+
+        read = self.run_workers(
+            stage="reading",
+            chunks=chunked(collected_urls, self.get_chunk_size(collected_urls)),
+            total=len(collected_urls),
+        )
+        read_results = tuple(chain.from_iterable(read))
+
+        reading_finished = timezone.now()
+        reading_duration = reading_finished - reading_started
+
         self.stdout.write(
             self.style.HTTP_REDIRECT(
-                "Took {time} seconds total".format(
-                    time=complete_duration.total_seconds()
+                "Read {num} URLs in {time} seconds".format(
+                    time=reading_duration.total_seconds(),
+                    num=len(read_results),
                 )
             )
         )
-        build_finished.send(sender=self.__class__)
+        self.handle_report()
+        if self.prune:
+            # only a report of what would be pruned, eg: for a script, so
+            # there's no preview server to stop.
+            self.prune_orphans(self.preview_manifest(read_results))
+            return self.handle_failures()
+        self.handle_failures()
+        return self.handle_preview(read_results=read_results)
+
+    def preview_manifest(self, read_results):
+        """
+        The manifest a build would write, were the pages read for --dry-run
+        written, along with the error pages and any compressed siblings.
+        """
+        read_results = tuple(x for x in read_results if x is not None)
+        precompressor = Precompressor.from_settings()
+        manifest = Manifest(urls=(x.url for x in read_results))
+        for read_result in chain(read_results, ErrorReader()()):
+            content = force_bytes(read_result.content)
+            files = [(read_result.filename, hashlib.md5(content).hexdigest())]
+            if precompressor is not None:
+                files.extend(
+                    (
+                        read_result.filename + extension,
+                        hashlib.md5(compressed).hexdigest(),
+                    )
+                    for extension, compressed in precompressor.compress(content)
+                )
+            manifest.add(files=files)
+        manifest.fail(failure.url for failure in self.failures)
+        return manifest
@@ -0,0 +1,115 @@
+from django.core.files.storage import storages
+from django.core.management import BaseCommand
+from django.core.management import CommandError
+from django.utils.encoding import force_str
+
+from staticpub.manifest import Manifest
+from staticpub.manifest import ManifestError
+from staticpub.manifest import delete_orphans
+from staticpub.manifest import get_default_manifest_path
+from staticpub.manifest import merge_manifests
+
+
+class Command(BaseCommand):
+    help = "Combine the manifests written by each shard of a build, checking for missing or duplicate files"  # noqa
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "manifests",
+            nargs="+",
+            help="The manifest written by each `collectstaticsite --shard`",
+        )
+        parser.add_argument(
+            "--output",
+            action="store",
+            dest="output",
+            default=None,
+            help="File to write the combined manifest to. Defaults to the "
+            "STATICPUB_MANIFEST setting",
+        )
+        parser.add_argument(
+            "--prune",
+            action="store_true",
+            dest="prune",
+            default=False,
+            help="Delete any files in the previous combined manifest which no "
+            "shard wrote this time",
+        )
+        parser.add_argument(
+            "--prune-batch-size",
+            action="store",
+            dest="prune_batch_size",
+            default=1000,
+            type=int,
+            help="How many orphaned files to delete at a time",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            dest="dry_run",
+            default=False,
+            help="Only list the files --prune would delete, and don't write "
+            "the combined manifest",
+        )
+
+    def handle(self, **options):
+        self.verbosity = options["verbosity"]
+        output = options["output"] or get_default_manifest_path()
+        try:
+            manifests = tuple(Manifest.read(path) for path in options["manifests"])
+            merged = merge_manifests(manifests)
+        except (OSError, ManifestError) as e:
+            for line in force_str(e).splitlines():
+                self.stderr.write(line)
+            raise CommandError(
+                "Couldn't merge {num} manifests".format(num=len(options["manifests"]))
+            )
+        if options["prune"]:
+            self.prune_orphans(
+                merged,
+                path=output,
+                batch_size=options["prune_batch_size"],
+                dry_run=options["dry_run"],
+            )
+        if options["dry_run"]:
+            return None
+        merged.write(output)
+        self.stdout.write(
+            "Merged {num} manifests, of {urls} URLs and {files} files, into "
+            "{path}".format(
+                num=len(manifests),
+                urls=len(merged.urls),
+                files=len(merged),
+                path=output,
+            )
+        )
+
+    def prune_orphans(self, manifest, path, batch_size, dry_run):
+        try:
+            previous = Manifest.read(path)
+        except FileNotFoundError:
+            self.stdout.write(
+                "Not pruning, as there's no previous manifest at {path}".format(
+                    path=path
+                )
+            )
+            return ()
+        except ManifestError as e:
+            raise CommandError(force_str(e))
+
+        orphans = manifest.orphans(previous)
+        if dry_run:
+            for name in orphans:
+                self.stdout.write("Would delete {name}".format(name=name))
+            return orphans
+
+        deleted = []
+        storage = storages["staticpub"]
+        for batch in delete_orphans(storage, orphans, batch_size=batch_size):
+            deleted.extend(batch)
+            if self.verbosity >= 2:
+                for name in batch:
+                    self.stdout.write("Deleted {name}".format(name=name))
+        self.stdout.write("Deleted {num} orphaned files".format(num=len(deleted)))
+        return deleted
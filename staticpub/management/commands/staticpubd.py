@@ -0,0 +1,66 @@
+from django.core.management import BaseCommand
+from django.core.management import CommandError
+from django.utils.encoding import force_str
+
+from staticpub.daemon import BuildDaemon
+from staticpub.daemon import DaemonError
+
+
+class Command(BaseCommand):
+    help = "Keep warm processes running, building whatever pages are asked for over a Unix socket"  # noqa
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--socket",
+            action="store",
+            dest="socket",
+            default=None,
+            help="Where to listen for requests. Defaults to the "
+            "STATICPUB_DAEMON_SOCKET setting",
+        )
+        parser.add_argument(
+            "--processes",
+            action="store",
+            dest="processes",
+            default=1,
+            type=int,
+            help="Number of processes to keep for building pages; with 1, "
+            "pages are built by the daemon itself",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            action="store",
+            dest="chunk_size",
+            default=10,
+            type=int,
+            help="Maximum number of URLs to hand to a process at a time",
+        )
+        parser.add_argument(
+            "--max-pages-per-process",
+            action="store",
+            dest="max_pages_per_process",
+            default=None,
+            type=int,
+            help="Replace each process with a new one once it has built this "
+            "many pages, so that memory it has leaked is given back",
+        )
+
+    def handle(self, **options):
+        daemon = BuildDaemon(
+            path=options["socket"],
+            processes=options["processes"],
+            chunk_size=options["chunk_size"],
+            max_pages=options["max_pages_per_process"],
+        )
+        try:
+            warmup = daemon.start()
+        except (OSError, DaemonError) as e:
+            daemon.close()
+            raise CommandError(force_str(e))
+        self.stdout.write("Warmed up {warmup}".format(warmup=warmup))
+        self.stdout.write("Listening on {path}".format(path=daemon.path))
+        try:
+            daemon.serve_forever()
+        except KeyboardInterrupt:
+            self.stdout.write("Stopped")
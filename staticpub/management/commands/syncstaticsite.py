@@ -0,0 +1,182 @@
+from time import perf_counter
+
+from django.conf import settings
+from django.core.files.storage import storages
+from django.core.management import BaseCommand
+from django.core.management import CommandError
+from django.utils.encoding import force_str
+
+from staticpub.manifest import MANIFEST_NAME
+from staticpub.manifest import Manifest
+from staticpub.manifest import ManifestError
+from staticpub.manifest import delete_orphans
+from staticpub.manifest import get_default_manifest_path
+from staticpub.sync import SyncPlan
+from staticpub.sync import read_remote_manifest
+from staticpub.sync import upload_many
+from staticpub.sync import write_remote_manifest
+
+
+class Command(BaseCommand):
+    help = "Upload the files of a site built by collectstaticsite to another storage, where they've changed"  # noqa
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--source",
+            action="store",
+            dest="source",
+            default="staticpub",
+            help="The storage the site was built into (default: staticpub)",
+        )
+        parser.add_argument(
+            "--destination",
+            action="store",
+            dest="destination",
+            default=None,
+            help="The storage to upload the site to. Defaults to the "
+            "STATICPUB_SYNC_STORAGE setting",
+        )
+        parser.add_argument(
+            "--manifest",
+            action="store",
+            dest="manifest",
+            default=None,
+            help="The manifest written by collectstaticsite (or "
+            "mergestaticsite). Defaults to the STATICPUB_MANIFEST setting",
+        )
+        parser.add_argument(
+            "--remote-manifest",
+            action="store",
+            dest="remote_manifest",
+            default=MANIFEST_NAME,
+            help="The name the manifest is kept under in the destination "
+            "storage (default: %s)" % MANIFEST_NAME,
+        )
+        parser.add_argument(
+            "--threads",
+            action="store",
+            dest="threads",
+            default=8,
+            type=int,
+            help="How many files to upload at once",
+        )
+        parser.add_argument(
+            "--delete",
+            action="store_true",
+            dest="delete",
+            default=False,
+            help="Delete any files in the remote manifest which aren't in the "
+            "local one",
+        )
+        parser.add_argument(
+            "--delete-batch-size",
+            action="store",
+            dest="delete_batch_size",
+            default=1000,
+            type=int,
+            help="How many files to delete at a time",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            dest="dry_run",
+            default=False,
+            help="Only list the files which would be uploaded or deleted",
+        )
+
+    def get_storage(self, alias):
+        try:
+            return storages[alias]
+        except Exception as e:
+            raise CommandError(
+                "Couldn't use the {alias!r} storage: {e}".format(
+                    alias=alias, e=force_str(e)
+                )
+            )
+
+    def handle(self, **options):
+        self.verbosity = options["verbosity"]
+        destination = options["destination"] or getattr(
+            settings, "STATICPUB_SYNC_STORAGE", None
+        )
+        if destination is None:
+            raise CommandError(
+                "Give a --destination storage, or set STATICPUB_SYNC_STORAGE"
+            )
+        if destination == options["source"]:
+            raise CommandError(
+                "Can't sync the {alias!r} storage to itself".format(alias=destination)
+            )
+        self.source = self.get_storage(options["source"])
+        self.destination = self.get_storage(destination)
+        remote_manifest = options["remote_manifest"]
+        path = options["manifest"] or get_default_manifest_path()
+        try:
+            local = Manifest.read(path)
+            remote = read_remote_manifest(self.destination, name=remote_manifest)
+        except FileNotFoundError:
+            raise CommandError(
+                "There's no manifest at {path}; run collectstaticsite "
+                "first".format(path=path)
+            )
+        except ManifestError as e:
+            raise CommandError(force_str(e))
+
+        plan = SyncPlan.from_manifests(local, remote)
+        if remote is None:
+            self.stdout.write(
+                "There's no {name} in the {alias!r} storage, so uploading "
+                "everything".format(name=remote_manifest, alias=destination)
+            )
+        delete = options["delete"]
+        if delete and local.failed:
+            self.stdout.write(
+                "Not deleting, as {num} URLs failed to build".format(
+                    num=len(local.failed)
+                )
+            )
+            delete = False
+
+        if options["dry_run"]:
+            for name in plan.upload:
+                self.stdout.write("Would upload {name}".format(name=name))
+            if delete:
+                for name in plan.delete:
+                    self.stdout.write("Would delete {name}".format(name=name))
+            return None
+
+        started = perf_counter()
+        uploaded = 0
+        for name in upload_many(
+            self.source, self.destination, plan.upload, threads=options["threads"]
+        ):
+            uploaded += 1
+            if self.verbosity >= 2:
+                self.stdout.write("Uploaded {name}".format(name=name))
+        deleted = 0
+        if delete:
+            for batch in delete_orphans(
+                self.destination,
+                plan.delete,
+                batch_size=options["delete_batch_size"],
+                threads=options["threads"],
+            ):
+                deleted += len(batch)
+                if self.verbosity >= 2:
+                    for name in batch:
+                        self.stdout.write("Deleted {name}".format(name=name))
+        elif remote is not None:
+            # still there, so they belong in the remote manifest, for a
+            # later --delete to find.
+            local.files.update((name, remote.files[name]) for name in plan.delete)
+        write_remote_manifest(self.destination, local, name=remote_manifest)
+        self.stdout.write(
+            "Uploaded {uploaded} files, deleted {deleted} and left {unchanged} "
+            "unchanged, in {seconds:.2f}s".format(
+                uploaded=uploaded,
+                deleted=deleted,
+                unchanged=plan.unchanged,
+                seconds=perf_counter() - started,
+            )
+        )
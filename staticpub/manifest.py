@@ -0,0 +1,373 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import os
+
+from django.conf import settings
+
+from staticpub.utils import build_scoped
+from staticpub.utils import chunked
+
+__all__ = [
+    "Shard",
+    "Manifest",
+    "ManifestError",
+    "describe_storage",
+    "merge_manifests",
+    "delete_orphans",
+]
+
+
+# the name a manifest is given when kept alongside the files it lists, eg: in
+# an archive, or a remote storage.
+MANIFEST_NAME = "staticpub-manifest.json"
+
+
+class ManifestError(ValueError):
+    pass
+
+
+def get_default_manifest_path():
+    path = getattr(settings, "STATICPUB_MANIFEST", None)
+    if path is None:
+        base_dir = getattr(settings, "BASE_DIR", os.getcwd())
+        path = os.path.join(base_dir, "var", "staticpub-manifest.json")
+    return os.fspath(path)
+
+
+def shard_of(url, count):
+    """
+    Which of `count` shards a URL belongs to, numbered from 1. Uses a hash of
+    the URL rather than `hash()`, so every machine agrees.
+
+    >>> shard_of('/', 1)
+    1
+    """
+    digest = hashlib.md5(url.encode("utf-8")).hexdigest()
+    return int(digest, 16) % count + 1
+
+
+def urls_digest(urls):
+    """
+    Identifies a set of collected URLs regardless of their order, so that
+    shards may check they were all given the same site to build.
+    """
+    digest = hashlib.sha1()
+    for url in sorted(set(urls)):
+        digest.update(url.encode("utf-8"))
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+
+def pages_written(write_results):
+    """
+    The names of the files written for each page, by its URL, eg: the page
+    itself and its compressed siblings.
+    """
+    pages = {}
+    for write_result in write_results:
+        if write_result is not None and write_result.url is not None:
+            pages.setdefault(write_result.url, set()).add(write_result.name)
+    return pages
+
+
+def describe_storage(storage):
+    """
+    Where a storage writes to, eg: its class and directory, or bucket, so a
+    build can tell whether a previous manifest lists files in the same place.
+    """
+    cls = type(storage)
+    where = (getattr(storage, name, None) for name in ("bucket_name", "location"))
+    return "{module}.{name}:{where}".format(
+        module=cls.__module__,
+        name=cls.__qualname__,
+        where="/".join(os.fspath(x) for x in where if x),
+    )
+
+
+class Shard(namedtuple("Shard", "index count")):
+    """
+    The `index`th of `count` disjoint slices of a site, numbered from 1.
+    """
+
+    __slots__ = ()
+
+    def __str__(self):
+        return "{index}/{count}".format(index=self.index, count=self.count)
+
+    def __contains__(self, url):
+        return shard_of(url, self.count) == self.index
+
+    @classmethod
+    def parse(cls, value):
+        """
+        >>> Shard.parse('2/3')
+        Shard(index=2, count=3)
+        """
+        try:
+            index, count = (int(x) for x in value.split("/"))
+        except (AttributeError, ValueError):
+            raise ManifestError(
+                "{value!r} isn't a shard, which should look like K/N".format(
+                    value=value
+                )
+            )
+        if not 1 <= index <= count:
+            raise ManifestError(
+                "Shard {index}/{count} should be between 1/{count} and "
+                "{count}/{count}".format(index=index, count=count)
+            )
+        return cls(index=index, count=count)
+
+    def select(self, urls):
+        return tuple(url for url in urls if url in self)
+
+    def path(self, path):
+        """
+        A per-shard variation of a path, so that several shards may be run
+        side by side without sharing a journal or manifest.
+
+        >>> Shard(2, 3).path('var/manifest.json')
+        'var/manifest.2-of-3.json'
+        """
+        root, ext = os.path.splitext(path)
+        return "{root}.{index}-of-{count}{ext}".format(
+            root=root, index=self.index, count=self.count, ext=ext
+        )
+
+
+class Manifest(object):
+    """
+    The files written by a build, mapped to the md5 of their content, along
+    with the URLs read to produce them, any which failed, the files written
+    for each page, which shard (if any) of which set of collected URLs was
+    built, and the storage written to. A manifest is marked `dirty` while a
+    build is replacing it, as the storage may no longer match what it says.
+    """
+
+    __slots__ = (
+        "files",
+        "urls",
+        "failed",
+        "pages",
+        "shard",
+        "collected",
+        "storage",
+        "dirty",
+    )
+
+    def __init__(
+        self,
+        files=None,
+        urls=(),
+        failed=(),
+        pages=None,
+        shard=None,
+        collected=None,
+        storage=None,
+        dirty=False,
+    ):
+        self.files = dict(files or {})
+        self.urls = set(urls)
+        self.failed = set(failed)
+        self.pages = {url: set(names) for url, names in (pages or {}).items()}
+        self.shard = shard
+        self.collected = collected
+        self.storage = storage
+        self.dirty = dirty
+
+    def __repr__(self):
+        return "<%(mod)s.%(cls)s shard=%(shard)s files=%(files)d>" % {
+            "mod": self.__module__,
+            "cls": self.__class__.__name__,
+            "shard": self.shard,
+            "files": len(self.files),
+        }
+
+    def __len__(self):
+        return len(self.files)
+
+    def __contains__(self, name):
+        return name in self.files
+
+    def add(self, urls=(), files=(), pages=None):
+        """
+        Records URLs as built, the (name, md5) of each file written, and the
+        names of the files written for each page's URL, which replace any
+        written for that page before.
+        """
+        self.urls.update(urls)
+        self.failed.difference_update(urls)
+        self.files.update(files)
+        for url, names in (pages or {}).items():
+            for name in self.pages.get(url, set()) - set(names):
+                self.files.pop(name, None)
+            self.pages[url] = set(names)
+
+    def fail(self, urls):
+        self.failed.update(set(urls) - self.urls)
+
+    def forget(self, names):
+        """
+        Keeps the names of files given, but not their md5s, eg: as they may
+        have been written since, so that anything compared against them reads
+        them back.
+        """
+        for name in names:
+            if name in self.files:
+                self.files[name] = None
+
+    def orphans(self, previous):
+        """
+        The files in a previous manifest which this build didn't write.
+        """
+        return sorted(name for name in previous.files if name not in self.files)
+
+    def as_dict(self):
+        return {
+            "shard": str(self.shard) if self.shard is not None else None,
+            "collected": self.collected,
+            "storage": self.storage,
+            "dirty": self.dirty,
+            "urls": sorted(self.urls),
+            "failed": sorted(self.failed),
+            "files": dict(sorted(self.files.items())),
+            "pages": {url: sorted(names) for url, names in sorted(self.pages.items())},
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        shard = data.get("shard")
+        return cls(
+            files=data.get("files"),
+            urls=data.get("urls", ()),
+            failed=data.get("failed", ()),
+            pages=data.get("pages"),
+            shard=Shard.parse(shard) if shard is not None else None,
+            collected=data.get("collected"),
+            storage=data.get("storage"),
+            dirty=data.get("dirty", False),
+        )
+
+    def write(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        partial = "{path}.partial".format(path=path)
+        with open(partial, "w") as f:
+            json.dump(self.as_dict(), f, indent=1)
+        os.replace(partial, path)
+        return path
+
+    @classmethod
+    def read(cls, path):
+        with open(path, "r") as f:
+            try:
+                return cls.from_dict(json.load(f))
+            except ValueError as e:
+                raise ManifestError("Couldn't read {path}: {e}".format(path=path, e=e))
+
+    @classmethod
+    def for_build(cls, path, build_id):
+        """
+        The manifest at `path`, read once by each process during a build,
+        eg: to know what the previous build wrote, which it doesn't change.
+        """
+        return build_scoped(cls.read, build_id, path)
+
+
+def merge_manifests(manifests):
+    """
+    Combines the partial manifests written by each shard of a build into one,
+    raising ManifestError listing every problem found: shards missing or
+    built twice, shards of different sets of URLs, files written with
+    different content by more than one shard, and URLs which no shard managed
+    to build. A file may be written by several shards alike, eg: the page a
+    URL in one shard redirects to, where that page's URL is in another.
+    """
+    manifests = tuple(manifests)
+    problems = []
+    if not manifests:
+        raise ManifestError("No manifests to merge")
+
+    shards = [manifest.shard for manifest in manifests]
+    if None in shards:
+        problems.append("Can't merge the manifest of a build which wasn't sharded")
+    counts = set(shard.count for shard in shards if shard is not None)
+    if len(counts) > 1:
+        problems.append(
+            "Can't merge shards of {counts} ways".format(
+                counts=" and ".join(str(x) for x in sorted(counts))
+            )
+        )
+    elif counts:
+        count = counts.pop()
+        indexes = [shard.index for shard in shards if shard is not None]
+        for index in range(1, count + 1):
+            if index not in indexes:
+                problems.append(
+                    "Shard {index}/{count} is missing".format(index=index, count=count)
+                )
+            elif indexes.count(index) > 1:
+                problems.append(
+                    "Shard {index}/{count} appears {times} times".format(
+                        index=index, count=count, times=indexes.count(index)
+                    )
+                )
+
+    collected = set(
+        json.dumps(manifest.collected, sort_keys=True) for manifest in manifests
+    )
+    if len(collected) > 1:
+        problems.append("Shards were given different sets of URLs to build")
+
+    merged = Manifest(collected=manifests[0].collected, storage=manifests[0].storage)
+    owners = {}
+    md5s = {}
+    for manifest in manifests:
+        for name, md5 in manifest.files.items():
+            owners.setdefault(name, []).append(manifest.shard)
+            md5s.setdefault(name, set()).add(md5)
+        merged.files.update(manifest.files)
+        merged.urls.update(manifest.urls)
+        merged.pages.update(manifest.pages)
+    for manifest in manifests:
+        merged.fail(manifest.failed)
+
+    for name, written_by in sorted(owners.items()):
+        if len(md5s[name]) > 1:
+            problems.append(
+                "{name} was written by shards {shards}".format(
+                    name=name, shards=", ".join(str(x) for x in written_by)
+                )
+            )
+    for url in sorted(merged.failed):
+        problems.append("{url} failed to build".format(url=url))
+    if merged.collected is not None:
+        unaccounted = merged.collected["count"] - len(merged.urls | merged.failed)
+        if unaccounted > 0:
+            problems.append(
+                "{num} collected URLs weren't built by any shard".format(
+                    num=unaccounted
+                )
+            )
+
+    if problems:
+        raise ManifestError("\n".join(problems))
+    return merged
+
+
+def delete_orphans(storage, names, batch_size=1000, threads=8):
+    """
+    Deletes files from a storage in batches, yielding each batch once it's
+    gone. A storage with a `delete_many(names)` method (eg: one wrapping a
+    bucket's bulk delete API) is given a whole batch at a time; otherwise the
+    files of a batch are deleted a few at a time in threads.
+    """
+    delete_many = getattr(storage, "delete_many", None)
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for batch in chunked(names, batch_size):
+            if delete_many is not None:
+                delete_many(batch)
+            else:
+                tuple(executor.map(storage.delete, batch))
+            yield batch
@@ -0,0 +1,124 @@
+"""
+A cache which lasts only as long as a build, for the fragments which every
+page of a site shares (eg: navigation, footers, sidebars), so they're worked
+out once by each process reading pages, rather than once per page. Unlike
+Django's `CACHES`, which may be a dummy backend while building, nothing is
+kept between builds, so there's nothing to invalidate.
+
+Outside of a build (eg: when the site is served as usual) nothing is cached,
+and every call is made as if the cache wasn't there. A build only uses its
+cache in the thread it's reading a page in, so that any other thread (eg:
+one serving requests) is unaffected.
+"""
+
+from functools import wraps
+import threading
+
+from staticpub.utils import build_scoped
+
+__all__ = [
+    "BuildCache",
+    "get_build_cache",
+    "build_cached",
+]
+
+_local = threading.local()
+
+
+def get_active():
+    """
+    The caches in use in this thread, innermost last.
+    """
+    try:
+        return _local.active
+    except AttributeError:
+        _local.active = []
+        return _local.active
+
+
+class BuildCache(object):
+    """
+    Values worked out during a build, by key, and how often each was asked
+    for again.
+    """
+
+    __slots__ = ("values", "hits", "misses", "_lock")
+
+    def __init__(self):
+        self.values = {}
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.RLock()
+
+    def __repr__(self):
+        return "<%(mod)s.%(cls)s keys=%(keys)d hits=%(hits)d misses=%(misses)d>" % {
+            "mod": self.__module__,
+            "cls": self.__class__.__name__,
+            "keys": len(self.values),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def __enter__(self):
+        get_active().append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        get_active().remove(self)
+        return None
+
+    @classmethod
+    def for_build(cls, build_id):
+        """
+        Shared by every reader in this process during one build, so that
+        fragments are worked out once per process rather than once per chunk
+        of URLs.
+        """
+        return build_scoped(cls, build_id)
+
+    def get_or_set(self, key, func):
+        """
+        The value cached for `key`, calling `func` for it if there isn't one.
+        """
+        with self._lock:
+            if key in self.values:
+                self.hits += 1
+                return self.values[key]
+            self.misses += 1
+            value = self.values[key] = func()
+            return value
+
+    def clear(self):
+        with self._lock:
+            self.values.clear()
+
+
+def get_build_cache():
+    """
+    The cache of the build reading a page in this thread, if there is one.
+    """
+    active = get_active()
+    if not active:
+        return None
+    return active[-1]
+
+
+def build_cached(func):
+    """
+    Caches the result of a function for the rest of the build, by its
+    arguments, which must be hashable:
+
+        @build_cached
+        def menu_tree(language):
+            return tuple(Page.objects.filter(language=language, in_menu=True))
+    """
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        cache = get_build_cache()
+        if cache is None:
+            return func(*args, **kwargs)
+        key = (func.__module__, func.__qualname__, args, tuple(sorted(kwargs.items())))
+        return cache.get_or_set(key, lambda: func(*args, **kwargs))
+
+    return wrapper
@@ -0,0 +1,190 @@
+from collections import namedtuple
+from contextlib import ExitStack
+import csv
+import json
+from time import perf_counter
+
+from django.db import connections
+
+from staticpub.signals import read_page
+from staticpub.signals import write_page
+
+__all__ = [
+    "QueryCounter",
+    "PageMetrics",
+    "BuildMetrics",
+]
+
+
+class QueryCounter(object):
+    """
+    Counts and times every query executed on any database connection
+    while in use as a context manager.
+    """
+
+    __slots__ = ("count", "duration", "_stack")
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self._stack = None
+
+    def __call__(self, execute, sql, params, many, context):
+        started = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += perf_counter() - started
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        for connection in connections.all():
+            self._stack.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stack.close()
+        self._stack = None
+
+
+class PageMetrics(
+    namedtuple(
+        "PageMetrics",
+        "url filename render_time queries query_time size write_time processing",
+        defaults=(None, None, None, None, None, None),
+    )
+):
+    __slots__ = ()
+
+
+class BuildMetrics(object):
+    """
+    Records a PageMetrics for every page read and written while in use as a
+    context manager, by listening to the `read_page` and `write_page` signals.
+    """
+
+    __slots__ = ("pages",)
+
+    columns = PageMetrics._fields
+    report_keys = (
+        ("render_time", "Slowest renders (seconds)"),
+        ("queries", "Most queries"),
+        ("size", "Largest responses (bytes)"),
+        ("write_time", "Slowest writes (seconds)"),
+    )
+
+    def __init__(self, pages=None):
+        self.pages = dict(pages or {})
+
+    def __repr__(self):
+        return "<%(mod)s.%(cls)s [%(count)d]>" % {
+            "mod": self.__module__,
+            "cls": self.__class__.__name__,
+            "count": len(self.pages),
+        }
+
+    def __len__(self):
+        return len(self.pages)
+
+    def __iter__(self):
+        return iter(self.pages.values())
+
+    def __enter__(self):
+        read_page.connect(self.record_read, weak=False)
+        write_page.connect(self.record_write, weak=False)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        read_page.disconnect(self.record_read)
+        write_page.disconnect(self.record_write)
+
+    def record(self, filename, **values):
+        existing = self.pages.get(filename)
+        if existing is None:
+            existing = PageMetrics(url=values.pop("url", None), filename=filename)
+        elif existing.url is not None:
+            values.pop("url", None)
+        self.pages[filename] = existing._replace(**values)
+
+    def record_read(self, sender, url, response, filename, **kwargs):
+        self.record(
+            filename,
+            url=url,
+            render_time=kwargs.get("duration"),
+            queries=kwargs.get("queries"),
+            query_time=kwargs.get("query_duration"),
+            processing=kwargs.get("processing") or None,
+        )
+
+    def record_write(self, sender, read_result, write_result, **kwargs):
+        self.record(
+            write_result.name,
+            url=read_result.url,
+            size=len(read_result.content),
+            write_time=kwargs.get("duration"),
+        )
+
+    def update(self, other):
+        """
+        Merges metrics recorded elsewhere, eg: in another process.
+        """
+        for page in other:
+            values = {k: v for k, v in page._asdict().items() if v is not None}
+            self.record(values.pop("filename"), **values)
+        return self
+
+    def top(self, key, count):
+        pages = (page for page in self if getattr(page, key) is not None)
+        return sorted(pages, key=lambda page: getattr(page, key), reverse=True)[:count]
+
+    def processor_times(self):
+        """
+        The total time spent in each post-render processor, across all pages.
+        """
+        totals = {}
+        for page in self:
+            for name, duration in page.processing or ():
+                totals[name] = totals.get(name, 0.0) + duration
+        return totals
+
+    def report(self, count):
+        totals = self.processor_times()
+        if totals:
+            yield "Time in each processor (seconds)"
+            for name, duration in sorted(totals.items(), key=lambda x: -x[1]):
+                yield "  {value!s:>12}  {name}".format(
+                    value=round(duration, 4), name=name
+                )
+        for key, title in self.report_keys:
+            pages = self.top(key=key, count=count)
+            if not pages:
+                continue
+            yield title
+            for page in pages:
+                yield "  {value!s:>12}  {name}".format(
+                    value=round(getattr(page, key), 4), name=page.url or page.filename
+                )
+
+    def write_csv(self, fileobj):
+        writer = csv.writer(fileobj)
+        writer.writerow(self.columns)
+        for page in self:
+            if page.processing:
+                page = page._replace(processing=json.dumps(dict(page.processing)))
+            writer.writerow(page)
+
+    def write_json(self, fileobj):
+        pages = []
+        for page in self:
+            page = page._asdict()
+            if page["processing"]:
+                page["processing"] = dict(page["processing"])
+            pages.append(page)
+        json.dump(pages, fileobj, indent=2)
+
+    def export(self, path):
+        with open(path, "w", newline="") as fileobj:
+            if path.endswith(".csv"):
+                return self.write_csv(fileobj)
+            return self.write_json(fileobj)
@@ -1,7 +1,11 @@
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 import hashlib
 import logging
+import re
 from mimetypes import guess_extension
+from time import perf_counter
+from traceback import format_exception, format_exception_only
 
 from django.urls import re_path
 from django.core.exceptions import ImproperlyConfigured
@@ -10,19 +14,30 @@ from django.core.files.storage import storages
 from django.http import HttpResponse, StreamingHttpResponse
 from django.template import TemplateDoesNotExist
 from django.template.loader import render_to_string
+from django.template.loader import select_template
 from django.utils.encoding import force_bytes
 from django.utils.encoding import force_str
 from django.utils.http import url_has_allowed_host_and_scheme as is_safe_url
 
 # noinspection PyUnresolvedReferences
 from urllib.parse import urlparse
+from staticpub.blobs import BlobIndex
+from staticpub.blobs import link_file
+from staticpub.compression import Precompressor
+from staticpub.memo import BuildCache
+from staticpub.metrics import QueryCounter
+from staticpub.processors import get_processors
+from staticpub.processors import process
 from staticpub.signals import reader_started
 from staticpub.signals import read_page
+from staticpub.signals import read_page_failed
 from staticpub.signals import reader_finished
 from staticpub.signals import writer_started
 from staticpub.signals import write_page
 from staticpub.signals import writer_finished
+from staticpub.utils import build_scoped
 from staticpub.utils import is_url_usable
+from staticpub.utils import time_limit
 from os.path import splitext
 
 try:
@@ -31,6 +46,8 @@ except ImportError:  # pragma: no cover
     from django.utils.module_loading import import_by_path as import_string
 from django.conf import settings
 from django.core.paginator import Paginator
+from django.db import connections
+from django.db import reset_queries
 from django.test.client import Client
 from staticpub import defaults
 from posixpath import normpath
@@ -39,9 +56,11 @@ from posixpath import normpath
 __all__ = [
     "URLCollector",
     "URLReader",
+    "RedirectPages",
     "ErrorReader",
     "URLWriter",
     "ModelProducer",
+    "InstanceProducer",
     "SitemapProducer",
     "MedusaProducer",
     "FeedProducer",
@@ -57,6 +76,15 @@ class ReaderError(ValueError):
     pass
 
 
+class ResponseError(ReaderError, AssertionError):
+    """
+    A URL gave a response other than 200 OK. This is also an AssertionError,
+    which is what was raised before it existed.
+    """
+
+    pass
+
+
 class ReadResult(namedtuple("ReadResult", "url filename status content")):
     __slots__ = ()
 
@@ -65,31 +93,157 @@ class ReadResult(namedtuple("ReadResult", "url filename status content")):
 
     def as_urls(self):
         yield re_path(
-            regex=r"^{url}$".format(url=self.url[1:]), name=None, view=self.as_response
+            regex=r"^{url}$".format(url=re.escape(self.url[1:])),
+            name=None,
+            view=self.as_response,
         )
         yield re_path(
-            regex=r"^{url}$".format(url=self.filename), name=None, view=self.as_response
+            regex=r"^{url}$".format(url=re.escape(self.filename)),
+            name=None,
+            view=self.as_response,
         )
 
 
+class RenderTimeout(ReaderError):
+    pass
+
+
+class ReadFailure(namedtuple("ReadFailure", "url error traceback")):
+    __slots__ = ()
+
+
 # this is a class rather than a namedtuple instance itself because otherwise
 # multiprocessint cannot handle cythonized versions:
 # Reason: 'PicklingError("Can't pickle <class 'importlib.WriteResult'>",)'
 class WriteResult(
-    namedtuple("WriteResult", "name created modified md5 storage_result")
+    namedtuple(
+        "WriteResult",
+        "name created modified md5 storage_result url",
+        # the URL of the page the file was written for, if known.
+        defaults=(None,),
+    )
 ):
     __slots__ = ()
 
 
+class BuildChanges(namedtuple("BuildChanges", "created modified deleted")):
+    """
+    The names of the files whose content a build actually changed, eg: for
+    invalidating only those paths in a CDN.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_write_results(cls, write_results, deleted=()):
+        write_results = tuple(x for x in write_results if x is not None)
+        return cls(
+            created=tuple(sorted(x.name for x in write_results if x.created)),
+            modified=tuple(
+                sorted(x.name for x in write_results if x.modified and not x.created)
+            ),
+            deleted=tuple(sorted(deleted)),
+        )
+
+
+class RedirectPages(object):
+    """
+    The redirecting pages built so far, by the URL redirected from and the
+    one redirected to, the template found for each set of candidate
+    templates, and the filenames of those already read. Many URLs may
+    redirect through the same few, so each page is only rendered, and read,
+    once per build.
+    """
+
+    __slots__ = ("pages", "templates", "read")
+
+    def __init__(self):
+        self.pages = {}
+        self.templates = {}
+        self.read = set()
+
+    def __repr__(self):
+        return "<%(mod)s.%(cls)s pages=%(pages)d templates=%(templates)d>" % {
+            "mod": self.__module__,
+            "cls": self.__class__.__name__,
+            "pages": len(self.pages),
+            "templates": len(self.templates),
+        }
+
+    @classmethod
+    def for_build(cls, build_id):
+        """
+        Shared by every reader in this process during one build, so that a
+        redirect read for an earlier chunk of URLs isn't read again.
+        """
+        return build_scoped(cls, build_id)
+
+    def get_template(self, template_names):
+        template_names = tuple(template_names)
+        if template_names not in self.templates:
+            try:
+                self.templates[template_names] = select_template(template_names)
+            except TemplateDoesNotExist:
+                self.templates[template_names] = None
+        template = self.templates[template_names]
+        if template is None:
+            raise TemplateDoesNotExist(", ".join(template_names))
+        return template
+
+    def is_new(self, result):
+        """
+        Whether a result from a reader should be written, being anything but
+        a redirecting page which has been already.
+        """
+        if result is None or result.status is not None:
+            return True
+        if result.filename in self.read:
+            return False
+        self.read.add(result.filename)
+        return True
+
+
 class URLReader(object):
     """
     Given a list of URLs, presumably from a URLCollector, build them to files
     """
 
-    __slots__ = ("urls", "_client", "_content_types")
-
-    def __init__(self, urls):
+    __slots__ = (
+        "urls",
+        "fail_soft",
+        "timeout",
+        "processors",
+        "redirects",
+        "cache",
+        "failures",
+        "_client",
+        "_content_types",
+        "_clear_cache",
+    )
+
+    def __init__(
+        self,
+        urls,
+        fail_soft=False,
+        timeout=None,
+        processors=None,
+        redirects=None,
+        cache=None,
+    ):
         self.urls = tuple(urls)
+        self.fail_soft = fail_soft
+        self.timeout = timeout
+        self.processors = tuple(get_processors(processors))
+        if redirects is None:
+            redirects = RedirectPages()
+        self.redirects = redirects
+        # a cache given to the reader may outlive it, eg: to be shared by
+        # every chunk of URLs a process reads.
+        self._clear_cache = cache is None
+        if cache is None:
+            cache = BuildCache()
+        self.cache = cache
+        self.failures = []
         self._client = None
         self._content_types = None
 
@@ -144,9 +298,13 @@ class URLReader(object):
         return self._content_types
 
     def build_redirect_page(self, url, final_url):
-        urlparts = urlparse(url)
-        url = urlparts.path
+        url = urlparse(url).path
+        key = (url, final_url)
+        if key not in self.redirects.pages:
+            self.redirects.pages[key] = self.render_redirect_page(url, final_url)
+        return self.redirects.pages[key]
 
+    def render_redirect_page(self, url, final_url):
         if not is_safe_url(url, settings.ALLOWED_HOSTS):
             logger.error(
                 "Unable to generate a redirecting page for {url} "
@@ -155,13 +313,12 @@ class URLReader(object):
             return None
 
         try:
-            result = render_to_string(
-                [
+            template = self.redirects.get_template(
+                (
                     normpath("{}/301.html".format(final_url)),
                     normpath("{}/301.html".format(url)),
                     "301.html",
-                ],
-                {"this_url": url, "next_url": final_url},
+                )
             )
         except TemplateDoesNotExist:
             logger.error(
@@ -171,53 +328,113 @@ class URLReader(object):
             )
             return None
 
+        result = template.render({"this_url": url, "next_url": final_url})
         response = HttpResponse(content=result, content_type="text/html")
         filename = self.get_target_filename(url=url, response=response)
-        return ReadResult(
-            url=url, filename=filename, status=None, content=force_bytes(result)
+        content, processing = process(
+            self.processors, url=url, filename=filename, chunks=(force_bytes(result),)
         )
+        return ReadResult(url=url, filename=filename, status=None, content=content)
 
     def build_page(self, url):
-        resp = self.client.get(url, follow=True, **{"HTTP_USER_AGENT": "staticpub"})
-        assert resp.status_code == 200, "Got %(code)d response for %(url)s" % {
-            "code": resp.status_code,
-            "url": url,
-        }
+        started = perf_counter()
+        timeout = RenderTimeout(
+            "Reading %(url)s took longer than %(timeout)s seconds"
+            % {"url": url, "timeout": self.timeout}
+        )
+        try:
+            with time_limit(self.timeout, timeout), QueryCounter() as queries:
+                resp = self.client.get(
+                    url, follow=True, **{"HTTP_USER_AGENT": "staticpub"}
+                )
+                if resp.status_code != 200:
+                    raise ResponseError(
+                        "Got %(code)d response for %(url)s"
+                        % {"code": resp.status_code, "url": url}
+                    )
+
+                # calculate changed URL and redirects if necessary
+                previous_pages = []
+                final_url = url
+                if hasattr(resp, "redirect_chain") and resp.redirect_chain:
+                    previous_pages = resp.redirect_chain[:]
+                    previous_pages.insert(0, (url, 301))  # hack to put in *this* url.
+                    urlparts = urlparse(previous_pages.pop()[0])
+                    final_url = urlparts.path
+
+                filename = self.get_target_filename(url=final_url, response=resp)
+                if resp.streaming is True:
+                    chunks = resp.streaming_content
+                else:
+                    chunks = (resp.content,)
+                response_content, processing = process(
+                    self.processors, url=final_url, filename=filename, chunks=chunks
+                )
+            # only the request and rendering it (a streaming response renders
+            # as it's processed), not the redirect pages, nor whoever is
+            # consuming them.
+            duration = perf_counter() - started
+        except RenderTimeout:
+            # whatever was abandoned may have left a connection mid-query.
+            connections.close_all()
+            raise
+
+        for previous_page, previous_status in previous_pages:
+            yield self.build_redirect_page(url=previous_page, final_url=final_url)
 
-        # calculate changed URL and redirects if necessary
-        if hasattr(resp, "redirect_chain") and resp.redirect_chain:
-            previous_pages = resp.redirect_chain[:]
-            previous_pages.insert(0, (url, 301))  # hack to put in *this* url.
-            final_url = previous_pages.pop()[0]
-            urlparts = urlparse(final_url)
-            url = urlparts.path
-            for previous_page, previous_status in previous_pages:
-                yield self.build_redirect_page(url=previous_page, final_url=url)
-
-        filename = self.get_target_filename(url=url, response=resp)
-        if resp.streaming is True:
-            response_content = b"".join(resp.streaming_content)
-        else:
-            response_content = resp.content
         read_page.send(
             sender=self.__class__,
             instance=self,
-            url=url,
+            url=final_url,
             response=resp,
             filename=filename,
+            duration=duration,
+            queries=queries.count,
+            query_duration=queries.duration,
+            processing=processing,
         )
         yield ReadResult(
-            url=url,
+            url=final_url,
             filename=filename,
             status=resp.status_code,
             content=force_bytes(response_content),
         )
 
+    def fail(self, url, error):
+        logger.error("Unable to read {url}".format(url=url), exc_info=error)
+        failure = ReadFailure(
+            url=url,
+            error="".join(format_exception_only(type(error), error)).strip(),
+            traceback="".join(
+                format_exception(type(error), error, error.__traceback__)
+            ),
+        )
+        self.failures.append(failure)
+        read_page_failed.send(sender=self.__class__, instance=self, failure=failure)
+        return failure
+
     def build(self):
         reader_started.send(sender=self.__class__, instance=self)
         for idx, url in enumerate(self.urls, start=0):
-            for result in self.build_page(url=url):
-                yield result
+            # only in use while reading, rather than while whoever is
+            # consuming this has it, or if they stop part way through.
+            with self.cache:
+                try:
+                    results = tuple(self.build_page(url=url))
+                except Exception as e:
+                    if not self.fail_soft:
+                        raise
+                    self.fail(url=url, error=e)
+                    continue
+            for result in results:
+                # several URLs may redirect through the same page.
+                if self.redirects.is_new(result):
+                    yield result
+            # with DEBUG on, every query is logged, and would otherwise be
+            # kept until the next request.
+            reset_queries()
+        if self._clear_cache:
+            self.cache.clear()
         reader_finished.send(sender=self.__class__, instance=self)
 
     def __call__(self):
@@ -257,22 +474,50 @@ class ErrorReader(object):
         filename = self.reader.get_target_filename(
             url="{error!s}.html".format(error=error), response=response
         )
+        # processed like any other page, eg: to be minified alike.
+        content, processing = process(
+            self.reader.processors,
+            url=None,
+            filename=filename,
+            chunks=(force_bytes(result),),
+        )
         read_page.send(
             sender=self.__class__,
             instance=self,
             url=None,
             response=response,
             filename=filename,
+            processing=processing,
         )
-        return ReadResult(url=None, filename=filename, status=error, content=result)
+        return ReadResult(url=None, filename=filename, status=error, content=content)
 
 
 class URLWriter(object):
-    __slots__ = ("data", "storage")
+    """
+    Writes ReadResults to the storage, leaving any file whose content hasn't
+    changed alone. If given the `previous` build's files (eg: from its
+    manifest) as {name: md5}, those are compared against, rather than reading
+    each file back from the storage.
+    """
 
-    def __init__(self, data):
+    __slots__ = ("data", "storage", "precompressor", "blobs", "previous")
+
+    def __init__(
+        self, data, storage=None, precompressor=None, blobs=None, previous=None
+    ):
         self.data = data
-        self.storage = storages["staticpub"]
+        self.previous = previous
+        if storage is None:
+            storage = storages["staticpub"]
+        self.storage = storage
+        if precompressor is None:
+            precompressor = Precompressor.from_settings()
+        self.precompressor = precompressor or None
+        if not getattr(settings, "STATICPUB_DEDUPLICATE", True):
+            blobs = False
+        if blobs is None:
+            blobs = BlobIndex()
+        self.blobs = blobs if blobs is not False else None
 
     def __repr__(self):
         num = len(self.data)
@@ -289,39 +534,181 @@ class URLWriter(object):
             "urls": urls % {"top3": urls_themselves, "more": remaining},
         }
 
-    def write(self, data):
+    def get_existing_md5(self, name):
+        # a storage may know without reading the file back, eg: an archive.
+        get_md5 = getattr(self.storage, "get_md5", None)
+        if get_md5 is not None:
+            return get_md5(name)
+        with self.storage.open(name, "rb") as f:
+            return hashlib.md5(f.read()).hexdigest()
+
+    def get_existing(self, name):
         """
-        :type data: staticpub.models.ReadResult
+        Whether `name` already exists, and the md5 of its content, if known.
         """
-        name = data.filename
-        content = force_bytes(data.content)
-        content_hash = hashlib.md5(content).hexdigest()
-        content_io = ContentFile(content)
+        if not self.storage.exists(name=name):
+            return False, None
+        if self.previous is not None and self.previous.get(name) is not None:
+            return True, self.previous[name]
+        # the previous build didn't write it, or it may have been written since.
+        return True, self.get_existing_md5(name)
+
+    def link(self, name, md5):
+        """
+        Makes `name` a link to a file with the same content already written
+        during this build, without needing the content itself, returning a
+        WriteResult, or None if there's no such file, or it can't be linked.
+        """
+        existing = self.blobs.find(md5, name)
+        if existing is None:
+            return None
+        file_exists, existing_md5 = self.get_existing(name)
+        modified = existing_md5 != md5
+        if modified and not link_file(self.storage, existing, name):
+            return None
+        self.blobs.add(md5, name)
+        return WriteResult(
+            name=name,
+            created=not file_exists,
+            modified=modified,
+            md5=md5,
+            storage_result=name,
+        )
 
-        file_exists = self.storage.exists(name=name)
-        if file_exists:
-            self.storage.delete(name=name)
-        result = self.storage.save(name=name, content=content_io)
-        write_result = WriteResult(
+    def save(self, name, content):
+        content_hash = hashlib.md5(content).hexdigest()
+        file_exists, existing_md5 = self.get_existing(name)
+        modified = existing_md5 != content_hash
+        existing = None
+        if modified and self.blobs is not None:
+            existing = self.blobs.find(content_hash, name)
+        if not modified:
+            # leave it be, so its modification time still says when the
+            # content last changed.
+            result = name
+        elif existing is not None and link_file(self.storage, existing, name):
+            # the same content was written already during this build.
+            result = name
+        else:
+            if file_exists:
+                self.storage.delete(name=name)
+            result = self.storage.save(name=name, content=ContentFile(content))
+        if self.blobs is not None:
+            self.blobs.add(content_hash, name)
+        return WriteResult(
             name=name,
             created=not file_exists,
-            modified=True,
+            modified=modified,
             md5=content_hash,
             storage_result=result,
         )
+
+    def write(self, data):
+        """
+        :type data: staticpub.models.ReadResult
+        """
+        started = perf_counter()
+        write_result = self.save(
+            name=data.filename, content=force_bytes(data.content)
+        )._replace(url=data.url)
         write_page.send(
             sender=self.__class__,
             instance=self,
             read_result=data,
             write_result=write_result,
+            duration=perf_counter() - started,
         )
         return write_result
 
+    def write_precompressed(self, write_result, content):
+        """
+        Writes a compressed sibling of a page for each of the precompressor's
+        encodings, returning a WriteResult for each. If the page hasn't changed
+        and its siblings are already there, they're left as they are. Any
+        sibling which isn't worth having any more, eg: as the page is now
+        smaller than `min_size`, is deleted, so it isn't served instead.
+        """
+        names = tuple(
+            write_result.name + extension
+            for extension in self.precompressor.extensions()
+        )
+        # a page which hasn't changed may have become too small to compress,
+        # eg: if `min_size` was raised.
+        if not write_result.modified and len(content) >= self.precompressor.min_size:
+            existing = tuple(self.get_existing(x) for x in names)
+            if all(md5 is not None for file_exists, md5 in existing):
+                return tuple(
+                    WriteResult(
+                        name=name,
+                        created=False,
+                        modified=False,
+                        md5=md5,
+                        storage_result=name,
+                    )
+                    for name, (file_exists, md5) in zip(names, existing)
+                )
+        siblings = None
+        if self.blobs is not None:
+            siblings = self.blobs.siblings.get(write_result.md5)
+        if siblings is not None:
+            # another page with this content was compressed already, so link
+            # to its siblings rather than compressing it all over again.
+            linked = tuple(
+                self.link(name=write_result.name + extension, md5=md5)
+                for extension, md5 in siblings
+            )
+            if None not in linked:
+                self.delete_stale(names, written=linked)
+                return linked
+        written = tuple(
+            self.save(name=write_result.name + extension, content=compressed)
+            for extension, compressed in self.precompressor.compress(content)
+        )
+        if self.blobs is not None:
+            self.blobs.siblings.setdefault(
+                write_result.md5,
+                tuple((x.name[len(write_result.name) :], x.md5) for x in written),
+            )
+        self.delete_stale(names, written=written)
+        return written
+
+    def delete_stale(self, names, written):
+        """
+        Deletes whichever of `names` exists but wasn't just `written`.
+        """
+        written = set(x.name for x in written)
+        for name in names:
+            if name in written:
+                continue
+            if self.previous is not None:
+                exists = name in self.previous
+            else:
+                exists = self.storage.exists(name=name)
+            if exists:
+                self.storage.delete(name=name)
+
     def build(self):
         writer_started.send(sender=self.__class__, instance=self)
-        for idx, data in enumerate(self.data, start=0):
-            write_result = self.write(data)
-            yield write_result
+        if self.precompressor is None:
+            for idx, data in enumerate(self.data, start=0):
+                write_result = self.write(data)
+                yield write_result
+        else:
+            # compress in threads, so the next page may be written meanwhile.
+            with ThreadPoolExecutor(max_workers=self.precompressor.threads) as pool:
+                pending = []
+                for data in self.data:
+                    write_result = self.write(data)
+                    future = pool.submit(
+                        self.write_precompressed,
+                        write_result,
+                        force_bytes(data.content),
+                    )
+                    pending.append((write_result.url, future))
+                    yield write_result
+                for url, future in pending:
+                    for sibling in future.result():
+                        yield sibling._replace(url=url)
         writer_finished.send(sender=self.__class__, instance=self)
 
     def __call__(self):
@@ -481,6 +868,21 @@ class ModelProducer(object):
         return frozenset(self.get_urls())
 
 
+class InstanceProducer(ModelProducer):
+    """
+    The URLs of particular model instances, as a ModelProducer of their
+    model would give for them.
+    """
+
+    __slots__ = ("instances",)
+
+    def __init__(self, instances):
+        self.instances = tuple(instances)
+
+    def get_paginated_queryset(self):
+        return self.instances
+
+
 class SitemapProducer(object):
     """
     Given a standard Django Sitemap class, this exposes enough functionality
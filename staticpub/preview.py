@@ -0,0 +1,264 @@
+import hashlib
+import re
+from mimetypes import guess_type
+from os.path import splitext
+from posixpath import normpath
+
+from django.conf import settings
+from django.core.files.storage import storages
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+
+from staticpub import defaults
+from staticpub.models import ReaderError
+from staticpub.models import URLReader
+from staticpub.models import URLWriter
+from staticpub.utils import is_url_usable
+
+__all__ = [
+    "PreviewIndex",
+    "StoragePreview",
+]
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+BLOCK_SIZE = 64 * 1024
+
+
+def guess_content_type(filename):
+    """
+    >>> guess_content_type('a/b/index.html')
+    'text/html; charset=utf-8'
+    >>> guess_content_type('a/b/feed.atom')
+    'application/atom+xml'
+    """
+    content_type, encoding = guess_type(filename, strict=False)
+    if content_type is None:
+        return "application/octet-stream"
+    if content_type.startswith("text/"):
+        content_type = "{type}; charset={charset}".format(
+            type=content_type, charset=settings.DEFAULT_CHARSET
+        )
+    return content_type
+
+
+class PreviewIndex(object):
+    """
+    Serves a set of ReadResult instances by exact lookup on either the URL
+    they were read from, or the filename they would be written to.
+    """
+
+    __slots__ = ("pages",)
+
+    def __init__(self, read_results):
+        pages = {}
+        filenames = []
+        for read_result in read_results:
+            if read_result is None or read_result.url is None:
+                continue
+            pages.setdefault(read_result.url.lstrip("/"), read_result)
+            filenames.append(read_result)
+        # URLs take precedence over filenames, should the two ever collide.
+        for read_result in filenames:
+            pages.setdefault(read_result.filename, read_result)
+        self.pages = pages
+
+    def __repr__(self):
+        return "<%(mod)s.%(cls)s [%(count)d]>" % {
+            "mod": self.__module__,
+            "cls": self.__class__.__name__,
+            "count": len(self.pages),
+        }
+
+    def __len__(self):
+        return len(self.pages)
+
+    def get(self, path):
+        return self.pages.get(path.lstrip("/"))
+
+    def __call__(self, request, path=""):
+        read_result = self.get(path)
+        if read_result is None:
+            raise Http404("%(path)s was not read during this build" % {"path": path})
+        return HttpResponse(
+            content=read_result.content,
+            status=read_result.status or 200,
+            content_type=guess_content_type(read_result.filename),
+        )
+
+
+def parse_range(header, size):
+    """
+    Parses a single-range `Range` header into inclusive (start, end) offsets.
+    Returns None if the header should be ignored, and False if it can't be
+    satisfied for a body of the given size.
+    >>> parse_range('bytes=0-4', 10)
+    (0, 4)
+    >>> parse_range('bytes=-3', 10)
+    (7, 9)
+    >>> parse_range('bytes=8-', 10)
+    (8, 9)
+    >>> parse_range('bytes=10-', 10)
+    False
+    >>> parse_range('bytes=0-1,4-5', 10) is None
+    True
+    """
+    match = RANGE_RE.match(header or "")
+    if match is None:
+        return None
+    start, end = match.groups()
+    if start == "" and end == "":
+        return None
+    if start == "":
+        length = int(end)
+        if length == 0 or size == 0:
+            return False
+        return (max(size - length, 0), size - 1)
+    start = int(start)
+    end = size - 1 if end == "" else min(int(end), size - 1)
+    if start >= size or end < start:
+        return False
+    return (start, end)
+
+
+def read_blocks(storage, filename, start=0, length=None):
+    """
+    Yields the content of a file in a storage a block at a time, from
+    `start`, and at most `length` bytes of it, if given. The file is only
+    opened once the first block is asked for, and closed once done.
+    """
+    with storage.open(filename, "rb") as f:
+        if start:
+            f.seek(start)
+        remaining = length
+        while remaining is None or remaining > 0:
+            size = BLOCK_SIZE if remaining is None else min(BLOCK_SIZE, remaining)
+            block = f.read(size)
+            if not block:
+                break
+            if remaining is not None:
+                remaining -= len(block)
+            yield block
+
+
+class StoragePreview(object):
+    """
+    Serves previously written pages straight out of a storage backend,
+    optionally reading and writing any page which isn't there yet on the
+    first request for it.
+    """
+
+    __slots__ = ("storage", "render_missing", "index_names")
+
+    def __init__(self, storage=None, render_missing=False):
+        if storage is None:
+            storage = storages["staticpub"]
+        self.storage = storage
+        self.render_missing = render_missing
+        content_types = getattr(
+            settings, "STATICPUB_CONTENT_TYPES", defaults.STATICPUB_CONTENT_TYPES
+        )
+        extensions = [".html"]
+        extensions.extend(content_types.values())
+        self.index_names = tuple(
+            "index{ext}".format(ext=ext) for ext in dict.fromkeys(extensions)
+        )
+
+    def __repr__(self):
+        return "<%(mod)s.%(cls)s storage=%(storage)r render_missing=%(render)r>" % {
+            "mod": self.__module__,
+            "cls": self.__class__.__name__,
+            "storage": self.storage,
+            "render": self.render_missing,
+        }
+
+    def get_filenames(self, path):
+        path = path.lstrip("/")
+        if path == "" or path.endswith("/"):
+            return tuple(
+                normpath("{path}{name}".format(path=path, name=name))
+                for name in self.index_names
+            )
+        if splitext(path)[1] != "":
+            return (normpath(path),)
+        return ()
+
+    def find(self, path):
+        for filename in self.get_filenames(path):
+            if self.storage.exists(filename):
+                return filename
+        return None
+
+    def get_etag(self, filename, size):
+        """
+        Identifies a file's content by its size and modification time, so it
+        needn't be read, or where the storage can't say when the file was
+        modified, by the md5 of its content, read a block at a time.
+        """
+        try:
+            modified = self.storage.get_modified_time(filename)
+        except NotImplementedError:
+            md5 = hashlib.md5()
+            for block in read_blocks(self.storage, filename):
+                md5.update(block)
+            return quote_etag(md5.hexdigest())
+        return quote_etag(
+            "{modified:x}-{size:x}".format(
+                modified=int(modified.timestamp() * 1000000), size=size
+            )
+        )
+
+    def render(self, path):
+        url = "/{path}".format(path=path.lstrip("/"))
+        if not is_url_usable(url):
+            return None
+        try:
+            read_results = tuple(URLReader(urls=[url])())
+        except (AssertionError, ReaderError):
+            return None
+        tuple(URLWriter(data=read_results, storage=self.storage)())
+        return self.find(path)
+
+    def __call__(self, request, path=""):
+        filename = self.find(path)
+        if filename is None and self.render_missing:
+            filename = self.render(path)
+        if filename is None:
+            raise Http404(
+                "%(path)s does not exist in %(storage)r"
+                % {
+                    "path": path,
+                    "storage": self.storage,
+                }
+            )
+
+        size = self.storage.size(filename)
+        etag = self.get_etag(filename, size)
+        content_type = guess_content_type(filename)
+
+        # the file is only read if the response's content is, so not at all
+        # for a 304 or 416.
+        byte_range = parse_range(request.META.get("HTTP_RANGE"), size)
+        if byte_range is False:
+            response = HttpResponse(status=416, content_type=content_type)
+            response["Content-Range"] = "bytes */{size}".format(size=size)
+        elif byte_range is not None:
+            start, end = byte_range
+            response = StreamingHttpResponse(
+                read_blocks(
+                    self.storage, filename, start=start, length=end + 1 - start
+                ),
+                status=206,
+                content_type=content_type,
+            )
+            response["Content-Range"] = "bytes {start}-{end}/{size}".format(
+                start=start, end=end, size=size
+            )
+            response["Content-Length"] = end + 1 - start
+        else:
+            response = StreamingHttpResponse(
+                read_blocks(self.storage, filename), content_type=content_type
+            )
+            response["Content-Length"] = size
+        response["ETag"] = etag
+        response["Accept-Ranges"] = "bytes"
+        return get_conditional_response(request, etag=etag, response=response)
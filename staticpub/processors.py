@@ -0,0 +1,115 @@
+"""
+Post-render processors transform a page's content between it being read and
+written, eg: to minify it, or rewrite URLs. Each processor is called with the
+page's final `url` (None for the error pages), the `filename` it'll be written
+to, and an iterable of `chunks` of bytes, and should return an iterable of
+bytes. Redirecting pages and error pages are processed too. Returning a
+generator which handles one chunk at a time lets a streaming response be
+processed as it's rendered; anything which needs the whole page may use
+`content_processor`.
+"""
+
+from functools import wraps
+import re
+from time import perf_counter
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+__all__ = [
+    "content_processor",
+    "spaceless_html",
+    "get_processors",
+    "process",
+]
+
+
+def content_processor(func):
+    """
+    Adapts a function taking and returning the whole content of a page, as
+    `func(url, filename, content)`, to be used as a processor.
+    """
+
+    @wraps(func)
+    def processor(url, filename, chunks):
+        yield func(url, filename, b"".join(chunks))
+
+    return processor
+
+
+SPACE_BETWEEN_TAGS_RE = re.compile(rb">\s+<")
+
+
+@content_processor
+def spaceless_html(url, filename, content):
+    """
+    Removes whitespace between HTML tags, as Django's `{% spaceless %}` does.
+
+    >>> b''.join(spaceless_html('/', 'index.html', [b'<p>\\n  <b>a</b>\\n</p>']))
+    b'<p><b>a</b></p>'
+    """
+    if not filename.endswith(".html"):
+        return content
+    return SPACE_BETWEEN_TAGS_RE.sub(b"><", content)
+
+
+def get_processors(processors=None):
+    """
+    Yields the name and callable of each processor, taken from the
+    `STATICPUB_PROCESSORS` setting unless given. Classes are instantiated
+    once, and the instance called for every page.
+    """
+    if processors is None:
+        processors = getattr(settings, "STATICPUB_PROCESSORS", ())
+    for processor in processors:
+        if isinstance(processor, str):
+            name = processor
+            processor = import_string(processor)
+        else:
+            name = getattr(processor, "__qualname__", processor.__class__.__name__)
+        if isinstance(processor, type):
+            processor = processor()
+        yield name, processor
+
+
+class Timed(object):
+    """
+    Wraps an iterator, keeping a running total of the time spent getting
+    each item out of it.
+    """
+
+    __slots__ = ("iterator", "elapsed")
+
+    def __init__(self, iterable, elapsed=0.0):
+        self.iterator = iter(iterable)
+        self.elapsed = elapsed
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        started = perf_counter()
+        try:
+            return next(self.iterator)
+        finally:
+            self.elapsed += perf_counter() - started
+
+
+def process(processors, url, filename, chunks):
+    """
+    Runs chunks of content through each processor in turn, returning the
+    resulting content, and the time spent in each processor. As the
+    processors are chained together, the time spent getting each chunk out of
+    one includes the time spent in all those before it, so that's subtracted.
+    """
+    stages = [Timed(chunks)]
+    for name, processor in processors:
+        started = perf_counter()
+        output = processor(url, filename, stages[-1])
+        stages.append(Timed(output, elapsed=perf_counter() - started))
+    content = b"".join(stages[-1])
+    timings = tuple(
+        (name, max(stage.elapsed - previous.elapsed, 0.0))
+        for (name, processor), previous, stage in zip(processors, stages, stages[1:])
+    )
+    return content, timings
@@ -0,0 +1,81 @@
+from datetime import timedelta
+from time import monotonic
+
+__all__ = [
+    "Progress",
+]
+
+
+class Progress(object):
+    """
+    Accumulates page and byte counts reported by (possibly many) workers, and
+    writes a single summary line at most once every `interval` seconds, rather
+    than a line per page.
+    """
+
+    __slots__ = (
+        "stdout",
+        "label",
+        "total",
+        "processes",
+        "interval",
+        "clock",
+        "count",
+        "size",
+        "busy",
+        "started",
+        "last_written",
+    )
+
+    def __init__(self, stdout, label, total, processes=1, interval=2.0, clock=None):
+        self.stdout = stdout
+        self.label = label
+        self.total = total
+        self.processes = processes
+        self.interval = interval
+        self.clock = clock or monotonic
+        self.count = 0
+        self.size = 0
+        self.busy = 0.0
+        self.started = self.clock()
+        self.last_written = self.started
+
+    def __repr__(self):
+        return "<%(mod)s.%(cls)s %(label)s %(count)d/%(total)d>" % {
+            "mod": self.__module__,
+            "cls": self.__class__.__name__,
+            "label": self.label,
+            "count": self.count,
+            "total": self.total,
+        }
+
+    def format(self, now):
+        elapsed = max(now - self.started, 1e-9)
+        rate = self.count / elapsed
+        parts = [
+            "{label} {count}/{total} pages".format(
+                label=self.label, count=self.count, total=self.total
+            ),
+            "{rate:.1f} pages/s".format(rate=rate),
+            "{rate:.2f} MB/s".format(rate=self.size / elapsed / 1000000),
+        ]
+        if 0 < self.count < self.total:
+            remaining = (self.total - self.count) / rate
+            parts.append("ETA {eta!s}".format(eta=timedelta(seconds=int(remaining))))
+        if self.busy:
+            utilisation = self.busy / (elapsed * self.processes)
+            parts.append("workers {busy:.0%} busy".format(busy=min(utilisation, 1)))
+        return ", ".join(parts)
+
+    def update(self, count, size=0, busy=0.0):
+        self.count += count
+        self.size += size
+        self.busy += busy
+        now = self.clock()
+        if self.stdout is not None and now - self.last_written >= self.interval:
+            self.last_written = now
+            self.stdout.write(self.format(now=now))
+
+    def finish(self):
+        if self.stdout is not None:
+            self.stdout.write(self.format(now=self.clock()))
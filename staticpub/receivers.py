@@ -1,6 +1,8 @@
-from staticpub.models import ModelProducer
+from staticpub.models import BuildChanges
+from staticpub.models import InstanceProducer
 from staticpub.models import URLReader
 from staticpub.models import URLWriter
+from staticpub.signals import build_finished
 
 __all__ = ["build_page_for_obj"]
 
@@ -12,14 +14,13 @@ def build_page_for_obj(sender, instance, **kwargs):
         - post_save
     and will attempt to build the single obj's URL.
     """
-
-    class PseudoModelProducer(ModelProducer):
-        def get_paginated_queryset(self):
-            return (instance,)
-
-    instance_urls = PseudoModelProducer()()
+    instance_urls = InstanceProducer(instances=(instance,))()
     read = tuple(URLReader(urls=instance_urls)())
     written = tuple(URLWriter(data=read)())
+    build_finished.send(
+        sender=build_page_for_obj,
+        changes=BuildChanges.from_write_results(written),
+    )
     return (read, written)
 
 
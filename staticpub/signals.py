@@ -10,6 +10,8 @@ reader_finished = Signal()
 
 read_page = Signal()
 
+read_page_failed = Signal()
+
 write_page = Signal()
 
 writer_started = Signal()
@@ -0,0 +1,138 @@
+"""
+Building only part of a site, eg: the section whose template was just fixed,
+by choosing which producers to run, giving URLs outright, and filtering
+whichever URLs are collected by glob or regular expression.
+"""
+
+from collections import namedtuple
+from fnmatch import translate
+import re
+import sys
+
+__all__ = [
+    "SubsetError",
+    "URLFilter",
+    "get_producer_name",
+    "select_producers",
+    "read_url_file",
+]
+
+
+class SubsetError(ValueError):
+    pass
+
+
+def get_producer_name(producer):
+    """
+    The dotted path of a producer, as given in `STATICPUB_PRODUCERS`, or of
+    the class or function given there.
+
+    >>> get_producer_name('myapp.producers.Posts')
+    'myapp.producers.Posts'
+    """
+    if isinstance(producer, str):
+        return producer
+    if not hasattr(producer, "__qualname__"):
+        producer = type(producer)
+    return "{module}.{name}".format(
+        module=producer.__module__, name=producer.__qualname__
+    )
+
+
+def select_producers(names, producers):
+    """
+    The producers named, by their full dotted path or just the end of it (eg:
+    the class name), in the order they're given in `producers`, which aren't
+    imported to do so.
+
+    >>> select_producers(['Posts'], ['a.Pages', 'b.Posts'])
+    ('b.Posts',)
+    """
+    producers = tuple(producers)
+    paths = tuple(get_producer_name(x) for x in producers)
+    selected = set()
+    for name in names:
+        found = [
+            index
+            for index, path in enumerate(paths)
+            if path == name or path.endswith(".{name}".format(name=name))
+        ]
+        if not found:
+            raise SubsetError(
+                "There's no producer called {name!r}; choose from {paths}".format(
+                    name=name, paths=", ".join(paths) or "nothing"
+                )
+            )
+        selected.update(found)
+    return tuple(
+        producer for index, producer in enumerate(producers) if index in selected
+    )
+
+
+def compile_pattern(pattern):
+    """
+    A glob (where `*` also matches `/`) for the whole URL, or, if prefixed
+    with `re:`, a regular expression to search it for.
+
+    >>> bool(compile_pattern('/blog/*').search('/en/blog/'))
+    False
+    """
+    if pattern.startswith("re:"):
+        try:
+            return re.compile(pattern[3:])
+        except re.error as e:
+            raise SubsetError(
+                "{pattern!r} isn't a regular expression: {e}".format(
+                    pattern=pattern, e=e
+                )
+            )
+    # anchored at the start too, as the pattern is searched for.
+    return re.compile(r"\A" + translate(pattern))
+
+
+class URLFilter(namedtuple("URLFilter", "include exclude")):
+    """
+    Keeps the URLs which match any of the `include` patterns, if there are
+    any, and none of the `exclude` patterns.
+
+    >>> urls = URLFilter.parse(include=['/blog/*'], exclude=['re:/2019/'])
+    >>> urls.select(['/', '/blog/', '/blog/2019/a/', '/blog/2020/b/'])
+    ('/blog/', '/blog/2020/b/')
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def parse(cls, include=(), exclude=()):
+        return cls(
+            include=tuple(compile_pattern(x) for x in include or ()),
+            exclude=tuple(compile_pattern(x) for x in exclude or ()),
+        )
+
+    @property
+    def empty(self):
+        return not self.include and not self.exclude
+
+    def matches(self, url):
+        if self.include and not any(x.search(url) for x in self.include):
+            return False
+        return not any(x.search(url) for x in self.exclude)
+
+    def select(self, urls):
+        return tuple(url for url in urls if self.matches(url))
+
+
+def read_url_file(path):
+    """
+    The URLs listed in a file, one per line, ignoring blank lines and those
+    starting with `#`. A path of `-` reads them from stdin.
+    """
+    if path == "-":
+        lines = sys.stdin.readlines()
+    else:
+        with open(path, "r") as f:
+            lines = f.readlines()
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith("#"):
+            yield line
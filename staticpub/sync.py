@@ -0,0 +1,103 @@
+"""
+Copies a site built into one storage (eg: a local directory, written at disk
+speed) to another (eg: a bucket, where every request has some latency),
+uploading only the files whose content differs from the remote manifest, a
+few at a time in threads.
+"""
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
+import json
+
+from django.core.files.base import ContentFile
+from django.core.files.base import File
+
+from staticpub.manifest import MANIFEST_NAME
+from staticpub.manifest import Manifest
+from staticpub.manifest import ManifestError
+
+__all__ = [
+    "SyncPlan",
+    "read_remote_manifest",
+    "write_remote_manifest",
+    "upload_many",
+]
+
+
+class SyncPlan(namedtuple("SyncPlan", "upload delete unchanged")):
+    """
+    The files to `upload`, because the remote copy is missing or has
+    different content, the files to `delete`, because the local build no
+    longer has them, and the number left `unchanged`.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_manifests(cls, local, remote=None):
+        """
+        >>> plan = SyncPlan.from_manifests(
+        ...     Manifest(files={'a': '1', 'b': '2'}),
+        ...     Manifest(files={'a': '1', 'b': '0', 'c': '3'}))
+        >>> plan
+        SyncPlan(upload=('b',), delete=('c',), unchanged=1)
+        """
+        remote_files = remote.files if remote is not None else {}
+        upload = tuple(
+            sorted(
+                name
+                for name, md5 in local.files.items()
+                if remote_files.get(name) != md5
+            )
+        )
+        delete = tuple(local.orphans(remote)) if remote is not None else ()
+        return cls(upload=upload, delete=delete, unchanged=len(local) - len(upload))
+
+
+def read_remote_manifest(storage, name=MANIFEST_NAME):
+    """
+    The manifest last synced to a storage, or None if there isn't one, in
+    which case every file will be uploaded.
+    """
+    if not storage.exists(name):
+        return None
+    with storage.open(name, "rb") as f:
+        try:
+            return Manifest.from_dict(json.loads(f.read().decode("utf-8")))
+        except ValueError as e:
+            raise ManifestError(
+                "Couldn't read {name} from {storage!r}: {e}".format(
+                    name=name, storage=storage, e=e
+                )
+            )
+
+
+def write_remote_manifest(storage, manifest, name=MANIFEST_NAME):
+    """
+    Should only be done once every file has been uploaded, so that an
+    interrupted sync is carried on by the next one, rather than forgotten.
+    """
+    data = json.dumps(manifest.as_dict(), indent=1).encode("utf-8")
+    if storage.exists(name):
+        storage.delete(name)
+    return storage.save(name, ContentFile(data))
+
+
+def upload(source, destination, name):
+    with source.open(name, "rb") as f:
+        if destination.exists(name):
+            destination.delete(name)
+        destination.save(name, File(f))
+    return name
+
+
+def upload_many(source, destination, names, threads=8):
+    """
+    Copies files from one storage to another, `threads` at a time, yielding
+    each name as its upload finishes.
+    """
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        futures = [executor.submit(upload, source, destination, name) for name in names]
+        for future in as_completed(futures):
+            yield future.result()
@@ -1,5 +1,7 @@
 from django.core.exceptions import ImproperlyConfigured
 from staticpub.models import collect, read, write
+from staticpub.models import BuildChanges
+from staticpub.signals import build_finished
 
 try:
     from celery import shared_task
@@ -20,4 +22,7 @@ def build_all():
 def build_single(url):
     read_ = tuple(read(urls=[url]))
     written = tuple(write(data=read_))
+    build_finished.send(
+        sender=build_single, changes=BuildChanges.from_write_results(written)
+    )
     return (read_, written)
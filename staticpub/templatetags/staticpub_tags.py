@@ -0,0 +1,58 @@
+from django import template
+from django.utils.encoding import force_str
+
+from staticpub.memo import get_build_cache
+
+register = template.Library()
+
+
+class BuildCacheNode(template.Node):
+    def __init__(self, nodelist, name, vary_on):
+        self.nodelist = nodelist
+        self.name = name
+        self.vary_on = vary_on
+
+    def __repr__(self):
+        return "<%(mod)s.%(cls)s name=%(name)r>" % {
+            "mod": self.__module__,
+            "cls": self.__class__.__name__,
+            "name": self.name.token,
+        }
+
+    def render(self, context):
+        cache = get_build_cache()
+        if cache is None:
+            return self.nodelist.render(context)
+        key = (
+            "buildcache",
+            force_str(self.name.resolve(context)),
+            tuple(force_str(x.resolve(context)) for x in self.vary_on),
+        )
+        return cache.get_or_set(key, lambda: self.nodelist.render(context))
+
+
+@register.tag("buildcache")
+def do_buildcache(parser, token):
+    """
+    Renders its contents once per build (for each of the values it varies
+    on), rather than for every page:
+
+        {% load staticpub_tags %}
+        {% buildcache "footer" LANGUAGE_CODE %}
+            ...
+        {% endbuildcache %}
+
+    Outside of a build, the contents are rendered every time.
+    """
+    nodelist = parser.parse(("endbuildcache",))
+    parser.delete_first_token()
+    bits = token.split_contents()
+    if len(bits) < 2:
+        raise template.TemplateSyntaxError(
+            "%r tag requires at least 1 argument, a name." % bits[0]
+        )
+    return BuildCacheNode(
+        nodelist,
+        name=parser.compile_filter(bits[1]),
+        vary_on=tuple(parser.compile_filter(x) for x in bits[2:]),
+    )
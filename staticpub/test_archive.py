@@ -0,0 +1,144 @@
+from io import StringIO
+import json
+import os
+from shutil import rmtree
+import tarfile
+from unittest.mock import patch
+import zipfile
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile
+from django.core.files.storage import storages
+from django.core.management import call_command
+from django.core.management import CommandError
+from django.test.utils import override_settings
+from django.urls import reverse
+from staticpub.archive import ArchiveStorage
+from staticpub.archive import guess_format
+from staticpub.archive import MANIFEST_NAME
+from staticpub.manifest import Manifest
+from staticpub.models import ReadResult
+from staticpub.models import URLWriter
+import pytest
+
+ROOT = os.path.join(settings.BASE_DIR, "var", "test_collectstatic", "archive")
+
+
+class ContentProducer:
+    def __call__(self):
+        yield reverse("content_a")
+        yield reverse("content_b")
+
+
+def read_members(path):
+    if path.endswith(".zip"):
+        with zipfile.ZipFile(path) as archive:
+            return {name: archive.read(name) for name in archive.namelist()}
+    if path.endswith(".tar.zst"):
+        zstandard = pytest.importorskip("zstandard")
+        with open(path, "rb") as f:
+            reader = zstandard.ZstdDecompressor().stream_reader(f)
+            with tarfile.open(fileobj=reader, mode="r|") as archive:
+                return {
+                    member.name: archive.extractfile(member).read()
+                    for member in archive
+                }
+    with tarfile.open(path) as archive:
+        return {
+            member.name: archive.extractfile(member).read()
+            for member in archive.getmembers()
+        }
+
+
+def test_guess_format():
+    assert guess_format("site.tar") == "tar"
+    assert guess_format("site.tgz") == "tar.gz"
+    assert guess_format("site.tar.gz") == "tar.gz"
+    assert guess_format("site.tar.zst") == "tar.zst"
+    assert guess_format("site.zip") == "zip"
+    with pytest.raises(ImproperlyConfigured):
+        guess_format("site.rar")
+
+
+@pytest.mark.parametrize(
+    "filename", ["site.tar", "site.tar.gz", "site.tar.zst", "site.zip"]
+)
+def test_archive_roundtrip(filename):
+    if filename.endswith(".zst"):
+        pytest.importorskip("zstandard")
+    rmtree(path=ROOT, ignore_errors=True)
+    path = os.path.join(ROOT, filename)
+    storage = ArchiveStorage(path=path)
+    storage.save("a/index.html", ContentFile(b"a"))
+    storage.save("a/index.html.gz", ContentFile(b"\x1f\x8b"))
+    assert storage.exists("a/index.html") is True
+    assert storage.exists("b/index.html") is False
+    assert os.path.exists(path) is False
+    manifest = Manifest()
+    manifest.add(urls=["/a/"], files=storage.md5s.items())
+    assert storage.close(manifest=manifest) == path
+    assert os.path.exists(storage.partial_path) is False
+
+    members = read_members(path)
+    assert members["a/index.html"] == b"a"
+    assert members["a/index.html.gz"] == b"\x1f\x8b"
+    embedded = Manifest.from_dict(json.loads(members[MANIFEST_NAME]))
+    assert embedded.files == manifest.files
+
+
+def test_writer_skips_unchanged_content_in_archive():
+    rmtree(path=ROOT, ignore_errors=True)
+    storage = ArchiveStorage(path=os.path.join(ROOT, "writer.tar"))
+    page = ReadResult(url="/a/", filename="a/index.html", status=200, content=b"a")
+    first = tuple(URLWriter(data=(page,), storage=storage, precompressor=False)())
+    with patch.object(storage, "add") as add:
+        second = tuple(URLWriter(data=(page,), storage=storage, precompressor=False)())
+    assert add.called is False
+    assert first[0].created is True
+    assert second[0].modified is False
+    storage.close()
+
+
+def test_collectstaticsite_archive():
+    rmtree(path=ROOT, ignore_errors=True)
+    NEW_STATIC_ROOT = os.path.join(ROOT, "storage")
+    path = os.path.join(ROOT, "site.tar.gz")
+    stdout = StringIO()
+    with patch.object(storages["staticpub"], "location", NEW_STATIC_ROOT):
+        with override_settings(STATICPUB_PRODUCERS=[ContentProducer]):
+            call_command(
+                "collectstaticsite",
+                interactive=False,
+                archive=path,
+                manifest=os.path.join(ROOT, "manifest.json"),
+                journal=os.path.join(ROOT, "journal.jsonl"),
+                stdout=stdout,
+            )
+    # nothing went into the storage ...
+    assert os.path.exists(NEW_STATIC_ROOT) is False
+    # ... it's all in the archive.
+    members = read_members(path)
+    assert sorted(members) == [
+        "401.html",
+        "403.html",
+        "404.html",
+        "500.html",
+        "content/a/b/index.html",
+        "content/a/index.html",
+        MANIFEST_NAME,
+    ]
+    embedded = json.loads(members[MANIFEST_NAME])
+    with open(os.path.join(ROOT, "manifest.json")) as f:
+        assert embedded == json.load(f)
+    assert "Wrote 6 files into {path}".format(path=path) in stdout.getvalue()
+
+
+def test_collectstaticsite_archive_refuses_resume():
+    with pytest.raises(CommandError):
+        call_command(
+            "collectstaticsite",
+            interactive=False,
+            archive=os.path.join(ROOT, "site.tar"),
+            resume=True,
+            stdout=StringIO(),
+        )
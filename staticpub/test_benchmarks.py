@@ -0,0 +1,57 @@
+import json
+import os
+from shutil import rmtree
+from django.conf import settings
+from django.core.files.storage import storages
+from django.test.utils import override_settings
+from benchmarks.run import compare
+from benchmarks.run import get_parser
+from benchmarks.run import get_settings
+from benchmarks.run import run_benchmarks
+import pytest
+
+
+@pytest.mark.django_db
+def test_benchmarks_smoke():
+    NEW_STATIC_ROOT = os.path.join(
+        settings.BASE_DIR, "var", "test_collectstatic", "benchmarks", "smoke"
+    )
+    rmtree(path=NEW_STATIC_ROOT, ignore_errors=True)
+    options = get_parser().parse_args([])
+    benchmark_settings = get_settings(options, directory=NEW_STATIC_ROOT)
+    for name in ("BASE_DIR", "STATICPUB_MANIFEST", "STATICPUB_JOURNAL"):
+        assert benchmark_settings[name].startswith(NEW_STATIC_ROOT)
+    with override_settings(
+        ROOT_URLCONF="benchmarks.site",
+        STATICPUB_PRODUCERS=("benchmarks.site.producer",),
+        STATICPUB_BENCHMARK={"pages": 5, "page_size": 100, "queries": 1},
+        STORAGES=dict(settings.STORAGES, **benchmark_settings["STORAGES"]),
+    ):
+        # written to the given directory, not wherever it's run from.
+        location = os.path.abspath(storages["staticpub"].location)
+        assert location.startswith(NEW_STATIC_ROOT + os.sep)
+        results = run_benchmarks(repeat=2, directory=NEW_STATIC_ROOT)
+        assert storages["staticpub"].location == location
+    assert [result.stage for result in results] == [
+        "collect",
+        "read",
+        "write",
+        "collectstaticsite",
+    ]
+    assert all(result.pages == 5 for result in results)
+    # each attempt builds a site of its own.
+    for attempt in ("write-1", "write-2", "collectstaticsite-1", "collectstaticsite-2"):
+        path = os.path.join(NEW_STATIC_ROOT, attempt)
+        assert os.path.exists(os.path.join(path, "site", "page", "4", "index.html"))
+    assert os.path.exists(
+        os.path.join(NEW_STATIC_ROOT, "collectstaticsite-2", "staticpub-manifest.json")
+    )
+
+    previous = json.loads(
+        json.dumps(
+            {"results": [r._replace(pages_per_second=1e12)._asdict() for r in results]}
+        )
+    )
+    compared = list(compare(results, previous, tolerance=0.1))
+    assert len(compared) == 4
+    assert all(is_regression for line, is_regression in compared)
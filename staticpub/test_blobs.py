@@ -0,0 +1,146 @@
+import os
+from shutil import rmtree
+import tarfile
+from unittest.mock import patch
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.core.files.storage import InMemoryStorage
+from django.test.utils import override_settings
+from staticpub.archive import ArchiveStorage
+from staticpub.blobs import BlobIndex
+from staticpub.compression import Precompressor
+from staticpub.models import ReadResult
+from staticpub.models import URLWriter
+
+ROOT = os.path.join(settings.BASE_DIR, "var", "test_collectstatic", "blobs")
+EMPTY = b"<p>Nothing to see here.</p>\n" * 100
+
+
+def pages(*names, content=EMPTY):
+    return tuple(
+        ReadResult(url="/%s/" % name, filename=name, status=200, content=content)
+        for name in names
+    )
+
+
+class CopyingStorage(InMemoryStorage):
+    """
+    As a storage which can copy a file on the server might.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.copied = []
+        super().__init__(*args, **kwargs)
+
+    def link(self, existing, name):
+        self.copied.append((existing, name))
+        with self.open(existing) as f:
+            if self.exists(name):
+                self.delete(name)
+            self.save(name, f)
+        return True
+
+
+def test_index():
+    index = BlobIndex()
+    index.add("1", "a.html")
+    index.add("1", "b.html")
+    assert index.find("1", "b.html") == "a.html"
+    assert index.find("1", "a.html") is None
+    assert index.find("2", "c.html") is None
+    # a.html has new content, so can't stand in for the old any more.
+    index.add("2", "a.html")
+    assert index.find("1", "c.html") is None
+    assert index.find("2", "c.html") == "a.html"
+
+
+def test_index_for_build():
+    first = BlobIndex.for_build("first")
+    assert BlobIndex.for_build("first") is first
+    assert BlobIndex.for_build("second") is not first
+    assert BlobIndex.for_build("first") is not first
+
+
+def test_writer_hardlinks_duplicates():
+    rmtree(path=ROOT, ignore_errors=True)
+    storage = FileSystemStorage(location=ROOT)
+    writer = URLWriter(
+        data=pages("a.html", "b.html") + pages("c.html", content=b"c"),
+        storage=storage,
+        precompressor=False,
+    )
+    with patch.object(storage, "save", wraps=storage.save) as save:
+        written = tuple(writer())
+    assert [call[1]["name"] for call in save.call_args_list] == ["a.html", "c.html"]
+    assert [(x.name, x.created, x.modified) for x in written] == [
+        ("a.html", True, True),
+        ("b.html", True, True),
+        ("c.html", True, True),
+    ]
+    assert written[0].md5 == written[1].md5
+    assert os.path.samefile(storage.path("a.html"), storage.path("b.html"))
+    with storage.open("b.html") as f:
+        assert f.read() == EMPTY
+
+    # rewriting one leaves the other alone.
+    tuple(URLWriter(data=pages("a.html", content=b"a"), storage=storage)())
+    with storage.open("b.html") as f:
+        assert f.read() == EMPTY
+
+
+def test_writer_links_compressed_siblings():
+    rmtree(path=ROOT, ignore_errors=True)
+    storage = FileSystemStorage(location=ROOT)
+    precompressor = Precompressor(encodings=["gzip"], threads=1)
+    writer = URLWriter(
+        data=pages("a.html", "b.html"), storage=storage, precompressor=precompressor
+    )
+    with patch.object(
+        precompressor.__class__, "compress", wraps=precompressor.compress
+    ) as compress:
+        written = tuple(writer())
+    assert compress.call_count == 1
+    assert sorted(x.name for x in written) == [
+        "a.html",
+        "a.html.gz",
+        "b.html",
+        "b.html.gz",
+    ]
+    assert os.path.samefile(storage.path("a.html.gz"), storage.path("b.html.gz"))
+
+
+def test_writer_uses_storage_link():
+    storage = CopyingStorage()
+    written = tuple(URLWriter(data=pages("a.html", "b.html"), storage=storage)())
+    assert storage.copied == [("a.html", "b.html")]
+    assert written[1].modified is True
+    with storage.open("b.html") as f:
+        assert f.read() == EMPTY
+
+
+def test_writer_saves_duplicates_when_it_cant_link():
+    storage = InMemoryStorage()
+    written = tuple(URLWriter(data=pages("a.html", "b.html"), storage=storage)())
+    assert [x.created for x in written] == [True, True]
+    with storage.open("b.html") as f:
+        assert f.read() == EMPTY
+
+
+def test_deduplication_may_be_turned_off():
+    assert URLWriter(data=()).blobs is not None
+    assert URLWriter(data=(), blobs=False).blobs is None
+    with override_settings(STATICPUB_DEDUPLICATE=False):
+        assert URLWriter(data=()).blobs is None
+
+
+def test_archive_links_duplicates():
+    rmtree(path=ROOT, ignore_errors=True)
+    path = os.path.join(ROOT, "site.tar")
+    storage = ArchiveStorage(path=path)
+    tuple(URLWriter(data=pages("a.html", "b.html"), storage=storage)())
+    storage.close()
+    with tarfile.open(path) as archive:
+        b = archive.getmember("b.html")
+        assert b.islnk() is True
+        assert b.linkname == "a.html"
+        assert archive.extractfile(b).read() == EMPTY
@@ -46,6 +46,7 @@ def test_building_a_single_item():
                 modified=True,
                 md5="95792493d34debeaee4af352d18f1c76",
                 storage_result="content/a/index.html",
+                url="/content/a/",
             ),
         ),
     )
@@ -1,4 +1,33 @@
+from unittest.mock import patch
+from django.core.management import CommandError
 from django.test.utils import override_settings
+from django.urls import reverse
+import pytest
+
+
+class ContentProducer:
+    def __call__(self):
+        yield reverse("content_a")
+        yield reverse("content_b")
+        yield reverse("redirect_a")
+
+
+class MarkingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.marked = True
+        return self.get_response(request)
+
+
+class RequiringMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.marked
+        return self.get_response(request)
 
 
 @override_settings()
@@ -53,3 +82,110 @@ def test_setting_is_not_a_string_to_import():
     appconfigs = apps.get_app_configs()
     output = check_producers_setting(appconfigs)
     assert output == []
+
+
+def test_read_database_needs_the_router():
+    from staticpub.checks import check_read_database_router
+
+    assert check_read_database_router(None) == []
+    with override_settings(STATICPUB_READ_DATABASE="replica"):
+        (error,) = check_read_database_router(None)
+        assert error.id == "staticpub.E005"
+        with override_settings(DATABASE_ROUTERS=["staticpub.db.BuildRouter"]):
+            assert check_read_database_router(None) == []
+
+
+def test_performance_checks_pass():
+    from django.core.checks import run_checks
+    from staticpub.checks import PERFORMANCE_TAG
+
+    assert run_checks(tags=[PERFORMANCE_TAG], include_deployment_checks=True) == []
+    # only run by `check --deploy`.
+    assert run_checks(tags=[PERFORMANCE_TAG]) == []
+
+
+@override_settings(DEBUG=True)
+def test_debug_is_on():
+    from django.core.checks import run_checks
+    from staticpub.checks import PERFORMANCE_TAG
+
+    output = run_checks(tags=[PERFORMANCE_TAG], include_deployment_checks=True)
+    assert [x.id for x in output] == ["staticpub.W101"]
+
+
+def test_template_loader_is_not_cached():
+    from django.template import engines
+    from django.template.loaders.filesystem import Loader
+    from staticpub.checks import check_template_loaders
+
+    engine = engines["django"].engine
+    with patch.object(engine, "template_loaders", [Loader(engine)]):
+        output = check_template_loaders(None)
+    assert [x.id for x in output] == ["staticpub.W102"]
+    assert "django template engine" in output[0].msg
+
+
+def test_slow_middleware():
+    from django.conf import settings
+    from staticpub.checks import check_slow_middleware
+
+    middleware = list(settings.MIDDLEWARE)
+    middleware.append("debug_toolbar.middleware.DebugToolbarMiddleware")
+    with override_settings(MIDDLEWARE=middleware):
+        output = check_slow_middleware(None)
+    assert [x.id for x in output] == ["staticpub.W103"]
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}}
+)
+def test_dummy_cache():
+    from staticpub.checks import check_dummy_cache
+
+    output = check_dummy_cache(None)
+    assert [x.id for x in output] == ["staticpub.W104"]
+    assert "'default'" in output[0].msg
+
+
+def test_time_middleware():
+    from staticpub.checks import time_middleware
+
+    urls = [reverse("content_a")]
+    with override_settings(
+        MIDDLEWARE=[
+            "staticpub.test_checks.MarkingMiddleware",
+            "staticpub.test_checks.RequiringMiddleware",
+        ]
+    ):
+        timings = tuple(time_middleware(urls, repeat=1))
+    assert [x[0] for x in timings] == [
+        "staticpub.test_checks.MarkingMiddleware",
+        "staticpub.test_checks.RequiringMiddleware",
+    ]
+    assert timings[0][1] > 0
+    assert timings[0][2] is None
+    assert timings[1][2] > 0
+
+
+def test_collectstaticsite_warns_about_performance():
+    from io import StringIO
+    from django.core.management import call_command
+
+    stderr = StringIO()
+    with override_settings(DEBUG=True, STATICPUB_PRODUCERS=[]):
+        with pytest.raises(CommandError):
+            call_command("collectstaticsite", interactive=False, stderr=stderr)
+    assert "staticpub.W101" in stderr.getvalue()
+
+
+def test_collectstaticsite_check_performance():
+    from io import StringIO
+    from django.core.management import call_command
+
+    stdout = StringIO()
+    with override_settings(STATICPUB_PRODUCERS=[ContentProducer]):
+        call_command("collectstaticsite", check_performance=2, stdout=stdout)
+    output = stdout.getvalue()
+    assert "System check identified no issues" in output
+    assert "Timing 2 URLs with and without each middleware" in output
+    assert "django.middleware.common.CommonMiddleware: " in output
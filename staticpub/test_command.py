@@ -1,14 +1,23 @@
 from shutil import rmtree
 from unittest.mock import patch
 from django.utils.encoding import force_bytes
+import hashlib
+import json
 import os
 from django.conf import settings
+from django.core.files.base import ContentFile
 from django.core.files.storage import storages
 from django.core.management import call_command
+from django.core.management import CommandError
 from django.urls import reverse
 from django.test.utils import override_settings
 from io import StringIO
+from staticpub.journal import BuildJournal
+from staticpub.manifest import Manifest
+from staticpub.models import BuildChanges
+from staticpub.models import WriteResult
 from staticpub.models import URLWriter
+from staticpub.signals import build_finished
 import pytest
 
 
@@ -39,7 +48,9 @@ def test_collectstaticsite_goes_ok():
     out = StringIO()
     with override_settings(STATICPUB_PRODUCERS=[DummyProducer]):
         with patch.object(storages["staticpub"], "location", NEW_STATIC_ROOT):
-            output = call_command("collectstaticsite", interactive=False, stdout=out)
+            output = call_command(
+                "collectstaticsite", interactive=False, verbosity=2, stdout=out
+            )
             assert output is None
             stdout = out.getvalue().splitlines()
             assert "Created content/a/index.html" in stdout
@@ -63,3 +74,272 @@ def test_collectstaticsite_goes_ok():
             assert redirect_code in redirect2
             assert storage.open("content/a/index.html").readlines() == [b"content_a"]  # noqa
             assert storage.open("content/a/b/index.html").readlines() == [b"content_b"]  # noqa
+
+
+def test_collectstaticsite_lists_files_only_when_verbose():
+    NEW_STATIC_ROOT = os.path.join(
+        settings.BASE_DIR, "var", "test_collectstatic", "collectstaticsite", "quiet"
+    )
+    rmtree(path=NEW_STATIC_ROOT, ignore_errors=True)
+    out = StringIO()
+    with override_settings(STATICPUB_PRODUCERS=[DummyProducer]):
+        with patch.object(storages["staticpub"], "location", NEW_STATIC_ROOT):
+            call_command("collectstaticsite", interactive=False, stdout=out)
+    stdout = out.getvalue().splitlines()
+    assert "Created content/a/index.html" not in stdout
+    assert "Read /content/a/" not in stdout
+    assert any(line.startswith("Building 2/2 pages, ") for line in stdout)
+
+
+class FailingProducer:
+    def __call__(self):
+        yield reverse("content_a")
+        yield reverse("content_b")
+        yield "/does-not-exist/"
+
+
+def test_collectstaticsite_resume():
+    NEW_STATIC_ROOT = os.path.join(
+        settings.BASE_DIR, "var", "test_collectstatic", "collectstaticsite", "resume"
+    )
+    rmtree(path=NEW_STATIC_ROOT, ignore_errors=True)
+    journal = os.path.join(NEW_STATIC_ROOT, "journal.jsonl")
+    manifest = os.path.join(NEW_STATIC_ROOT, "manifest.json")
+    with patch.object(storages["staticpub"], "location", NEW_STATIC_ROOT):
+        storage = storages["staticpub"]
+        with override_settings(STATICPUB_PRODUCERS=[FailingProducer]):
+            with pytest.raises(AssertionError):
+                call_command(
+                    "collectstaticsite",
+                    interactive=False,
+                    chunk_size=1,
+                    journal=journal,
+                    manifest=manifest,
+                    stdout=StringIO(),
+                )
+        assert os.path.exists(journal) is True
+        entries = tuple(BuildJournal(path=journal).entries())
+        assert all("/does-not-exist/" not in x["urls"] for x in entries)
+
+        # as if the build had stopped once /content/a/ was written.
+        seeded = BuildJournal(path=journal)
+        seeded.reset()
+        storage.delete("content/a/index.html")
+        storage.save("content/a/index.html", ContentFile(b"built before"))
+        seeded.record(
+            urls=["/content/a/"],
+            write_results=[
+                WriteResult(
+                    name="content/a/index.html",
+                    created=True,
+                    modified=True,
+                    md5=hashlib.md5(b"built before").hexdigest(),
+                    storage_result="content/a/index.html",
+                )
+            ],
+        )
+
+        out = StringIO()
+        with override_settings(STATICPUB_PRODUCERS=[DummyProducer]):
+            call_command(
+                "collectstaticsite",
+                interactive=False,
+                resume=True,
+                journal=journal,
+                manifest=manifest,
+                verbosity=2,
+                stdout=out,
+            )
+        with storage.open("content/a/index.html") as f:
+            assert f.read() == b"built before"
+    stdout = out.getvalue().splitlines()
+    assert "Resuming: skipping 1 URLs already built" in stdout
+    assert "Read /content/a/" not in stdout
+    assert "Read /r/a/" in stdout
+    assert "Updated content/a/index.html" not in stdout
+    assert "content/a/index.html" in Manifest.read(manifest)
+    assert os.path.exists(journal) is False
+
+
+def test_collectstaticsite_keep_going():
+    NEW_STATIC_ROOT = os.path.join(
+        settings.BASE_DIR, "var", "test_collectstatic", "collectstaticsite", "keep"
+    )
+    rmtree(path=NEW_STATIC_ROOT, ignore_errors=True)
+    out = StringIO()
+    err = StringIO()
+    options = {
+        "interactive": False,
+        "keep_going": True,
+        "retry_delay": 0,
+        "journal": os.path.join(NEW_STATIC_ROOT, "journal.jsonl"),
+        "stdout": out,
+        "stderr": err,
+    }
+    with override_settings(STATICPUB_PRODUCERS=[FailingProducer]):
+        with patch.object(storages["staticpub"], "location", NEW_STATIC_ROOT):
+            with pytest.raises(CommandError):
+                call_command("collectstaticsite", **options)
+            call_command("collectstaticsite", max_failures=1, **options)
+            storage = storages["staticpub"]
+            assert storage.exists("content/a/index.html")
+            assert storage.exists("content/a/b/index.html")
+    stdout = out.getvalue().splitlines()
+    assert stdout.count("Retrying 1 failed URLs in 0 seconds") == 4
+    stderr = err.getvalue().splitlines()
+    assert (
+        "Failed to read /does-not-exist/: staticpub.models.ResponseError: "
+        "Got 404 response for /does-not-exist/"
+    ) in stderr
+
+
+def test_collectstaticsite_resume_without_journal():
+    NEW_STATIC_ROOT = os.path.join(
+        settings.BASE_DIR, "var", "test_collectstatic", "collectstaticsite", "fresh"
+    )
+    rmtree(path=NEW_STATIC_ROOT, ignore_errors=True)
+    journal = os.path.join(NEW_STATIC_ROOT, "missing", "journal.jsonl")
+    with patch.object(storages["staticpub"], "location", NEW_STATIC_ROOT):
+        with override_settings(STATICPUB_PRODUCERS=[ContentAProducer]):
+            out = StringIO()
+            call_command(
+                "collectstaticsite",
+                interactive=False,
+                resume=True,
+                journal=journal,
+                manifest=os.path.join(NEW_STATIC_ROOT, "manifest.json"),
+                stdout=out,
+            )
+        assert "Resuming: skipping 0 URLs already built" in out.getvalue()
+        assert storages["staticpub"].exists("content/a/index.html")
+    assert os.path.exists(journal) is False
+
+
+def test_collectstaticsite_reports_reading_and_writing_apart():
+    NEW_STATIC_ROOT = os.path.join(
+        settings.BASE_DIR, "var", "test_collectstatic", "collectstaticsite", "phases"
+    )
+    rmtree(path=NEW_STATIC_ROOT, ignore_errors=True)
+    with patch.object(storages["staticpub"], "location", NEW_STATIC_ROOT):
+        with override_settings(STATICPUB_PRODUCERS=[DummyProducer]):
+            out = StringIO()
+            call_command(
+                "collectstaticsite",
+                interactive=False,
+                trace_memory=True,
+                journal=os.path.join(NEW_STATIC_ROOT, "journal.jsonl"),
+                manifest=os.path.join(NEW_STATIC_ROOT, "manifest.json"),
+                stdout=out,
+            )
+    stdout = out.getvalue()
+    assert "Peak memory while reading: " in stdout
+    assert "Peak memory while writing: " in stdout
+    assert "Peak memory while building: " not in stdout
+    assert "seconds writing, across every process" in stdout
+
+
+class MissingProducer:
+    def __call__(self):
+        for num in range(10):
+            yield "/does-not-exist/{num}/".format(num=num)
+
+
+def test_collectstaticsite_stops_once_too_many_fail():
+    NEW_STATIC_ROOT = os.path.join(
+        settings.BASE_DIR, "var", "test_collectstatic", "collectstaticsite", "stop"
+    )
+    rmtree(path=NEW_STATIC_ROOT, ignore_errors=True)
+    options = {
+        "interactive": False,
+        "keep_going": True,
+        "retry_delay": 0,
+        "max_failures": 1,
+        "chunk_size": 1,
+        "journal": os.path.join(NEW_STATIC_ROOT, "journal.jsonl"),
+        "manifest": os.path.join(NEW_STATIC_ROOT, "manifest.json"),
+    }
+    with override_settings(STATICPUB_PRODUCERS=[MissingProducer]):
+        with patch.object(storages["staticpub"], "location", NEW_STATIC_ROOT):
+            out = StringIO()
+            err = StringIO()
+            with pytest.raises(CommandError):
+                call_command(
+                    "collectstaticsite", retries=0, stdout=out, stderr=err, **options
+                )
+            stderr = err.getvalue().splitlines()
+            assert "Stopping, as 2 URLs have failed" in stderr
+            assert len([x for x in stderr if x.startswith("Failed to read ")]) == 2
+            assert "Read " not in out.getvalue()
+
+            # a failure which may yet be retried doesn't stop the build.
+            out = StringIO()
+            err = StringIO()
+            with pytest.raises(CommandError):
+                call_command(
+                    "collectstaticsite", retries=1, stdout=out, stderr=err, **options
+                )
+            assert "Retrying 10 failed URLs in 0 seconds" in out.getvalue()
+            assert "Stopping, as 2 URLs have failed" in err.getvalue()
+
+
+class ContentAProducer:
+    def __call__(self):
+        yield reverse("content_a")
+
+
+def test_collectstaticsite_changes_file():
+    NEW_STATIC_ROOT = os.path.join(
+        settings.BASE_DIR, "var", "test_collectstatic", "collectstaticsite", "changes"
+    )
+    rmtree(path=NEW_STATIC_ROOT, ignore_errors=True)
+    changes_file = os.path.join(NEW_STATIC_ROOT, "changes.json")
+    options = {
+        "interactive": False,
+        "manifest": os.path.join(NEW_STATIC_ROOT, "manifest.json"),
+        "journal": os.path.join(NEW_STATIC_ROOT, "journal.jsonl"),
+        "changes_file": changes_file,
+        "stdout": StringIO(),
+    }
+    sent = []
+
+    def receiver(sender, changes, **kwargs):
+        sent.append(changes)
+
+    build_finished.connect(receiver)
+    try:
+        with patch.object(storages["staticpub"], "location", NEW_STATIC_ROOT):
+            with override_settings(STATICPUB_PRODUCERS=[FailingProducer]):
+                call_command(
+                    "collectstaticsite",
+                    keep_going=True,
+                    retries=0,
+                    max_failures=1,
+                    **options,
+                )
+            with override_settings(STATICPUB_PRODUCERS=[ContentAProducer]):
+                call_command("collectstaticsite", prune=True, **options)
+                with open(changes_file) as f:
+                    changes = json.load(f)
+    finally:
+        build_finished.disconnect(receiver)
+
+    assert sent[0].created == (
+        "401.html",
+        "403.html",
+        "404.html",
+        "500.html",
+        "content/a/b/index.html",
+        "content/a/index.html",
+    )
+    assert sent[0].modified == ()
+    # nothing has changed in the pages which were written again ...
+    assert sent[1] == BuildChanges(
+        created=(),
+        modified=(),
+        deleted=("content/a/b/index.html",),
+    )
+    assert changes == {
+        "created": [],
+        "modified": [],
+        "deleted": ["content/a/b/index.html"],
+    }
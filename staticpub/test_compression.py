@@ -0,0 +1,121 @@
+import gzip
+import os
+from shutil import rmtree
+from unittest.mock import patch
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.test.utils import override_settings
+from staticpub.compression import Precompressor
+from staticpub.models import ReadResult
+from staticpub.models import URLWriter
+import pytest
+
+PAGE = b"<p>Some compressible content.</p>\n" * 100
+
+
+def test_from_settings():
+    with override_settings(STATICPUB_PRECOMPRESS=None):
+        assert Precompressor.from_settings() is None
+    with override_settings(STATICPUB_PRECOMPRESS=True):
+        assert Precompressor.from_settings().min_size == 1024
+    with override_settings(
+        STATICPUB_PRECOMPRESS={"encodings": ["gzip"], "min_size": 10, "threads": 1}
+    ):
+        precompressor = Precompressor.from_settings()
+    assert precompressor.encodings == ("gzip",)
+    assert precompressor.min_size == 10
+    assert precompressor.threads == 1
+
+
+def test_unknown_encoding():
+    with pytest.raises(ImproperlyConfigured):
+        Precompressor(encodings=["zip"])
+
+
+def test_compress_gzip():
+    (extension, compressed), *rest = Precompressor(encodings=["gzip"]).compress(PAGE)
+    assert rest == []
+    assert extension == ".gz"
+    assert gzip.decompress(compressed) == PAGE
+    # the same content always compresses the same way.
+    assert compressed == dict(Precompressor(encodings=["gzip"]).compress(PAGE))[".gz"]
+
+
+def test_compress_brotli():
+    brotli = pytest.importorskip("brotli")
+    compressed = dict(Precompressor(encodings=["br"]).compress(PAGE))
+    assert brotli.decompress(compressed[".br"]) == PAGE
+
+
+def test_compress_skips_small_and_incompressible_content():
+    precompressor = Precompressor(encodings=["gzip"], min_size=1024)
+    assert tuple(precompressor.compress(b"tiny")) == ()
+    assert tuple(precompressor.compress(os.urandom(2048))) == ()
+
+
+def test_writer_writes_precompressed_siblings():
+    NEW_STATIC_ROOT = os.path.join(
+        settings.BASE_DIR, "var", "test_collectstatic", "compression", "siblings"
+    )
+    rmtree(path=NEW_STATIC_ROOT, ignore_errors=True)
+    pages = (
+        ReadResult(url="/a/", filename="a/index.html", status=200, content=PAGE),
+        ReadResult(url="/b/", filename="b/index.html", status=200, content=b"b"),
+    )
+    precompressor = Precompressor(encodings=["gzip"], threads=2)
+    writer = URLWriter(data=pages, precompressor=precompressor)
+    with patch.object(writer.storage, "location", NEW_STATIC_ROOT):
+        written = tuple(writer())
+        assert [x.name for x in written] == [
+            "a/index.html",
+            "b/index.html",
+            "a/index.html.gz",
+        ]
+        assert written[-1].created is True
+        with writer.storage.open("a/index.html.gz") as f:
+            assert gzip.decompress(f.read()) == PAGE
+        assert writer.storage.exists("b/index.html.gz") is False
+
+        with patch.object(writer.storage, "save") as save:
+            rewritten = tuple(writer())
+        assert save.called is False
+        assert rewritten[-1].name == "a/index.html.gz"
+        assert rewritten[-1].modified is False
+        assert rewritten[-1].md5 == written[-1].md5
+
+
+def test_writer_deletes_siblings_no_longer_worth_having():
+    NEW_STATIC_ROOT = os.path.join(
+        settings.BASE_DIR, "var", "test_collectstatic", "compression", "stale"
+    )
+    rmtree(path=NEW_STATIC_ROOT, ignore_errors=True)
+    page = ReadResult(url="/a/", filename="a/index.html", status=200, content=PAGE)
+    precompressor = Precompressor(encodings=["gzip"], threads=2)
+    writer = URLWriter(data=(page,), precompressor=precompressor)
+    with patch.object(writer.storage, "location", NEW_STATIC_ROOT):
+        written = tuple(writer())
+        assert writer.storage.exists("a/index.html.gz")
+
+        # the same page, now too small to be worth compressing.
+        larger = Precompressor(encodings=["gzip"], min_size=len(PAGE) + 1)
+        previous = {x.name: x.md5 for x in written}
+        rewritten = tuple(
+            URLWriter(data=(page,), precompressor=larger, previous=previous)()
+        )
+        assert [x.name for x in rewritten] == ["a/index.html"]
+        assert rewritten[0].modified is False
+        assert writer.storage.exists("a/index.html.gz") is False
+
+        tuple(writer())
+        assert writer.storage.exists("a/index.html.gz")
+        # a page which changed to something too small.
+        small = page._replace(content=b"a")
+        tuple(URLWriter(data=(small,), precompressor=precompressor)())
+        assert writer.storage.exists("a/index.html.gz") is False
+
+
+def test_writer_without_precompressor():
+    with override_settings(STATICPUB_PRECOMPRESS=True):
+        assert URLWriter(data=()).precompressor is not None
+        assert URLWriter(data=(), precompressor=False).precompressor is None
+    assert URLWriter(data=()).precompressor is None
@@ -0,0 +1,108 @@
+import os
+from shutil import rmtree
+import threading
+from unittest.mock import patch
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.storage import storages
+from django.urls import reverse
+from staticpub.daemon import BuildDaemon
+from staticpub.daemon import DaemonError
+from staticpub.daemon import DaemonServer
+from staticpub.daemon import get_instances
+from staticpub.daemon import request_build
+import pytest
+
+ROOT = os.path.join(settings.BASE_DIR, "var", "test_collectstatic", "daemon")
+
+
+@pytest.fixture
+def daemon():
+    rmtree(path=ROOT, ignore_errors=True)
+    daemon = BuildDaemon(path=os.path.join(ROOT, "staticpubd.sock"))
+    with patch.object(storages["staticpub"], "location", os.path.join(ROOT, "site")):
+        daemon.start()
+        thread = threading.Thread(target=daemon.serve_forever)
+        thread.start()
+        try:
+            yield daemon
+        finally:
+            daemon.server.shutdown()
+            thread.join()
+
+
+def test_request_build(daemon):
+    events = tuple(
+        request_build(
+            urls=[reverse("content_a"), reverse("redirect_a"), "/no/such/page/"],
+            path=daemon.path,
+            timeout=10,
+        )
+    )
+    assert [x["event"] for x in events] == [
+        "written",
+        "written",
+        "written",
+        "written",
+        "failed",
+        "done",
+    ]
+    assert events[-2]["url"] == "/no/such/page/"
+    assert events[-1]["changes"]["created"] == [
+        "content/a/b/index.html",
+        "content/a/index.html",
+        "r/a/index.html",
+        "r/a_b/index.html",
+    ]
+    assert storages["staticpub"].exists("content/a/index.html") is True
+
+    # the same daemon, and so the same warm process, builds the next request.
+    events = tuple(
+        request_build(urls=[reverse("content_a")], path=daemon.path, timeout=10)
+    )
+    assert events[0]["modified"] is False
+    assert events[-1]["changes"] == {"created": [], "modified": [], "deleted": []}
+
+
+def test_request_build_bad_object(daemon):
+    events = tuple(request_build(objects=["nope"], path=daemon.path, timeout=10))
+    assert events[0]["event"] == "error"
+    assert "app_label.model_name:pk" in events[0]["error"]
+
+
+def test_daemon_refuses_a_socket_in_use(daemon):
+    with pytest.raises(DaemonError):
+        DaemonServer(daemon.path, daemon=daemon)
+
+
+def test_stale_socket_is_replaced():
+    rmtree(path=ROOT, ignore_errors=True)
+    os.makedirs(ROOT)
+    path = os.path.join(ROOT, "stale.sock")
+    with open(path, "w"):
+        pass
+    server = DaemonServer(path, daemon=None)
+    server.server_close()
+    os.remove(path)
+
+
+@pytest.mark.django_db
+def test_build_objects():
+    rmtree(path=ROOT, ignore_errors=True)
+    user = get_user_model().objects.create(username="daemon")
+    reference = "auth.user:%d" % user.pk
+    assert tuple(get_instances([reference])) == (user,)
+    with pytest.raises(DaemonError):
+        tuple(get_instances(["auth.user:0"]))
+    daemon = BuildDaemon(path=os.path.join(ROOT, "unused.sock"))
+
+    def get_absolute_url(self):
+        return reverse("show_user", kwargs={"pk": self.pk})
+
+    with patch.object(
+        get_user_model(), "get_absolute_url", get_absolute_url, create=True
+    ), patch.object(storages["staticpub"], "location", os.path.join(ROOT, "site")):
+        events = tuple(daemon.handle({"objects": [reference]}))
+    assert events[-1]["changes"]["created"] == ["users/show/%d/index.html" % user.pk]
+    assert tuple(daemon.handle({"ping": True})) == ({"event": "pong"},)
+    assert tuple(daemon.handle([]))[0]["event"] == "error"
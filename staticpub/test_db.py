@@ -0,0 +1,182 @@
+import os
+from io import StringIO
+import threading
+from shutil import rmtree
+from unittest.mock import patch
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import storages
+from django.core.management import CommandError
+from django.core.management import call_command
+from django.db import router
+from django.db.utils import ConnectionHandler
+from django.test import override_settings
+from django.urls import reverse
+from staticpub.db import forget_connections
+from staticpub.db import get_read_database
+from staticpub.db import read_from
+from staticpub.management.commands import collectstaticsite
+import pytest
+
+
+def test_get_read_database():
+    assert get_read_database() is None
+    with override_settings(STATICPUB_READ_DATABASE="replica"):
+        assert get_read_database() == "replica"
+
+
+BUILD_ROUTER = ["staticpub.db.BuildRouter"]
+
+
+@override_settings(DATABASE_ROUTERS=BUILD_ROUTER)
+def test_read_from_routes_reads_only():
+    User = get_user_model()
+    assert router.db_for_read(User) == "default"
+    with read_from("replica"):
+        assert router.db_for_read(User) == "replica"
+        assert router.db_for_write(User) == "default"
+        with read_from("other"):
+            assert router.db_for_read(User) == "other"
+        assert router.db_for_read(User) == "replica"
+    assert router.db_for_read(User) == "default"
+
+
+@override_settings(DATABASE_ROUTERS=BUILD_ROUTER)
+def test_read_from_only_routes_its_own_thread():
+    User = get_user_model()
+    elsewhere = []
+    reading = threading.Event()
+    done = threading.Event()
+
+    def read_elsewhere():
+        reading.wait()
+        elsewhere.append(router.db_for_read(User))
+        done.set()
+
+    thread = threading.Thread(target=read_elsewhere)
+    thread.start()
+    with read_from("replica"):
+        reading.set()
+        done.wait()
+        assert router.db_for_read(User) == "replica"
+    thread.join()
+    assert elsewhere == ["default"]
+
+
+def test_read_from_needs_the_router():
+    before = tuple(router.routers)
+    with pytest.raises(ImproperlyConfigured):
+        with read_from("replica"):
+            pass
+    with read_from(None):
+        assert router.db_for_read(get_user_model()) == "default"
+    assert tuple(router.routers) == before
+
+
+@override_settings(DATABASE_ROUTERS=BUILD_ROUTER)
+def test_read_from_allows_relations_across_the_replica():
+    User = get_user_model()
+    written = User(username="written")
+    written._state.db = "default"
+    read = User(username="read")
+    read._state.db = "replica"
+    elsewhere = User(username="elsewhere")
+    elsewhere._state.db = "elsewhere"
+    assert router.allow_relation(written, read) is False
+    with read_from("replica"):
+        assert router.allow_relation(written, read) is True
+        assert router.allow_relation(written, elsewhere) is False
+
+
+@pytest.mark.django_db
+def test_forget_connections(tmp_path):
+    connections = ConnectionHandler(
+        {
+            "default": {"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:"},
+            "file": {
+                "ENGINE": "django.db.backends.sqlite3",
+                "NAME": str(tmp_path / "db.sqlite3"),
+            },
+            "unused": {
+                "ENGINE": "django.db.backends.sqlite3",
+                "NAME": str(tmp_path / "unused.sqlite3"),
+            },
+        }
+    )
+    connections["default"].ensure_connection()
+    connections["file"].ensure_connection()
+    inherited = connections["file"].connection
+    memory = connections["default"].connection
+    try:
+        assert forget_connections(connections) == 1
+        assert connections["default"].connection is memory
+        assert connections["file"].connection is None
+        # the parent's connection is left open, and a new one is made.
+        connections["file"].ensure_connection()
+        assert connections["file"].connection is not inherited
+        inherited.execute("SELECT 1")
+    finally:
+        connections.close_all()
+        inherited.close()
+
+
+class ReadingProducer:
+    def __call__(self):
+        assert router.db_for_read(get_user_model()) == "default"
+        yield reverse("content_a")
+
+
+def test_collectstaticsite_reads_from_the_read_database():
+    NEW_STATIC_ROOT = os.path.join(
+        settings.BASE_DIR, "var", "test_collectstatic", "collectstaticsite", "db"
+    )
+    rmtree(path=NEW_STATIC_ROOT, ignore_errors=True)
+    read_from_calls = []
+
+    def recording_read_from(alias):
+        read_from_calls.append(alias)
+        return read_from(alias)
+
+    with patch.object(
+        storages["staticpub"], "location", NEW_STATIC_ROOT
+    ), override_settings(
+        STATICPUB_PRODUCERS=[ReadingProducer],
+        STATICPUB_READ_DATABASE="default",
+        DATABASE_ROUTERS=BUILD_ROUTER,
+    ), patch.object(
+        collectstaticsite, "read_from", recording_read_from
+    ):
+        call_command(
+            "collectstaticsite",
+            interactive=False,
+            manifest=os.path.join(NEW_STATIC_ROOT, "manifest.json"),
+            journal=os.path.join(NEW_STATIC_ROOT, "journal.jsonl"),
+            stdout=StringIO(),
+        )
+        assert storages["staticpub"].exists("content/a/index.html") is True
+    # while collecting, and then reading.
+    assert len(read_from_calls) > 1
+    assert set(read_from_calls) == {"default"}
+
+
+def test_collectstaticsite_needs_a_known_read_database():
+    with pytest.raises(CommandError) as exc:
+        call_command(
+            "collectstaticsite",
+            interactive=False,
+            read_database="replica",
+            stdout=StringIO(),
+        )
+    assert "'replica'" in str(exc.value)
+
+
+def test_collectstaticsite_needs_the_router():
+    with pytest.raises(CommandError) as exc:
+        call_command(
+            "collectstaticsite",
+            interactive=False,
+            read_database="default",
+            stdout=StringIO(),
+        )
+    assert "staticpub.db.BuildRouter" in str(exc.value)
@@ -0,0 +1,80 @@
+import os
+import pstats
+from shutil import rmtree
+from django.conf import settings
+from django.urls import reverse
+from staticpub.diagnostics import MemoryTracker
+from staticpub.diagnostics import PageProfiler
+from staticpub.diagnostics import ProcessMemory
+from staticpub.diagnostics import get_rss
+from staticpub.diagnostics import profile_filename
+from staticpub.models import URLReader
+
+
+def test_profile_filename():
+    assert profile_filename("/") == "index-6666cd76.prof"
+    assert profile_filename("/content/a/b/") == "content__a__b-757fd5ab.prof"
+    assert profile_filename("/a/b?c=d") == "a__b_c_d-eee12339.prof"
+    # which would otherwise be the same.
+    assert profile_filename("/a/b/") != profile_filename("/a__b/")
+    assert profile_filename("/a b/") != profile_filename("/a_b/")
+
+
+def test_profiles_pages_over_threshold():
+    directory = os.path.join(
+        settings.BASE_DIR, "var", "test_collectstatic", "diagnostics", "profiles"
+    )
+    rmtree(path=directory, ignore_errors=True)
+    with PageProfiler(threshold=0, directory=directory) as profiler:
+        tuple(URLReader(urls=[reverse("content_a"), reverse("content_b")])())
+    assert sorted(os.listdir(directory)) == [
+        "content__a-061a4d64.prof",
+        "content__a__b-757fd5ab.prof",
+    ]
+    assert len(profiler.profiled) == 2
+    stats = pstats.Stats(os.path.join(directory, "content__a-061a4d64.prof"))
+    assert stats.total_calls > 0
+
+
+def test_skips_pages_under_threshold():
+    directory = os.path.join(
+        settings.BASE_DIR, "var", "test_collectstatic", "diagnostics", "fast"
+    )
+    rmtree(path=directory, ignore_errors=True)
+    with PageProfiler(threshold=60, directory=directory) as profiler:
+        tuple(URLReader(urls=[reverse("content_a")])())
+    assert profiler.profiled == []
+    assert os.path.exists(directory) is False
+
+
+def test_memory_tracker_stages():
+    memory = MemoryTracker()
+    with memory.stage("reading"):
+        data = [bytearray(1024) for _ in range(1024)]
+    with memory.stage("writing"):
+        pass
+    del data
+    assert memory.peaks["reading"] > 1024 * 1024
+    assert memory.peaks["writing"] < memory.peaks["reading"]
+    memory.update({"reading": 1, "collecting": 5})
+    assert memory.peaks["collecting"] == 5
+    assert memory.peaks["reading"] > 1024 * 1024
+    assert next(memory.report()).startswith("Peak memory while reading: ")
+
+
+def test_get_rss():
+    rss = get_rss()
+    assert rss > 1024 * 1024
+
+
+def test_process_memory():
+    memory = ProcessMemory()
+    memory.record(pid=2, rss=3 * 1024 * 1024, pages=10)
+    memory.record(pid=1, rss=1024 * 1024, pages=5)
+    memory.record(pid=2, rss=2 * 1024 * 1024, pages=10)
+    memory.record(pid=3, rss=None, pages=10)
+    assert len(memory) == 2
+    assert tuple(memory.report()) == (
+        "Process 1: 1.0 MiB resident after 5 pages (peak 1.0 MiB)",
+        "Process 2: 2.0 MiB resident after 20 pages (peak 3.0 MiB)",
+    )
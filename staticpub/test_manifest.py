@@ -0,0 +1,568 @@
+from shutil import rmtree
+from unittest.mock import patch
+from io import StringIO
+import json
+import os
+from django.conf import settings
+from django.core.files.storage import storages
+from django.core.management import call_command
+from django.core.management import CommandError
+from django.test.utils import override_settings
+from django.urls import reverse
+from staticpub.manifest import Manifest, ManifestError, Shard, merge_manifests
+from staticpub.manifest import describe_storage, shard_of
+from staticpub.manifest import delete_orphans, urls_digest
+from staticpub.processors import content_processor
+import pytest
+
+
+def test_shard_parse():
+    assert Shard.parse("1/1") == Shard(index=1, count=1)
+    assert Shard.parse("3/4") == Shard(index=3, count=4)
+    assert str(Shard.parse("3/4")) == "3/4"
+
+
+@pytest.mark.parametrize("value", ["", "1", "0/2", "3/2", "a/b", "1/2/3", None])
+def test_shard_parse_invalid(value):
+    with pytest.raises(ManifestError):
+        Shard.parse(value)
+
+
+def test_shards_are_disjoint_and_complete():
+    urls = ["/page/{num}/".format(num=num) for num in range(100)]
+    shards = [Shard(index, 3) for index in range(1, 4)]
+    selected = [shard.select(urls) for shard in shards]
+    assert sum(len(x) for x in selected) == len(urls)
+    assert set().union(*selected) == set(urls)
+    assert all(selected)
+    # stable, regardless of process or order.
+    assert shards[0].select(reversed(urls)) == tuple(reversed(selected[0]))
+
+
+def test_shard_path():
+    assert Shard(2, 3).path("var/manifest.json") == "var/manifest.2-of-3.json"
+    assert Shard(1, 2).path("journal") == "journal.1-of-2"
+
+
+def test_urls_digest_ignores_order_and_duplicates():
+    assert urls_digest(["/a/", "/b/"]) == urls_digest(["/b/", "/a/", "/a/"])
+    assert urls_digest(["/a/"]) != urls_digest(["/a/", "/b/"])
+
+
+def test_manifest_roundtrip(tmpdir):
+    manifest = Manifest(shard=Shard(1, 2), collected={"count": 3, "digest": "x"})
+    manifest.add(
+        urls=["/a/"],
+        files=[("a/index.html", "abc")],
+        pages={"/a/": {"a/index.html"}},
+    )
+    manifest.fail(["/b/", "/a/"])
+    path = manifest.write(os.path.join(str(tmpdir), "manifest.json"))
+    loaded = Manifest.read(path)
+    assert loaded.as_dict() == manifest.as_dict()
+    assert loaded.failed == {"/b/"}
+    assert "a/index.html" in loaded
+    assert len(loaded) == 1
+
+
+def test_describe_storage():
+    storage = storages["staticpub"]
+    with patch.object(storage, "location", "/srv/site"):
+        assert describe_storage(storage) == (
+            "staticpub.defaults.StaticpubFilesStorage:/srv/site"
+        )
+
+
+def test_manifest_add_replaces_a_pages_files():
+    manifest = Manifest()
+    manifest.add(
+        urls=["/a/", "/b/"],
+        files=[("a/index.html", "1"), ("a/index.html.gz", "2"), ("b.html", "3")],
+        pages={"/a/": ["a/index.html", "a/index.html.gz"], "/b/": ["b.html"]},
+    )
+    manifest.add(
+        urls=["/a/"], files=[("a/index.html", "4")], pages={"/a/": ["a/index.html"]}
+    )
+    assert manifest.files == {"a/index.html": "4", "b.html": "3"}
+    assert manifest.pages == {"/a/": {"a/index.html"}, "/b/": {"b.html"}}
+
+
+def make_shard(index, count, urls, files, failed=(), collected=None):
+    manifest = Manifest(
+        shard=Shard(index, count),
+        collected=collected or {"count": 3, "digest": "x"},
+    )
+    manifest.add(urls=urls, files=files)
+    manifest.fail(failed)
+    return manifest
+
+
+def test_merge_manifests():
+    merged = merge_manifests(
+        [
+            make_shard(2, 2, ["/b/", "/c/"], [("b.html", "2"), ("c.html", "3")]),
+            make_shard(1, 2, ["/a/"], [("a.html", "1")]),
+        ]
+    )
+    assert merged.shard is None
+    assert merged.urls == {"/a/", "/b/", "/c/"}
+    assert merged.files == {"a.html": "1", "b.html": "2", "c.html": "3"}
+
+
+def test_merge_manifests_detects_problems():
+    with pytest.raises(ManifestError) as exc:
+        merge_manifests(
+            [
+                make_shard(1, 3, ["/a/"], [("a.html", "1"), ("404.html", "4")]),
+                make_shard(2, 3, ["/b/"], [("b.html", "2"), ("404.html", "5")]),
+                make_shard(2, 3, [], [], failed=["/c/"]),
+            ]
+        )
+    problems = str(exc.value).splitlines()
+    assert problems == [
+        "Shard 2/3 appears 2 times",
+        "Shard 3/3 is missing",
+        "404.html was written by shards 1/3, 2/3",
+        "/c/ failed to build",
+    ]
+
+
+def test_merge_manifests_allows_files_written_alike():
+    merged = merge_manifests(
+        [
+            make_shard(1, 2, ["/a/"], [("a.html", "1"), ("c.html", "3")]),
+            make_shard(2, 2, ["/b/", "/c/"], [("b.html", "2"), ("c.html", "3")]),
+        ]
+    )
+    assert merged.files == {"a.html": "1", "b.html": "2", "c.html": "3"}
+
+
+def test_merge_manifests_detects_unbuilt_urls():
+    with pytest.raises(ManifestError) as exc:
+        merge_manifests(
+            [
+                make_shard(1, 2, ["/a/"], [], collected={"count": 3, "digest": "x"}),
+                make_shard(2, 2, ["/b/"], [], collected={"count": 3, "digest": "x"}),
+            ]
+        )
+    assert str(exc.value) == "1 collected URLs weren't built by any shard"
+
+
+def test_merge_manifests_of_different_sites():
+    with pytest.raises(ManifestError) as exc:
+        merge_manifests(
+            [
+                make_shard(1, 2, ["/a/"], [], collected={"count": 1, "digest": "x"}),
+                make_shard(2, 2, [], [], collected={"count": 1, "digest": "y"}),
+            ]
+        )
+    assert str(exc.value) == "Shards were given different sets of URLs to build"
+
+
+class ShardedProducer:
+    def __call__(self):
+        yield reverse("content_a")
+        yield reverse("content_b")
+        yield reverse("streamable")
+        yield reverse("show_user", kwargs={"pk": 1})
+        yield reverse("show_user", kwargs={"pk": 2})
+
+
+@pytest.mark.django_db
+def test_collectstaticsite_shards_then_mergestaticsite():
+    from django.contrib.auth import get_user_model
+
+    for pk in (1, 2):
+        get_user_model().objects.create(pk=pk, username="user{pk}".format(pk=pk))
+    NEW_STATIC_ROOT = os.path.join(
+        settings.BASE_DIR, "var", "test_collectstatic", "collectstaticsite", "shards"
+    )
+    rmtree(path=NEW_STATIC_ROOT, ignore_errors=True)
+    manifest = os.path.join(NEW_STATIC_ROOT, "manifest.json")
+    built = []
+    with override_settings(
+        STATICPUB_PRODUCERS=[ShardedProducer], STATICPUB_MANIFEST=manifest
+    ):
+        with patch.object(storages["staticpub"], "location", NEW_STATIC_ROOT):
+            for shard in ("1/2", "2/2"):
+                out = StringIO()
+                call_command(
+                    "collectstaticsite",
+                    interactive=False,
+                    shard=shard,
+                    journal=os.path.join(NEW_STATIC_ROOT, "journal.jsonl"),
+                    stdout=out,
+                )
+                built.append(out.getvalue())
+            storage = storages["staticpub"]
+            assert storage.exists("content/a/index.html")
+            assert storage.exists("users/show/2/index.html")
+            assert storage.exists("404.html")
+
+            partials = [Shard(index, 2).path(manifest) for index in (1, 2)]
+            assert all(os.path.exists(path) for path in partials)
+            assert "Building shard 1/2: " in built[0]
+            assert "404.html" in Manifest.read(partials[0])
+            assert "404.html" not in Manifest.read(partials[1])
+
+            with pytest.raises(CommandError):
+                call_command(
+                    "mergestaticsite", partials[0], stdout=StringIO(), stderr=StringIO()
+                )
+            assert os.path.exists(manifest) is False
+
+            out = StringIO()
+            call_command("mergestaticsite", *partials, stdout=out)
+    merged = Manifest.read(manifest)
+    assert len(merged.urls) == 5
+    assert set(merged.files) == {
+        "401.html",
+        "403.html",
+        "404.html",
+        "500.html",
+        "content/a/index.html",
+        "content/a/b/index.html",
+        "streamable/index.html",
+        "users/show/1/index.html",
+        "users/show/2/index.html",
+    }
+    assert out.getvalue().startswith("Merged 2 manifests, of 5 URLs and 9 files")
+
+
+class RedirectingProducer:
+    def __call__(self):
+        # /r/a/ is in shard 2, and redirects through /r/a_b/, in shard 1, to
+        # /content/a/b/, in shard 2, so both shards write the redirect's pages.
+        yield reverse("redirect_a")
+        yield reverse("redirect_b")
+        yield reverse("content_b")
+
+
+def test_collectstaticsite_shards_with_redirects_then_mergestaticsite():
+    assert [shard_of(url, 2) for url in RedirectingProducer()()] == [2, 1, 2]
+    NEW_STATIC_ROOT = os.path.join(
+        settings.BASE_DIR,
+        "var",
+        "test_collectstatic",
+        "collectstaticsite",
+        "sharded_redirects",
+    )
+    rmtree(path=NEW_STATIC_ROOT, ignore_errors=True)
+    manifest = os.path.join(NEW_STATIC_ROOT, "manifest.json")
+    with override_settings(
+        STATICPUB_PRODUCERS=[RedirectingProducer], STATICPUB_MANIFEST=manifest
+    ):
+        with patch.object(storages["staticpub"], "location", NEW_STATIC_ROOT):
+            for shard in ("1/2", "2/2"):
+                call_command(
+                    "collectstaticsite",
+                    interactive=False,
+                    shard=shard,
+                    journal=os.path.join(NEW_STATIC_ROOT, "journal.jsonl"),
+                    stdout=StringIO(),
+                )
+            partials = [Shard(index, 2).path(manifest) for index in (1, 2)]
+            both = set(Manifest.read(partials[0]).files) & set(
+                Manifest.read(partials[1]).files
+            )
+            assert both == {"r/a_b/index.html", "content/a/b/index.html"}
+            out = StringIO()
+            call_command("mergestaticsite", *partials, stdout=out)
+    merged = Manifest.read(manifest)
+    assert merged.urls == {"/r/a/", "/r/a_b/", "/content/a/b/"}
+    assert {
+        "r/a/index.html",
+        "r/a_b/index.html",
+        "content/a/b/index.html",
+    } <= set(merged.files)
+
+
+def test_orphans():
+    previous = Manifest(files={"a.html": "1", "b.html": "2", "c.html": "3"})
+    current = Manifest(files={"b.html": "4", "d.html": "5"})
+    assert current.orphans(previous) == ["a.html", "c.html"]
+
+
+class BulkStorage:
+    def __init__(self):
+        self.batches = []
+
+    def delete_many(self, names):
+        self.batches.append(names)
+
+
+def test_delete_orphans_in_batches_with_delete_many():
+    storage = BulkStorage()
+    batches = tuple(delete_orphans(storage, ["a", "b", "c"], batch_size=2))
+    assert batches == (("a", "b"), ("c",))
+    assert storage.batches == [("a", "b"), ("c",)]
+
+
+def test_delete_orphans_one_by_one(tmpdir):
+    from django.core.files.storage import FileSystemStorage
+    from django.core.files.base import ContentFile
+
+    storage = FileSystemStorage(location=str(tmpdir))
+    for name in ("a.html", "b/index.html", "c.html"):
+        storage.save(name, ContentFile(b"x"))
+    batches = tuple(delete_orphans(storage, ["a.html", "b/index.html"], batch_size=1))
+    assert batches == (("a.html",), ("b/index.html",))
+    assert storage.exists("a.html") is False
+    assert storage.exists("b/index.html") is False
+    assert storage.exists("c.html") is True
+
+
+class UnprunedProducer:
+    def __call__(self):
+        yield reverse("content_a")
+        yield reverse("content_b")
+        yield reverse("streamable")
+
+
+class PrunedProducer:
+    def __call__(self):
+        yield reverse("content_a")
+
+
+def test_collectstaticsite_prune():
+    NEW_STATIC_ROOT = os.path.join(
+        settings.BASE_DIR, "var", "test_collectstatic", "collectstaticsite", "prune"
+    )
+    rmtree(path=NEW_STATIC_ROOT, ignore_errors=True)
+    options = {
+        "interactive": False,
+        "manifest": os.path.join(NEW_STATIC_ROOT, "manifest.json"),
+        "journal": os.path.join(NEW_STATIC_ROOT, "journal.jsonl"),
+    }
+    with patch.object(storages["staticpub"], "location", NEW_STATIC_ROOT):
+        storage = storages["staticpub"]
+        with override_settings(STATICPUB_PRODUCERS=[UnprunedProducer]):
+            out = StringIO()
+            call_command("collectstaticsite", prune=True, stdout=out, **options)
+            assert "Not pruning, as there's no previous manifest at " in out.getvalue()
+        assert storage.exists("streamable/index.html")
+
+        with override_settings(STATICPUB_PRODUCERS=[PrunedProducer]):
+            with patch(
+                "staticpub.management.commands.collectstaticsite.Command.handle_preview",
+                return_value=None,
+            ) as preview:
+                out = StringIO()
+                call_command(
+                    "collectstaticsite", prune=True, dry_run=True, stdout=out, **options
+                )
+            assert preview.called is False
+            stdout = out.getvalue().splitlines()
+            assert "Would delete streamable/index.html" in stdout
+            assert "Would delete content/a/index.html" not in stdout
+            assert "Would delete 404.html" not in stdout
+            assert storage.exists("streamable/index.html")
+
+            out = StringIO()
+            call_command(
+                "collectstaticsite", prune=True, verbosity=2, stdout=out, **options
+            )
+            stdout = out.getvalue().splitlines()
+            assert "Deleted streamable/index.html" in stdout
+            assert "Deleted 2 orphaned files" in stdout
+        assert storage.exists("streamable/index.html") is False
+        assert storage.exists("content/a/b/index.html") is False
+        assert storage.exists("content/a/index.html")
+        assert storage.exists("404.html")
+
+
+def test_collectstaticsite_compares_against_previous_manifest():
+    NEW_STATIC_ROOT = os.path.join(
+        settings.BASE_DIR, "var", "test_collectstatic", "collectstaticsite", "previous"
+    )
+    rmtree(path=NEW_STATIC_ROOT, ignore_errors=True)
+    options = {
+        "interactive": False,
+        "manifest": os.path.join(NEW_STATIC_ROOT, "manifest.json"),
+        "journal": os.path.join(NEW_STATIC_ROOT, "journal.jsonl"),
+    }
+    with override_settings(STATICPUB_PRODUCERS=[UnprunedProducer]):
+        with patch.object(storages["staticpub"], "location", NEW_STATIC_ROOT):
+            call_command("collectstaticsite", stdout=StringIO(), **options)
+            previous = Manifest.read(options["manifest"])
+            assert previous.storage == describe_storage(storages["staticpub"])
+            with patch(
+                "staticpub.models.URLWriter.get_existing_md5",
+                side_effect=AssertionError("read back"),
+            ):
+                out = StringIO()
+                call_command("collectstaticsite", verbosity=2, stdout=out, **options)
+            assert "Created " not in out.getvalue()
+            assert "Updated " not in out.getvalue()
+
+            # a manifest of another destination is ignored.
+            previous.storage = "elsewhere"
+            previous.write(options["manifest"])
+            with patch(
+                "staticpub.models.URLWriter.get_existing_md5", return_value=""
+            ) as get_existing_md5:
+                call_command("collectstaticsite", stdout=StringIO(), **options)
+            assert get_existing_md5.called is True
+    assert Manifest.read(options["manifest"]).storage != "elsewhere"
+
+
+@content_processor
+def replaced(url, filename, content):
+    return b"replaced"
+
+
+def test_collectstaticsite_distrusts_manifest_of_crashed_build():
+    NEW_STATIC_ROOT = os.path.join(
+        settings.BASE_DIR, "var", "test_collectstatic", "collectstaticsite", "crashed"
+    )
+    rmtree(path=NEW_STATIC_ROOT, ignore_errors=True)
+    changes_file = os.path.join(NEW_STATIC_ROOT, "changes.json")
+    options = {
+        "interactive": False,
+        "manifest": os.path.join(NEW_STATIC_ROOT, "manifest.json"),
+        "journal": os.path.join(NEW_STATIC_ROOT, "journal.jsonl"),
+    }
+    with override_settings(STATICPUB_PRODUCERS=[PrunedProducer]):
+        with patch.object(storages["staticpub"], "location", NEW_STATIC_ROOT):
+            storage = storages["staticpub"]
+            call_command("collectstaticsite", stdout=StringIO(), **options)
+            assert Manifest.read(options["manifest"]).dirty is False
+
+            # a build which wrote other content, then died before replacing
+            # the manifest.
+            with override_settings(STATICPUB_PROCESSORS=[replaced]):
+                with patch(
+                    "staticpub.management.commands.collectstaticsite.Command."
+                    "handle_report",
+                    side_effect=RuntimeError("died"),
+                ):
+                    with pytest.raises(RuntimeError):
+                        call_command("collectstaticsite", stdout=StringIO(), **options)
+            assert storage.open("content/a/index.html").read() == b"replaced"
+            previous = Manifest.read(options["manifest"])
+            assert previous.dirty is True
+            assert os.path.exists(options["journal"])
+
+            call_command(
+                "collectstaticsite",
+                changes_file=changes_file,
+                stdout=StringIO(),
+                **options,
+            )
+            assert storage.open("content/a/index.html").read() == b"content_a"
+            with open(changes_file) as f:
+                assert "content/a/index.html" in json.load(f)["modified"]
+            assert Manifest.read(options["manifest"]).dirty is False
+
+
+def test_manifest_forget():
+    manifest = Manifest(files={"a.html": "1", "b.html": "2"})
+    manifest.forget(["a.html", "c.html"])
+    assert manifest.files == {"a.html": None, "b.html": "2"}
+
+
+@content_processor
+def padded(url, filename, content):
+    return content * 100
+
+
+class BrokenProducer:
+    def __call__(self):
+        yield reverse("content_a")
+        yield "/does-not-exist/"
+
+
+@override_settings(
+    STATICPUB_PROCESSORS=[padded],
+    STATICPUB_PRECOMPRESS={"encodings": ["gzip"], "min_size": 0},
+)
+def test_collectstaticsite_prune_dry_run_keeps_compressed_siblings():
+    NEW_STATIC_ROOT = os.path.join(
+        settings.BASE_DIR, "var", "test_collectstatic", "collectstaticsite", "siblings"
+    )
+    rmtree(path=NEW_STATIC_ROOT, ignore_errors=True)
+    options = {
+        "interactive": False,
+        "manifest": os.path.join(NEW_STATIC_ROOT, "manifest.json"),
+        "journal": os.path.join(NEW_STATIC_ROOT, "journal.jsonl"),
+    }
+    with patch.object(storages["staticpub"], "location", NEW_STATIC_ROOT):
+        with override_settings(STATICPUB_PRODUCERS=[UnprunedProducer]):
+            call_command("collectstaticsite", stdout=StringIO(), **options)
+        assert storages["staticpub"].exists("content/a/index.html.gz")
+        assert storages["staticpub"].exists("404.html.gz")
+
+        with patch(
+            "staticpub.management.commands.collectstaticsite.Command.handle_preview",
+            return_value=None,
+        ):
+            with override_settings(STATICPUB_PRODUCERS=[PrunedProducer]):
+                out = StringIO()
+                call_command(
+                    "collectstaticsite", prune=True, dry_run=True, stdout=out, **options
+                )
+            stdout = out.getvalue().splitlines()
+            assert "Would delete streamable/index.html" in stdout
+            assert "Would delete streamable/index.html.gz" in stdout
+            assert "Would delete content/a/index.html.gz" not in stdout
+            assert "Would delete 404.html.gz" not in stdout
+
+            # a page which failed to be read leaves nothing to prune.
+            with override_settings(STATICPUB_PRODUCERS=[BrokenProducer]):
+                out = StringIO()
+                call_command(
+                    "collectstaticsite",
+                    prune=True,
+                    dry_run=True,
+                    keep_going=True,
+                    retries=0,
+                    max_failures=1,
+                    stdout=out,
+                    stderr=StringIO(),
+                    **options,
+                )
+            assert "Not pruning, as 1 URLs failed to build" in out.getvalue()
+
+
+def test_collectstaticsite_prune_needs_whole_site():
+    with pytest.raises(CommandError):
+        call_command("collectstaticsite", prune=True, shard="1/2", interactive=False)
+
+
+def test_mergestaticsite_prune(tmpdir):
+    from django.core.files.base import ContentFile
+
+    location = str(tmpdir.mkdir("site"))
+    output = os.path.join(str(tmpdir), "manifest.json")
+    collected = {"count": 2, "digest": "x"}
+    partials = []
+    for shard in (
+        make_shard(1, 2, ["/a/"], [("a.html", "1")], collected=collected),
+        make_shard(2, 2, ["/b/"], [("b.html", "2")], collected=collected),
+    ):
+        partials.append(shard.write(shard.shard.path(output)))
+    Manifest(files={"a.html": "1", "gone.html": "3"}).write(output)
+    with patch.object(storages["staticpub"], "location", location):
+        storage = storages["staticpub"]
+        storage.save("gone.html", ContentFile(b"gone"))
+
+        out = StringIO()
+        call_command(
+            "mergestaticsite",
+            *partials,
+            output=output,
+            prune=True,
+            dry_run=True,
+            stdout=out,
+        )
+        assert out.getvalue().splitlines() == ["Would delete gone.html"]
+        assert storage.exists("gone.html")
+        assert "gone.html" in Manifest.read(output)
+
+        out = StringIO()
+        call_command(
+            "mergestaticsite", *partials, output=output, prune=True, stdout=out
+        )
+        assert "Deleted 1 orphaned files" in out.getvalue().splitlines()
+        assert storage.exists("gone.html") is False
+    assert set(Manifest.read(output).files) == {"a.html", "b.html"}
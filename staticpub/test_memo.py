@@ -0,0 +1,117 @@
+import threading
+from django.template import engines
+from django.template import TemplateSyntaxError
+from django.urls import reverse
+from staticpub.memo import BuildCache
+from staticpub.memo import build_cached
+from staticpub.memo import get_build_cache
+from staticpub.models import URLReader
+from staticpub.utils import end_build
+import pytest
+import test_urls
+
+CALLS = []
+
+
+@build_cached
+def menu(language="en"):
+    CALLS.append(language)
+    return "menu-%s" % language
+
+
+def render(source, **context):
+    return engines["django"].from_string(source).render(context)
+
+
+def test_build_cached_outside_a_build():
+    del CALLS[:]
+    assert get_build_cache() is None
+    assert menu() == "menu-en"
+    assert menu() == "menu-en"
+    assert CALLS == ["en", "en"]
+
+
+def test_build_cached_during_a_build():
+    del CALLS[:]
+    with BuildCache() as cache:
+        assert get_build_cache() is cache
+        assert menu() == "menu-en"
+        assert menu() == "menu-en"
+        assert menu(language="fr") == "menu-fr"
+        assert menu(language="fr") == "menu-fr"
+    assert get_build_cache() is None
+    assert CALLS == ["en", "fr"]
+    assert cache.hits == 2
+    assert cache.misses == 2
+
+
+def test_buildcache_tag():
+    source = (
+        "{% load staticpub_tags %}"
+        "{% buildcache 'nav' lang %}{{ count }}{% endbuildcache %}"
+    )
+    counted = []
+
+    def count():
+        counted.append(1)
+        return len(counted)
+
+    assert render(source, count=count, lang="en") == "1"
+    assert render(source, count=count, lang="en") == "2"
+    with BuildCache():
+        assert render(source, count=count, lang="en") == "3"
+        assert render(source, count=count, lang="en") == "3"
+        assert render(source, count=count, lang="fr") == "4"
+
+
+def test_buildcache_tag_needs_a_name():
+    with pytest.raises(TemplateSyntaxError):
+        render("{% load staticpub_tags %}{% buildcache %}{% endbuildcache %}")
+
+
+def test_reader_caches_fragments_until_it_finishes():
+    del test_urls.RENDERED[:]
+    urls = [reverse("fragments", kwargs={"page": page}) for page in (1, 2, 1)]
+    reader = URLReader(urls=urls)
+    output = tuple(reader())
+    assert [x.content.count(b"<footer>1</footer>") for x in output] == [1, 1, 1]
+    # the sidebar varies on the page.
+    assert b"<aside>1</aside>" in output[0].content
+    assert b"<aside>2</aside>" in output[1].content
+    assert b"<aside>1</aside>" in output[2].content
+    assert test_urls.RENDERED.count("footer_links") == 1
+    assert reader.cache.values == {}
+    assert get_build_cache() is None
+
+
+def test_cache_shared_for_a_build():
+    del test_urls.RENDERED[:]
+    cache = BuildCache.for_build("build")
+    for page in (1, 2):
+        url = reverse("fragments", kwargs={"page": page})
+        tuple(URLReader(urls=[url], cache=cache)())
+    assert test_urls.RENDERED.count("footer") == 1
+    assert cache.values != {}
+    end_build("build")
+    assert BuildCache.for_build("build") is not cache
+    end_build("build")
+
+
+def test_build_cache_is_only_used_by_its_thread():
+    seen = []
+    with BuildCache():
+        thread = threading.Thread(target=lambda: seen.append(get_build_cache()))
+        thread.start()
+        thread.join()
+    assert seen == [None]
+
+
+def test_reader_only_uses_its_cache_while_reading():
+    urls = [reverse("fragments", kwargs={"page": page}) for page in (1, 2)]
+    reader = URLReader(urls=urls)
+    pages = reader()
+    next(pages)
+    # the consumer of the first page isn't reading with the cache.
+    assert get_build_cache() is None
+    pages.close()
+    assert get_build_cache() is None
@@ -0,0 +1,131 @@
+import csv
+import json
+import os
+from shutil import rmtree
+from unittest.mock import patch
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.storage import storages
+from django.core.management import call_command
+from django.urls import reverse
+from django.test.utils import override_settings
+from io import StringIO
+from time import perf_counter
+from time import sleep
+from staticpub.metrics import BuildMetrics
+from staticpub.metrics import PageMetrics
+from staticpub.metrics import QueryCounter
+from staticpub.models import URLReader
+from staticpub.models import URLWriter
+import pytest
+
+
+class DummyProducer:
+    def __call__(self):
+        yield reverse("redirect_a")
+        yield reverse("content_a")
+        yield reverse("users")
+
+
+@pytest.mark.django_db
+def test_query_counter():
+    with QueryCounter() as queries:
+        get_user_model().objects.count()
+        get_user_model().objects.count()
+    assert queries.count == 2
+    assert queries.duration > 0
+    get_user_model().objects.count()
+    assert queries.count == 2
+
+
+@pytest.mark.django_db
+def test_records_reads_and_writes():
+    NEW_STATIC_ROOT = os.path.join(
+        settings.BASE_DIR, "var", "test_collectstatic", "metrics", "records"
+    )
+    rmtree(path=NEW_STATIC_ROOT, ignore_errors=True)
+    with BuildMetrics() as metrics:
+        read_results = tuple(URLReader(urls=[reverse("users")])())
+        writer = URLWriter(data=read_results)
+        with patch.object(writer.storage, "location", NEW_STATIC_ROOT):
+            tuple(writer())
+    assert len(metrics) == 1
+    page = metrics.pages["index.html"]
+    assert page.url == "/"
+    assert page.queries >= 1
+    assert page.render_time >= page.query_time > 0
+    assert page.size == len(read_results[0].content)
+    assert page.write_time > 0
+
+
+def test_render_time_excludes_redirect_pages():
+    render_redirect_page = URLReader.render_redirect_page
+
+    def slow_redirect_page(self, url, final_url):
+        sleep(0.1)
+        return render_redirect_page(self, url, final_url)
+
+    with patch.object(URLReader, "render_redirect_page", slow_redirect_page):
+        with BuildMetrics() as metrics:
+            started = perf_counter()
+            tuple(URLReader(urls=[reverse("redirect_a")])())
+            elapsed = perf_counter() - started
+    assert elapsed >= 0.2
+    assert metrics.pages["content/a/b/index.html"].render_time < 0.1
+
+
+def test_update_merges_partial_metrics():
+    metrics = BuildMetrics()
+    metrics.update([PageMetrics(url="/a/", filename="a/index.html", render_time=2)])
+    metrics.update([PageMetrics(url=None, filename="a/index.html", write_time=1)])
+    metrics.update([PageMetrics(url="/b/", filename="b/index.html", render_time=1)])
+    assert metrics.pages["a/index.html"] == PageMetrics(
+        url="/a/", filename="a/index.html", render_time=2, write_time=1
+    )
+    assert [page.url for page in metrics.top(key="render_time", count=1)] == ["/a/"]
+    assert list(metrics.report(count=5)) == [
+        "Slowest renders (seconds)",
+        "             2  /a/",
+        "             1  /b/",
+        "Slowest writes (seconds)",
+        "             1  /a/",
+    ]
+
+
+@pytest.mark.django_db
+def test_collectstaticsite_report_and_export():
+    NEW_STATIC_ROOT = os.path.join(
+        settings.BASE_DIR, "var", "test_collectstatic", "metrics", "command"
+    )
+    rmtree(path=NEW_STATIC_ROOT, ignore_errors=True)
+    os.makedirs(NEW_STATIC_ROOT)
+    csv_path = os.path.join(NEW_STATIC_ROOT, "metrics.csv")
+    json_path = os.path.join(NEW_STATIC_ROOT, "metrics.json")
+    out = StringIO()
+    with override_settings(STATICPUB_PRODUCERS=[DummyProducer]):
+        with patch.object(storages["staticpub"], "location", NEW_STATIC_ROOT):
+            call_command(
+                "collectstaticsite",
+                interactive=False,
+                report=2,
+                metrics_file=csv_path,
+                stdout=out,
+            )
+            call_command(
+                "collectstaticsite",
+                interactive=False,
+                metrics_file=json_path,
+                stdout=StringIO(),
+            )
+    stdout = out.getvalue().splitlines()
+    assert "Slowest renders (seconds)" in stdout
+    assert "Most queries" in stdout
+    with open(csv_path) as f:
+        rows = list(csv.DictReader(f))
+    by_name = {row["filename"]: row for row in rows}
+    assert by_name["index.html"]["url"] == "/"
+    assert int(by_name["index.html"]["queries"]) >= 1
+    assert "r/a/index.html" in by_name
+    assert "404.html" in by_name
+    with open(json_path) as f:
+        assert len(json.load(f)) == len(rows)
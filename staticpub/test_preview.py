@@ -0,0 +1,152 @@
+import os
+from shutil import rmtree
+from unittest.mock import patch
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.http import Http404
+from django.test.client import RequestFactory
+from django.urls import reverse
+from staticpub.models import ReadResult
+from staticpub.models import ReaderError
+from staticpub.models import URLReader
+from staticpub.preview import PreviewIndex
+from staticpub.preview import StoragePreview
+import pytest
+
+
+def test_repr():
+    index = PreviewIndex(
+        read_results=[
+            ReadResult(url="/a/", filename="a/index.html", status=200, content=b"a"),
+        ]
+    )
+    assert repr(index) == "<staticpub.preview.PreviewIndex [2]>"
+
+
+def test_lookup_by_url_and_filename():
+    read_result = ReadResult(
+        url="/a+b/c.d/", filename="a+b/c.d/index.html", status=200, content=b"x"
+    )
+    index = PreviewIndex(read_results=[read_result])
+    assert index.get("a+b/c.d/") is read_result
+    assert index.get("/a+b/c.d/") is read_result
+    assert index.get("a+b/c.d/index.html") is read_result
+    # a regex would have happily matched this ...
+    assert index.get("aab/cXd/") is None
+
+
+def test_serves_with_content_type():
+    index = PreviewIndex(
+        read_results=[
+            ReadResult(
+                url="/feed.atom", filename="feed.atom", status=200, content=b"<feed/>"
+            ),
+        ]
+    )
+    response = index(RequestFactory().get("/feed.atom"), path="feed.atom")
+    assert response.status_code == 200
+    assert response["Content-Type"] == "application/atom+xml"
+    assert response.content == b"<feed/>"
+
+
+def test_serves_redirect_pages_as_ok():
+    index = PreviewIndex(read_results=tuple(URLReader(urls=[reverse("redirect_a")])()))
+    response = index(RequestFactory().get("/r/a/"), path="r/a/")
+    assert response.status_code == 200
+    assert response["Content-Type"] == "text/html; charset=utf-8"
+    assert reverse("content_b").encode("utf-8") in response.content
+
+
+def test_missing_path_raises_404():
+    index = PreviewIndex(read_results=())
+    with pytest.raises(Http404):
+        index(RequestFactory().get("/nope/"), path="nope/")
+
+
+def _storage(name):
+    location = os.path.join(
+        settings.BASE_DIR, "var", "test_collectstatic", "preview", name
+    )
+    rmtree(path=location, ignore_errors=True)
+    return FileSystemStorage(location=location)
+
+
+def test_storage_preview_serves_written_page():
+    storage = _storage("serves_written_page")
+    storage.save("a/index.html", ContentFile(b"hello world"))
+    preview = StoragePreview(storage=storage)
+    response = preview(RequestFactory().get("/a/"), path="a/")
+    assert response.status_code == 200
+    assert b"".join(response.streaming_content) == b"hello world"
+    assert response["Content-Type"] == "text/html; charset=utf-8"
+    assert response["Content-Length"] == "11"
+    assert response["ETag"] == preview.get_etag("a/index.html", 11)
+    assert response["ETag"].endswith('-b"')
+
+
+class UndatedStorage(FileSystemStorage):
+    def get_modified_time(self, name):
+        raise NotImplementedError()
+
+
+def test_storage_preview_etag_without_modified_time():
+    location = _storage("undated").location
+    storage = UndatedStorage(location=location)
+    storage.save("a/index.html", ContentFile(b"hello world"))
+    preview = StoragePreview(storage=storage)
+    response = preview(RequestFactory().get("/a/"), path="a/")
+    assert response["ETag"] == '"5eb63bbbe01eeed093cb22bb8f5acdc3"'
+
+
+def test_storage_preview_if_none_match():
+    storage = _storage("if_none_match")
+    storage.save("a/index.html", ContentFile(b"hello world"))
+    preview = StoragePreview(storage=storage)
+    request = RequestFactory().get(
+        "/a/", HTTP_IF_NONE_MATCH=preview.get_etag("a/index.html", 11)
+    )
+    with patch.object(storage, "open", side_effect=AssertionError("read")):
+        response = preview(request, path="a/")
+    assert response.status_code == 304
+    assert response["ETag"] == request.META["HTTP_IF_NONE_MATCH"]
+
+
+def test_storage_preview_range():
+    storage = _storage("range")
+    storage.save("a/index.html", ContentFile(b"hello world"))
+    preview = StoragePreview(storage=storage)
+    response = preview(RequestFactory().get("/a/", HTTP_RANGE="bytes=6-"), path="a/")
+    assert response.status_code == 206
+    assert b"".join(response.streaming_content) == b"world"
+    assert response["Content-Range"] == "bytes 6-10/11"
+    assert response["Content-Length"] == "5"
+
+    response = preview(RequestFactory().get("/a/", HTTP_RANGE="bytes=2-4"), path="a/")
+    assert b"".join(response.streaming_content) == b"llo"
+
+    response = preview(RequestFactory().get("/a/", HTTP_RANGE="bytes=20-"), path="a/")
+    assert response.status_code == 416
+    assert response["Content-Range"] == "bytes */11"
+
+
+def test_storage_preview_missing():
+    preview = StoragePreview(storage=_storage("missing"))
+    with pytest.raises(Http404):
+        preview(RequestFactory().get("/content/a/"), path="content/a/")
+
+
+def test_storage_preview_render_missing():
+    storage = _storage("render_missing")
+    preview = StoragePreview(storage=storage, render_missing=True)
+    response = preview(RequestFactory().get("/content/a/"), path="content/a/")
+    assert response.status_code == 200
+    assert b"".join(response.streaming_content) == b"content_a"
+    assert storage.exists("content/a/index.html") is True
+
+
+def test_storage_preview_render_missing_fails():
+    preview = StoragePreview(storage=_storage("render_fails"), render_missing=True)
+    with patch("staticpub.preview.URLReader", side_effect=ReaderError("couldn't read")):
+        with pytest.raises(Http404):
+            preview(RequestFactory().get("/content/a/"), path="content/a/")
@@ -0,0 +1,132 @@
+from time import sleep
+from django.test.utils import override_settings
+from django.urls import reverse
+from staticpub.metrics import BuildMetrics
+from staticpub.models import ErrorReader
+from staticpub.models import URLReader
+from staticpub.processors import content_processor
+from staticpub.processors import get_processors
+from staticpub.processors import process
+from staticpub.processors import spaceless_html
+
+
+def upper(url, filename, chunks):
+    for chunk in chunks:
+        yield chunk.upper()
+
+
+@content_processor
+def slow_exclaim(url, filename, content):
+    sleep(0.05)
+    return content + b"!"
+
+
+class Prefix(object):
+    def __call__(self, url, filename, chunks):
+        yield url.encode("utf-8")
+        yield from chunks
+
+
+def test_spaceless_html():
+    content = b"<ul>\n  <li>a b</li>\n  <li>c</li>\n</ul>\n"
+    assert b"".join(spaceless_html("/", "index.html", [content])) == (
+        b"<ul><li>a b</li><li>c</li></ul>\n"
+    )
+    assert b"".join(spaceless_html("/", "feed.xml", [content])) == content
+
+
+def test_get_processors():
+    with override_settings(
+        STATICPUB_PROCESSORS=["staticpub.processors.spaceless_html", Prefix]
+    ):
+        processors = tuple(get_processors())
+    assert [name for name, processor in processors] == [
+        "staticpub.processors.spaceless_html",
+        "Prefix",
+    ]
+    assert processors[0][1] is spaceless_html
+    assert isinstance(processors[1][1], Prefix)
+    assert tuple(get_processors()) == ()
+
+
+def test_process_chains_processors_and_times_each():
+    processors = tuple(get_processors([upper, slow_exclaim, Prefix]))
+    content, timings = process(
+        processors, url="/a/", filename="a/index.html", chunks=iter([b"a", b"b"])
+    )
+    assert content == b"/a/AB!"
+    assert [name for name, duration in timings] == [
+        "upper",
+        "slow_exclaim",
+        "Prefix",
+    ]
+    durations = dict(timings)
+    assert durations["slow_exclaim"] >= 0.05
+    assert durations["upper"] < 0.05
+    assert durations["Prefix"] < 0.05
+
+
+def test_process_streams_chunks():
+    seen = []
+
+    def source():
+        for chunk in (b"a", b"b"):
+            seen.append(chunk)
+            yield chunk
+
+    def check(url, filename, chunks):
+        for chunk in chunks:
+            # only the chunk being processed has been rendered so far.
+            assert seen[-1] == chunk
+            yield chunk
+
+    content, timings = process(
+        tuple(get_processors([check])), url="/", filename="index.html", chunks=source()
+    )
+    assert content == b"ab"
+
+
+def test_reader_applies_processors():
+    with BuildMetrics() as metrics:
+        reader = URLReader(urls=[reverse("streamable")], processors=[upper])
+        output = tuple(reader())
+    assert output[0].content == b"HELLOI'MASTREAM"
+    page = metrics.pages["streamable/index.html"]
+    assert [name for name, duration in page.processing] == ["upper"]
+    assert "Time in each processor (seconds)" in tuple(metrics.report(count=1))
+
+
+def test_metrics_export_processing():
+    from io import StringIO
+    import json
+    from staticpub.metrics import PageMetrics
+
+    metrics = BuildMetrics()
+    metrics.update(
+        [PageMetrics(url="/a/", filename="a/index.html", processing=(("upper", 0.5),))]
+    )
+    out = StringIO()
+    metrics.write_json(out)
+    assert json.loads(out.getvalue())[0]["processing"] == {"upper": 0.5}
+    out = StringIO()
+    metrics.write_csv(out)
+    assert out.getvalue().splitlines()[1].endswith(',"{""upper"": 0.5}"')
+
+
+def test_reader_processes_redirect_pages():
+    reader = URLReader(urls=[reverse("redirect_a")], processors=[upper])
+    pages = {x.filename: x.content for x in reader()}
+    assert pages["content/a/b/index.html"] == b"CONTENT_B"
+    # the pages written for each redirect too.
+    redirect = pages["r/a/index.html"]
+    assert redirect == redirect.upper()
+    assert b"/CONTENT/A/B/" in redirect
+
+
+def test_error_reader_processes_error_pages():
+    with override_settings(STATICPUB_PROCESSORS=[upper]):
+        pages = tuple(ErrorReader()())
+    assert len(pages) == 4
+    for page in pages:
+        assert page.content == page.content.upper()
+        assert page.content.strip()
@@ -0,0 +1,45 @@
+from io import StringIO
+from django.core.management.base import OutputWrapper
+from staticpub.progress import Progress
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_writes_at_most_once_per_interval():
+    out = StringIO()
+    clock = FakeClock()
+    progress = Progress(
+        stdout=OutputWrapper(out),
+        label="Reading",
+        total=100,
+        processes=2,
+        interval=5,
+        clock=clock,
+    )
+    clock.now = 1
+    progress.update(count=10, size=1000000, busy=2)
+    assert out.getvalue() == ""
+    clock.now = 10
+    progress.update(count=30, size=3000000, busy=10)
+    assert out.getvalue().splitlines() == [
+        "Reading 40/100 pages, 4.0 pages/s, 0.40 MB/s, ETA 0:00:15, workers 60% busy"
+    ]
+    clock.now = 20
+    progress.update(count=60, size=0, busy=8)
+    progress.finish()
+    assert out.getvalue().splitlines()[-1] == (
+        "Reading 100/100 pages, 5.0 pages/s, 0.20 MB/s, workers 50% busy"
+    )
+
+
+def test_silent_without_stdout():
+    progress = Progress(stdout=None, label="Writing", total=1, interval=0)
+    progress.update(count=1)
+    progress.finish()
+    assert repr(progress) == "<staticpub.progress.Progress Writing 1/1>"
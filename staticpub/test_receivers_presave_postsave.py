@@ -123,3 +123,38 @@ def test_using_as_presave_but_cannot_build():
         # Should still error because we didn't build it ...
         with pytest.raises(IOError):
             storage.open(url)
+
+
+@pytest.mark.django_db
+def test_using_as_postsave_sends_changes():
+    from staticpub.signals import build_finished
+
+    class UserChangesProxy(get_user_model()):
+        def get_absolute_url(self):
+            return reverse("show_user", kwargs={"pk": self.pk})
+
+        class Meta:
+            proxy = True
+
+    user = UserChangesProxy.objects.create(username="changes")
+    NEW_STATIC_ROOT = os.path.join(
+        settings.BASE_DIR, "var", "test_collectstatic", "utils", "sends_changes"
+    )
+    rmtree(path=NEW_STATIC_ROOT, ignore_errors=True)
+    sent = []
+
+    def receiver(sender, changes, **kwargs):
+        sent.append(changes)
+
+    url = "%sindex.html" % user.get_absolute_url()[1:]
+    writer = URLWriter(data=None)
+    build_finished.connect(receiver)
+    try:
+        with patch.object(writer.storage, "location", NEW_STATIC_ROOT):
+            with tidying_signal(cls=UserChangesProxy, signal=post_save):
+                user.save()
+                user.save()
+    finally:
+        build_finished.disconnect(receiver)
+    assert [x.created for x in sent] == [(url,), ()]
+    assert [x.modified for x in sent] == [(), ()]
@@ -0,0 +1,221 @@
+import json
+import os
+from io import StringIO
+from shutil import rmtree
+from unittest.mock import patch
+from django.conf import settings
+from django.core.files.storage import storages
+from django.core.management import CommandError
+from django.core.management import call_command
+from django.test.utils import override_settings
+from django.urls import reverse
+from staticpub.manifest import urls_digest
+from staticpub.processors import content_processor
+from staticpub.subset import SubsetError
+from staticpub.subset import URLFilter
+from staticpub.subset import get_producer_name
+from staticpub.subset import read_url_file
+from staticpub.subset import select_producers
+import pytest
+
+NEW_STATIC_ROOT = os.path.join(
+    settings.BASE_DIR, "var", "test_collectstatic", "collectstaticsite", "subset"
+)
+called = []
+
+
+class ContentProducer:
+    def __call__(self):
+        called.append(self.__class__.__name__)
+        yield reverse("content_a")
+        yield reverse("content_b")
+
+
+class FragmentsProducer:
+    def __call__(self):
+        called.append(self.__class__.__name__)
+        for page in range(1, 4):
+            yield reverse("fragments", kwargs={"page": page})
+
+
+def fragments_producer():
+    return FragmentsProducer()
+
+
+def test_get_producer_name():
+    assert get_producer_name("a.b.C") == "a.b.C"
+    assert get_producer_name(ContentProducer) == "staticpub.test_subset.ContentProducer"
+    assert get_producer_name(ContentProducer()) == (
+        "staticpub.test_subset.ContentProducer"
+    )
+    assert get_producer_name(fragments_producer) == (
+        "staticpub.test_subset.fragments_producer"
+    )
+
+
+def test_select_producers():
+    producers = ("a.Pages", ContentProducer, "b.Posts", "c.Posts")
+    assert select_producers(["Posts"], producers) == ("b.Posts", "c.Posts")
+    assert select_producers(["b.Posts", "ContentProducer"], producers) == (
+        ContentProducer,
+        "b.Posts",
+    )
+    # not the end of a name.
+    with pytest.raises(SubsetError) as exc:
+        select_producers(["osts"], producers)
+    assert "a.Pages, staticpub.test_subset.ContentProducer" in str(exc.value)
+
+
+def test_url_filter():
+    urls = ("/", "/blog/", "/blog/2019/a/", "/blog/2020/b/", "/feed.xml")
+    assert URLFilter.parse().empty is True
+    assert URLFilter.parse().select(urls) == urls
+    assert URLFilter.parse(include=["/blog/*"]).select(urls) == urls[1:4]
+    assert URLFilter.parse(include=["/blog/*/"], exclude=["*/2019/*"]).select(urls) == (
+        "/blog/2020/b/",
+    )
+    assert URLFilter.parse(include=[r"re:\.xml$", "/"]).select(urls) == (
+        "/",
+        "/feed.xml",
+    )
+    assert URLFilter.parse(exclude=["re:^/blog/20"]).select(urls) == (
+        "/",
+        "/blog/",
+        "/feed.xml",
+    )
+    with pytest.raises(SubsetError):
+        URLFilter.parse(include=["re:("])
+
+
+def test_url_filter_matches():
+    urls = URLFilter.parse(include=["/blog/*"], exclude=["re:/2019/"])
+    assert urls.matches("/blog/2020/b/") is True
+    assert urls.matches("/blog/2019/a/") is False
+    assert urls.matches("/") is False
+    # still a tuple of its patterns.
+    assert len(urls) == 2
+    assert urls.include in urls
+
+
+def test_read_url_file(tmp_path):
+    path = tmp_path / "urls.txt"
+    path.write_text("# section\n/a/\n\n  /b/  \n")
+    assert tuple(read_url_file(str(path))) == ("/a/", "/b/")
+    with patch("sys.stdin", StringIO("/c/\n")):
+        assert tuple(read_url_file("-")) == ("/c/",)
+
+
+def build(**options):
+    stdout = StringIO()
+    with patch.object(storages["staticpub"], "location", NEW_STATIC_ROOT):
+        with override_settings(
+            STATICPUB_PRODUCERS=[ContentProducer, FragmentsProducer]
+        ):
+            options.setdefault("interactive", False)
+            call_command(
+                "collectstaticsite",
+                manifest=os.path.join(NEW_STATIC_ROOT, "manifest.json"),
+                journal=os.path.join(NEW_STATIC_ROOT, "journal.jsonl"),
+                changes_file=os.path.join(NEW_STATIC_ROOT, "changes.json"),
+                stdout=stdout,
+                **options,
+            )
+    with open(os.path.join(NEW_STATIC_ROOT, "changes.json")) as f:
+        changes = json.load(f)
+    with open(os.path.join(NEW_STATIC_ROOT, "manifest.json")) as f:
+        manifest = json.load(f)
+    return stdout.getvalue(), changes, manifest
+
+
+def test_collectstaticsite_subsets():
+    rmtree(path=NEW_STATIC_ROOT, ignore_errors=True)
+    del called[:]
+    output, changes, manifest = build()
+    assert sorted(called) == ["ContentProducer", "FragmentsProducer"]
+    assert len(manifest["urls"]) == 5
+    everything = manifest["files"]
+
+    # only the chosen producer is run.
+    del called[:]
+    os.remove(os.path.join(NEW_STATIC_ROOT, "content/a/index.html"))
+    output, changes, manifest = build(producers=["ContentProducer"])
+    assert called == ["ContentProducer"]
+    assert changes["created"] == ["content/a/index.html"]
+    assert "Read 2 URLs" in output
+    # the rest of the site is still in the manifest.
+    assert manifest["files"] == everything
+
+    # no producers are run for URLs given outright, but they may be filtered.
+    del called[:]
+    url_file = os.path.join(NEW_STATIC_ROOT, "urls.txt")
+    with open(url_file, "w") as f:
+        f.write("/fragments/3/\n")
+    output, changes, manifest = build(
+        urls=["/fragments/1/", "/fragments/2/"], url_file=url_file, exclude=["*/2/"]
+    )
+    assert called == []
+    assert "Read 2 URLs" in output
+
+    output, changes, manifest = build(include=["re:^/content/a/$"])
+    assert sorted(called) == ["ContentProducer", "FragmentsProducer"]
+    assert "Read 1 URLs" in output
+
+
+def test_collectstaticsite_subset_confirmation():
+    with patch("builtins.input", return_value="no") as prompt:
+        with pytest.raises(CommandError):
+            build(
+                producers=["FragmentsProducer"],
+                urls=["/content/a/"],
+                exclude=["*/3/"],
+                interactive=True,
+            )
+    (message,), kwargs = prompt.call_args
+    assert (
+        "collect the URLs of the producers FragmentsProducer and 1 given URLs "
+        "except those matching */3/, 3 URLs in all, at the destination"
+    ) in " ".join(message.split())
+
+
+@content_processor
+def padded(url, filename, content):
+    return content * 100
+
+
+@override_settings(STATICPUB_PROCESSORS=[padded])
+def test_collectstaticsite_subset_manifest():
+    rmtree(path=NEW_STATIC_ROOT, ignore_errors=True)
+    with override_settings(STATICPUB_PRECOMPRESS={"encodings": ["gzip"]}):
+        output, changes, everything = build()
+    assert "fragments/1/index.html.gz" in everything["files"]
+
+    # the fragments are now too small to compress, so the rebuilt pages no
+    # longer have a .gz, and the manifest describes this build.
+    with override_settings(
+        STATICPUB_PRECOMPRESS={"encodings": ["gzip"], "min_size": 10**6}
+    ):
+        output, changes, manifest = build(urls=["/fragments/1/"])
+    assert "fragments/1/index.html.gz" not in manifest["files"]
+    assert "fragments/2/index.html.gz" in manifest["files"]
+    assert manifest["pages"]["/fragments/1/"] == ["fragments/1/index.html"]
+    assert manifest["urls"] == everything["urls"]
+    assert manifest["collected"] == {
+        "count": 1,
+        "digest": urls_digest(["/fragments/1/"]),
+    }
+    assert manifest["collected"] != everything["collected"]
+
+
+def test_collectstaticsite_subset_errors():
+    with pytest.raises(CommandError) as exc:
+        build(producers=["NoSuchProducer"])
+    assert "NoSuchProducer" in str(exc.value)
+    with pytest.raises(CommandError) as exc:
+        build(include=["/nothing/*"])
+    assert str(exc.value) == "No URLs were selected to build"
+    with pytest.raises(CommandError) as exc:
+        build(urls=["/no-slash"])
+    assert "/no-slash" in str(exc.value)
+    with pytest.raises(CommandError) as exc:
+        build(urls=["/content/a/"], prune=True)
+    assert "--prune" in str(exc.value)
@@ -0,0 +1,164 @@
+from io import StringIO
+import json
+import os
+from shutil import rmtree
+from time import perf_counter
+from time import sleep
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.files.storage import storages
+from django.core.management import call_command
+from django.core.management import CommandError
+from django.test.utils import override_settings
+from staticpub.manifest import MANIFEST_NAME
+from staticpub.manifest import Manifest
+from staticpub.sync import SyncPlan
+from staticpub.sync import read_remote_manifest
+from staticpub.sync import upload_many
+import pytest
+
+ROOT = os.path.join(settings.BASE_DIR, "var", "test_collectstatic", "sync")
+LATENCY = 0.05
+
+
+class SlowStorage(FileSystemStorage):
+    """
+    Stands in for a remote storage, where every request takes a while.
+    """
+
+    def __init__(self, latency=LATENCY, **kwargs):
+        self.latency = latency
+        super().__init__(**kwargs)
+
+    def _save(self, name, content):
+        sleep(self.latency)
+        return super()._save(name, content)
+
+    def delete(self, name):
+        sleep(self.latency)
+        return super().delete(name)
+
+
+def get_storages():
+    return dict(
+        settings.STORAGES,
+        local={
+            "BACKEND": "django.core.files.storage.FileSystemStorage",
+            "OPTIONS": {"location": os.path.join(ROOT, "local")},
+        },
+        remote={
+            "BACKEND": "staticpub.test_sync.SlowStorage",
+            "OPTIONS": {"location": os.path.join(ROOT, "remote")},
+        },
+    )
+
+
+def build(files, failed=()):
+    """
+    What collectstaticsite would leave behind: the files, and a manifest.
+    """
+    local = storages["local"]
+    manifest = Manifest(failed=failed)
+    for name, content in files.items():
+        if local.exists(name):
+            local.delete(name)
+        local.save(name, ContentFile(content))
+        manifest.add(files=[(name, content.decode("utf-8"))])
+    return manifest.write(os.path.join(ROOT, "manifest.json"))
+
+
+def sync(**options):
+    stdout = StringIO()
+    call_command(
+        "syncstaticsite",
+        source="local",
+        destination="remote",
+        manifest=os.path.join(ROOT, "manifest.json"),
+        stdout=stdout,
+        **options,
+    )
+    return stdout.getvalue()
+
+
+def test_plan():
+    local = Manifest(files={"a": "1", "b": "2", "c": "3"})
+    assert SyncPlan.from_manifests(local) == SyncPlan(
+        upload=("a", "b", "c"), delete=(), unchanged=0
+    )
+    remote = Manifest(files={"a": "1", "b": "0", "d": "4"})
+    assert SyncPlan.from_manifests(local, remote) == SyncPlan(
+        upload=("b", "c"), delete=("d",), unchanged=1
+    )
+
+
+def test_upload_many_in_parallel():
+    rmtree(path=ROOT, ignore_errors=True)
+    with override_settings(STORAGES=get_storages()):
+        names = ["page/{num}/index.html".format(num=num) for num in range(20)]
+        build(dict((name, b"x") for name in names))
+        started = perf_counter()
+        uploaded = tuple(
+            upload_many(storages["local"], storages["remote"], names, threads=10)
+        )
+        elapsed = perf_counter() - started
+        assert sorted(uploaded) == sorted(names)
+        assert storages["remote"].exists("page/19/index.html") is True
+    # one at a time, that would have taken a second.
+    assert elapsed < len(names) * LATENCY / 2
+
+
+def test_syncstaticsite():
+    rmtree(path=ROOT, ignore_errors=True)
+    with override_settings(STORAGES=get_storages()):
+        remote = storages["remote"]
+        build({"a.html": b"1", "b.html": b"2", "c.html": b"3"})
+        output = sync()
+        assert "There's no {name}".format(name=MANIFEST_NAME) in output
+        assert "Uploaded 3 files, deleted 0 and left 0 unchanged" in output
+        assert read_remote_manifest(remote).files == {
+            "a.html": "1",
+            "b.html": "2",
+            "c.html": "3",
+        }
+
+        # nothing changed, so nothing to do.
+        assert "Uploaded 0 files, deleted 0 and left 3 unchanged" in sync()
+
+        rmtree(path=os.path.join(ROOT, "local"))
+        build({"a.html": b"1", "b.html": b"4"})
+        assert sync(dry_run=True, delete=True).splitlines() == [
+            "Would upload b.html",
+            "Would delete c.html",
+        ]
+        # without --delete, c.html is left, and remembered.
+        assert "Uploaded 1 files, deleted 0 and left 1 unchanged" in sync()
+        with remote.open("b.html") as f:
+            assert f.read() == b"4"
+        assert "c.html" in read_remote_manifest(remote)
+
+        output = sync(delete=True, verbosity=2)
+        assert "Deleted c.html" in output
+        assert "Uploaded 0 files, deleted 1 and left 2 unchanged" in output
+        assert remote.exists("c.html") is False
+        with remote.open(MANIFEST_NAME) as f:
+            assert sorted(json.load(f)["files"]) == ["a.html", "b.html"]
+
+
+def test_syncstaticsite_doesnt_delete_after_failures():
+    rmtree(path=ROOT, ignore_errors=True)
+    with override_settings(STORAGES=get_storages()):
+        build({"a.html": b"1", "b.html": b"2"})
+        sync()
+        rmtree(path=os.path.join(ROOT, "local"))
+        build({"a.html": b"1"}, failed=["/b/"])
+        output = sync(delete=True)
+        assert "Not deleting, as 1 URLs failed to build" in output
+        assert storages["remote"].exists("b.html") is True
+
+
+def test_syncstaticsite_needs_a_destination():
+    with pytest.raises(CommandError):
+        call_command("syncstaticsite", stdout=StringIO())
+    with pytest.raises(CommandError):
+        call_command("syncstaticsite", destination="staticpub", stdout=StringIO())
@@ -1,9 +1,17 @@
+from django.contrib.auth import get_user_model
+from django.db import connection
 from django.urls import reverse
 from django.utils.encoding import force_bytes
 from django.test.client import Client
 from django.test.utils import override_settings
+from django.template import TemplateDoesNotExist
+from django.template.loader import select_template
 from staticpub import defaults
-from staticpub.models import URLReader, ReaderError
+from staticpub.models import URLReader, ReaderError, ResponseError, RenderTimeout
+from staticpub.models import RedirectPages
+from unittest.mock import patch
+from staticpub.signals import read_page
+from staticpub.signals import read_page_failed
 import pytest
 
 
@@ -123,3 +131,117 @@ def test_build_page_includes_redirections():
     assert third.url == "/content/a/b/"
     assert third.filename == "content/a/b/index.html"
     assert third.content == b"content_b"
+
+
+def test_build_skips_redirects_already_read():
+    reader = URLReader(urls=[reverse("redirect_a"), reverse("redirect_b")])
+    with patch("staticpub.models.select_template", wraps=select_template) as find:
+        result = tuple(reader())
+    assert [x.filename for x in result] == [
+        "r/a/index.html",
+        "r/a_b/index.html",
+        "content/a/b/index.html",
+        # /r/a_b/ itself, read again, but only the page it leads to is new.
+        "content/a/b/index.html",
+    ]
+    # templates were only looked for once for each redirect page ...
+    assert find.call_count == 2
+    # ... and each page only rendered once.
+    assert sorted(reader.redirects.pages) == [
+        ("/r/a/", "/content/a/b/"),
+        ("/r/a_b/", "/content/a/b/"),
+    ]
+
+
+def test_redirects_shared_for_a_build():
+    redirects = RedirectPages.for_build("build")
+    assert RedirectPages.for_build("build") is redirects
+    first = tuple(URLReader(urls=[reverse("redirect_a")], redirects=redirects)())
+    second = tuple(URLReader(urls=[reverse("redirect_b")], redirects=redirects)())
+    assert len(first) == 3
+    assert [x.filename for x in second] == ["content/a/b/index.html"]
+    assert RedirectPages.for_build("another build") is not redirects
+
+
+def test_redirect_template_missing_is_remembered():
+    redirects = RedirectPages()
+    with patch(
+        "staticpub.models.select_template", side_effect=TemplateDoesNotExist("301.html")
+    ) as find:
+        for attempt in range(2):
+            with pytest.raises(TemplateDoesNotExist):
+                redirects.get_template(["r/a/301.html", "301.html"])
+        reader = URLReader(urls=(), redirects=redirects)
+        assert reader.build_redirect_page("/r/a/", "/content/a/b/") is None
+    assert find.call_count == 2
+
+
+def test_build_page_raises_for_bad_status():
+    reader = URLReader(urls=())
+    with pytest.raises(ResponseError):
+        tuple(reader.build_page(url="/does-not-exist/"))
+
+
+def test_fail_soft_records_failures_and_carries_on():
+    failed = []
+
+    def receiver(sender, failure, **kwargs):
+        failed.append(failure)
+
+    reader = URLReader(urls=["/does-not-exist/", reverse("content_a")], fail_soft=True)
+    read_page_failed.connect(receiver)
+    try:
+        output = tuple(reader())
+    finally:
+        read_page_failed.disconnect(receiver)
+    assert [x.url for x in output] == ["/content/a/"]
+    assert len(reader.failures) == 1
+    assert failed == reader.failures
+    failure = reader.failures[0]
+    assert failure.url == "/does-not-exist/"
+    assert failure.error.startswith("staticpub.models.ResponseError: Got 404")
+    assert "Traceback" in failure.traceback
+
+
+def test_timeout_abandons_slow_render():
+    reader = URLReader(urls=[reverse("slow")], timeout=0.05)
+    with pytest.raises(RenderTimeout):
+        tuple(reader())
+
+
+def test_timeout_with_fail_soft_records_failure_and_carries_on():
+    reader = URLReader(
+        urls=[reverse("slow"), reverse("content_a")], fail_soft=True, timeout=0.05
+    )
+    output = tuple(reader())
+    assert [x.url for x in output] == ["/content/a/"]
+    assert [x.url for x in reader.failures] == ["/slow/"]
+    assert reader.failures[0].error == (
+        "staticpub.models.RenderTimeout: "
+        "Reading /slow/ took longer than 0.05 seconds"
+    )
+
+
+def test_timeout_allows_quick_render():
+    reader = URLReader(urls=[reverse("slow", kwargs={"seconds": 0})], timeout=5)
+    output = tuple(reader())
+    assert output[0].content == b"slow"
+
+
+@pytest.mark.django_db
+def test_build_forgets_queries_between_pages():
+    user = get_user_model().objects.create(username="queries")
+    url = reverse("show_user", kwargs={"pk": user.pk})
+    queries = []
+
+    def record_queries(sender, **kwargs):
+        queries.append(len(connection.queries))
+
+    read_page.connect(record_queries)
+    try:
+        with override_settings(DEBUG=True):
+            tuple(URLReader(urls=[url, reverse("content_a")])())
+            assert connection.queries == []
+    finally:
+        read_page.disconnect(record_queries)
+    assert queries[0] > 0
@@ -8,6 +8,7 @@ from staticpub.defaults import StaticpubFilesStorage
 from staticpub.models import URLReader
 from staticpub.models import ReadResult
 from staticpub.models import URLWriter
+from staticpub.models import BuildChanges
 
 
 def test_repr_short():
@@ -119,3 +120,56 @@ def test_write_single_item():
     assert output.modified is True
     assert output.name == "content/a/b/index.html"
     assert storage.open(output.name).readlines() == [b"content_b"]
+
+
+def test_write_only_modifies_changed_content():
+    writer = URLWriter(data=None)
+    NEW_STATIC_ROOT = os.path.join(
+        settings.BASE_DIR, "var", "test_collectstatic", "urlwriter", "unchanged"
+    )
+    rmtree(path=NEW_STATIC_ROOT, ignore_errors=True)
+    page = ReadResult(url="/a/", filename="a/index.html", status=200, content=b"a")
+    with patch.object(writer.storage, "location", NEW_STATIC_ROOT):
+        created = writer.write(page)
+        with patch.object(writer.storage, "save") as save:
+            unchanged = writer.write(page)
+        assert save.called is False
+        changed = writer.write(page._replace(content=b"b"))
+        assert writer.storage.open("a/index.html").read() == b"b"
+
+    assert (created.created, created.modified) == (True, True)
+    assert (unchanged.created, unchanged.modified) == (False, False)
+    assert unchanged.storage_result == "a/index.html"
+    assert (changed.created, changed.modified) == (False, True)
+    assert BuildChanges.from_write_results(
+        [created, unchanged, changed, None], deleted=["z.html", "b.html"]
+    ) == BuildChanges(
+        created=("a/index.html",),
+        modified=("a/index.html",),
+        deleted=("b.html", "z.html"),
+    )
+
+
+def test_write_compares_against_previous_files():
+    NEW_STATIC_ROOT = os.path.join(
+        settings.BASE_DIR, "var", "test_collectstatic", "urlwriter", "previous"
+    )
+    rmtree(path=NEW_STATIC_ROOT, ignore_errors=True)
+    page = ReadResult(url="/a/", filename="a/index.html", status=200, content=b"a")
+    writer = URLWriter(data=None)
+    with patch.object(writer.storage, "location", NEW_STATIC_ROOT):
+        created = writer.write(page)
+        previous = URLWriter(data=None, previous={created.name: created.md5})
+        with patch.object(previous.storage, "open") as storage_open:
+            unchanged = previous.write(page)
+        assert storage_open.called is False
+        assert (unchanged.created, unchanged.modified) == (False, False)
+
+        # the previous build's files are believed over the storage's.
+        stale = URLWriter(data=None, previous={created.name: "0" * 32})
+        assert stale.write(page).modified is True
+        # and anything it didn't write, or may have been written since, is
+        # read back.
+        assert URLWriter(data=None, previous={}).write(page).modified is False
+        forgotten = URLWriter(data=None, previous={created.name: None})
+        assert forgotten.write(page).modified is False
@@ -0,0 +1,130 @@
+from io import StringIO
+import multiprocessing
+import os
+from shutil import rmtree
+from unittest.mock import patch
+from django.conf import settings
+from django.core.files.storage import storages
+from django.core.management import call_command
+from django.template import engines
+from django.test.utils import override_settings
+from django.urls import reverse
+from staticpub import warmup
+from staticpub.warmup import Warmup
+from staticpub.warmup import get_template_names
+from staticpub.warmup import initialize_worker
+from staticpub.warmup import warm_up
+import pytest
+
+
+class ContentProducer:
+    def __call__(self):
+        yield reverse("content_a")
+        yield reverse("content_b")
+
+
+class FragmentsProducer:
+    def __call__(self):
+        for page in range(1, 5):
+            yield reverse("fragments", kwargs={"page": page})
+
+
+def test_get_template_names():
+    names = tuple(get_template_names())
+    assert "301.html" in names
+    assert "fragments.html" in names
+    assert "admin/base.html" in names
+    assert len(names) == len(set(names))
+
+
+def test_warm_up_compiles_templates():
+    cached = engines["django"].engine.template_loaders[0]
+    cached.reset()
+    result = warm_up(templates=["301.html", "users.html", "no/such/template.html"])
+    assert result.templates == 2
+    assert result.urls == 0
+    assert any(key.startswith("301.html") for key in cached.get_template_cache)
+    assert warmup.is_warm() is True
+
+
+def test_warm_up_reads_urls():
+    with override_settings(
+        STATICPUB_WARMUP_TEMPLATES=False,
+        STATICPUB_WARMUP_URLS=[reverse("content_a"), "/no/such/page/"],
+    ):
+        result = warm_up()
+    assert result.templates == 0
+    # a 404 is still a page read.
+    assert result.urls == 2
+    assert str(result).startswith("0 templates, 2 URLs and ")
+
+
+def test_initialize_worker_only_warms_up_once():
+    with patch.object(warmup, "_warm", []):
+        with patch.object(warmup, "warm_up") as warm:
+            initialize_worker(warm=False)
+            assert warm.called is False
+            initialize_worker()
+            assert warm.call_count == 1
+        warmup._warm.append(Warmup(templates=0, urls=0, languages=0, duration=0))
+        with patch.object(warmup, "warm_up") as warm:
+            initialize_worker()
+            assert warm.called is False
+
+
+@pytest.mark.skipif(
+    "fork" not in multiprocessing.get_all_start_methods(), reason="needs fork"
+)
+def test_collectstaticsite_warms_up_before_forking():
+    NEW_STATIC_ROOT = os.path.join(
+        settings.BASE_DIR, "var", "test_collectstatic", "collectstaticsite", "warmup"
+    )
+    rmtree(path=NEW_STATIC_ROOT, ignore_errors=True)
+    stdout = StringIO()
+    with patch.object(storages["staticpub"], "location", NEW_STATIC_ROOT):
+        with override_settings(STATICPUB_PRODUCERS=[ContentProducer]):
+            call_command(
+                "collectstaticsite",
+                interactive=False,
+                processes=2,
+                start_method="fork",
+                manifest=os.path.join(NEW_STATIC_ROOT, "manifest.json"),
+                journal=os.path.join(NEW_STATIC_ROOT, "journal.jsonl"),
+                stdout=stdout,
+            )
+        assert storages["staticpub"].exists("content/a/b/index.html") is True
+    assert "Warmed up " in stdout.getvalue()
+
+
+@pytest.mark.skipif(
+    "fork" not in multiprocessing.get_all_start_methods(), reason="needs fork"
+)
+def test_collectstaticsite_replaces_processes():
+    NEW_STATIC_ROOT = os.path.join(
+        settings.BASE_DIR, "var", "test_collectstatic", "collectstaticsite", "recycle"
+    )
+    rmtree(path=NEW_STATIC_ROOT, ignore_errors=True)
+    stdout = StringIO()
+    with patch.object(storages["staticpub"], "location", NEW_STATIC_ROOT):
+        with override_settings(STATICPUB_PRODUCERS=[FragmentsProducer]):
+            call_command(
+                "collectstaticsite",
+                interactive=False,
+                processes=2,
+                chunk_size=1,
+                max_pages_per_process=1,
+                start_method="fork",
+                manifest=os.path.join(NEW_STATIC_ROOT, "manifest.json"),
+                journal=os.path.join(NEW_STATIC_ROOT, "journal.jsonl"),
+                stdout=stdout,
+            )
+        assert storages["staticpub"].exists("fragments/4/index.html") is True
+    # each chunk was read by a process of its own, and the error pages by
+    # this one.
+    lines = [
+        x
+        for x in stdout.getvalue().splitlines()
+        if x.startswith("Process ") and not x.startswith("Process %d:" % os.getpid())
+    ]
+    assert len(lines) == 4
+    assert all("resident after 1 pages" in x for x in lines)
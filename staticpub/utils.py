@@ -1,7 +1,11 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
 from __future__ import unicode_literals
+from contextlib import contextmanager
+from itertools import islice
 from os.path import splitext
+import signal
+import threading
 
 
 def is_url_usable(url):
@@ -17,3 +21,83 @@ def is_url_usable(url):
         return True
     path, ext = splitext(url)
     return ext != ''
+
+
+def chunked(items, size):
+    """
+    Split an iterable into tuples of at most `size` items.
+    >>> assert tuple(chunked([1, 2, 3, 4, 5], 2)) == ((1, 2), (3, 4), (5,))
+    >>> assert tuple(chunked([], 2)) == ()
+    """
+    iterator = iter(items)
+    chunk = tuple(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = tuple(islice(iterator, size))
+
+
+@contextmanager
+def time_limit(seconds, exception):
+    """
+    Raise `exception` from wherever the block has got to, if it takes longer
+    than `seconds`. Only possible in the main thread of a process, on
+    platforms with SIGALRM; elsewhere, or if `seconds` is falsy, the block is
+    simply allowed to run to completion.
+    """
+    if (
+        not seconds
+        or not hasattr(signal, "setitimer")
+        or threading.current_thread() is not threading.main_thread()
+    ):
+        yield
+        return
+
+    def handler(signum, frame):
+        raise exception
+
+    previous = signal.signal(signal.SIGALRM, handler)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+_build_scoped = {}
+
+
+def build_scoped(factory, build_id, *args):
+    """
+    The one instance made by `factory` (given `args`) for a build in this
+    process, so that everything the process does during that build (eg: each
+    chunk of URLs it's given) may share it. Only the latest build's instances
+    are kept.
+    """
+    key = (factory, build_id) + args
+    if key not in _build_scoped:
+        for stale in tuple(x for x in _build_scoped if x[1] != build_id):
+            del _build_scoped[stale]
+        _build_scoped[key] = factory(*args)
+    return _build_scoped[key]
+
+
+def end_build(build_id):
+    """
+    Forgets everything this process kept for a build.
+    """
+    for key in tuple(x for x in _build_scoped if x[1] == build_id):
+        del _build_scoped[key]
+
+
+def max_tasks_per_process(max_pages, chunk_size):
+    """
+    How many chunks of `chunk_size` URLs a process should be given before
+    it's replaced by a new one, to read at most `max_pages` (if that's set).
+    >>> assert max_tasks_per_process(None, 50) is None
+    >>> assert max_tasks_per_process(1000, 50) == 20
+    >>> assert max_tasks_per_process(10, 50) == 1
+    """
+    if not max_pages:
+        return None
+    return max(1, max_pages // max(1, chunk_size))
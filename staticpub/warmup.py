@@ -0,0 +1,210 @@
+"""
+A process which has only just started reading pages does so slowly: no
+templates have been compiled by the cached loader, the URL resolvers haven't
+been populated, translations haven't been loaded and views haven't been
+imported. `warm_up` does all of that up front, so that the parent process can
+do it once before forking its workers, which then start warm; under the
+`spawn` or `forkserver` start methods, each worker does it as it starts,
+before it's given any URLs.
+"""
+
+from collections import namedtuple
+import logging
+import os
+from time import perf_counter
+
+from django.conf import settings
+
+__all__ = [
+    "Warmup",
+    "warm_up",
+    "is_warm",
+    "initialize_worker",
+    "FORKSERVER_PRELOAD",
+]
+
+logger = logging.getLogger(__name__)
+
+# imported once by the forkserver, rather than by every worker it starts.
+# Only those which don't need settings, as the forkserver hasn't any.
+FORKSERVER_PRELOAD = (
+    "django.core.handlers.wsgi",
+    "django.db.models",
+    "django.template.loader",
+    "django.test.client",
+)
+
+_warm = []
+
+
+class Warmup(namedtuple("Warmup", "templates urls languages duration")):
+    """
+    How many templates were compiled, URLs read and languages loaded while
+    warming up, and how long it took.
+    """
+
+    __slots__ = ()
+
+    def __str__(self):
+        return (
+            "{templates} templates, {urls} URLs and {languages} languages in "
+            "{duration:.2f}s".format(**self._asdict())
+        )
+
+
+def is_warm():
+    return bool(_warm)
+
+
+def get_template_directories():
+    from django.template import engines
+    from django.template.backends.django import DjangoTemplates
+
+    for backend in engines.all():
+        if not isinstance(backend, DjangoTemplates):
+            continue
+        for loader in backend.engine.template_loaders:
+            # a cached loader wraps the others.
+            for inner in getattr(loader, "loaders", (loader,)):
+                if hasattr(inner, "get_dirs"):
+                    yield from inner.get_dirs()
+
+
+def get_template_names():
+    """
+    Every template the Django template engines could load, by the name it'd
+    be loaded by.
+    """
+    seen = set()
+    for directory in get_template_directories():
+        for root, dirs, files in os.walk(directory):
+            dirs.sort()
+            for filename in sorted(files):
+                name = os.path.relpath(os.path.join(root, filename), directory)
+                name = name.replace(os.sep, "/")
+                if name not in seen:
+                    seen.add(name)
+                    yield name
+
+
+def warm_templates(names=None):
+    """
+    Compiles templates, so that a cached loader has them already. Any which
+    aren't templates at all, or don't compile, are skipped.
+    """
+    from django.template.loader import get_template
+
+    if names is None:
+        names = get_template_names()
+    compiled = 0
+    for name in names:
+        try:
+            get_template(name)
+        except Exception:
+            logger.debug("Unable to compile {name} to warm up".format(name=name))
+            continue
+        compiled += 1
+    return compiled
+
+
+def warm_urls():
+    """
+    Imports the URLconf and every view in it, and fills in the resolver's
+    lookups, so that neither is done while reading the first page.
+    """
+    from django.urls import get_resolver
+
+    resolver = get_resolver()
+    # populates the resolver, importing the views as it goes.
+    resolver.reverse_dict
+    return resolver
+
+
+def warm_languages():
+    from django.utils import translation
+
+    if not settings.USE_I18N:
+        return 0
+    languages = (settings.LANGUAGE_CODE,)
+    # rather than every language Django knows.
+    if settings.is_overridden("LANGUAGES"):
+        languages = tuple(code for code, name in settings.LANGUAGES)
+    current = translation.get_language()
+    try:
+        for code in languages:
+            translation.activate(code)
+    finally:
+        if current:
+            translation.activate(current)
+        else:
+            translation.deactivate()
+    return len(languages)
+
+
+def read_urls(urls):
+    """
+    Reads some pages, throwing away the result, to import and fill in
+    whatever else the views need, eg: lazily imported modules.
+    """
+    from django.test.client import Client
+
+    client = Client()
+    read = 0
+    for url in urls:
+        try:
+            client.get(url, follow=True, **{"HTTP_USER_AGENT": "staticpub"})
+        except Exception:
+            logger.warning("Unable to read {url} to warm up".format(url=url))
+            continue
+        read += 1
+    return read
+
+
+def warm_up(templates=None, urls=None):
+    """
+    Primes this process's templates, URL resolvers and translations, and
+    reads any `STATICPUB_WARMUP_URLS`. `STATICPUB_WARMUP_TEMPLATES` may be a
+    list of template names to compile, or False for none; by default, every
+    template is.
+    """
+    started = perf_counter()
+    if templates is None:
+        templates = getattr(settings, "STATICPUB_WARMUP_TEMPLATES", True)
+    if urls is None:
+        urls = getattr(settings, "STATICPUB_WARMUP_URLS", ())
+    warm_urls()
+    languages = warm_languages()
+    compiled = 0
+    if templates is True:
+        compiled = warm_templates()
+    elif templates:
+        compiled = warm_templates(templates)
+    read = read_urls(urls)
+    warmup = Warmup(
+        templates=compiled,
+        urls=read,
+        languages=languages,
+        duration=perf_counter() - started,
+    )
+    _warm[:] = [warmup]
+    return warmup
+
+
+def initialize_worker(warm=True):
+    """
+    Run as each pool worker starts. One forked from a warm parent has
+    nothing left to do but leave the parent's database connections to it,
+    but one spawned afresh has to set Django up (from
+    `DJANGO_SETTINGS_MODULE`), and warm itself up.
+    """
+    import django
+    from django.apps import apps
+
+    if not apps.ready:
+        django.setup()
+    else:
+        from staticpub.db import forget_connections
+
+        forget_connections()
+    if warm and not is_warm():
+        warm_up()
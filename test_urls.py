@@ -1,4 +1,5 @@
 from random import randint
+from time import sleep
 from django.urls import re_path as url, reverse
 from django.contrib import messages
 from django.contrib.auth import get_user_model
@@ -19,6 +20,7 @@ from django.utils.encoding import force_str
 from django.views.decorators.http import require_http_methods
 from django.contrib.sitemaps.views import sitemap
 from staticpub.actions import build_selected
+from staticpub.memo import build_cached
 from staticpub.models import ModelProducer
 
 
@@ -107,6 +109,39 @@ def redirect_b(request):
     return HttpResponseRedirect(reverse("content_b"))
 
 
+@require_http_methods(["GET"])
+def slow(request, seconds="5"):
+    sleep(float(seconds))
+    return HttpResponse("slow")
+
+
+RENDERED = []
+
+
+def rendered(name):
+    RENDERED.append(name)
+    return RENDERED.count(name)
+
+
+@build_cached
+def footer_links():
+    return rendered("footer_links")
+
+
+@require_http_methods(["GET"])
+def fragments(request, page):
+    footer_links()
+    return render(
+        request,
+        "fragments.html",
+        {
+            "page": page,
+            "footer": lambda: rendered("footer"),
+            "sidebar": lambda: rendered("sidebar"),
+        },
+    )
+
+
 sitemaps = {
     "users": UserSitemap,
 }
@@ -129,4 +164,7 @@ urlpatterns = [
     url(r"^content/a/$", content_a, name="content_a"),
     url(r"^r/a/$", redirect_a, name="redirect_a"),
     url(r"^r/a_b/$", redirect_b, name="redirect_b"),
+    url(r"^fragments/(?P<page>\d+)/$", fragments, name="fragments"),
+    url(r"^slow/$", slow, name="slow"),
+    url(r"^slow/(?P<seconds>\d+)/$", slow, name="slow"),
 ]
@@ -0,0 +1,16 @@
+import os
+from unittest.mock import patch
+from django.core.files.storage import storages
+from django.core.management import call_command
+from django.test.utils import override_settings
+from io import StringIO
+from staticpub.test_metrics import DummyProducer
+import pytest
+
+@pytest.mark.django_db(transaction=True)
+def test_pool():
+    out = StringIO()
+    with override_settings(STATICPUB_PRODUCERS=[DummyProducer]):
+        with patch.object(storages["staticpub"], "location", "/tmp/sp_pool"):
+            call_command("collectstaticsite", interactive=False, processes=2, report=1, trace_memory=True, profile_threshold=0.0, profile_dir="/tmp/sp_prof", stdout=out)
+    print(out.getvalue())
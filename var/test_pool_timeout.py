@@ -0,0 +1,18 @@
+from unittest.mock import patch
+from django.core.files.storage import storages
+from django.core.management import call_command
+from django.test.utils import override_settings
+from io import StringIO
+import pytest
+
+class SlowProducer(object):
+    def __call__(self):
+        return ["/content/a/", "/slow/", "/content/a/b/"]
+
+@pytest.mark.django_db(transaction=True)
+def test_pool():
+    out, err = StringIO(), StringIO()
+    with override_settings(STATICPUB_PRODUCERS=[SlowProducer]):
+        with patch.object(storages["staticpub"], "location", "/tmp/sp_pool_t"):
+            call_command("collectstaticsite", interactive=False, processes=2, keep_going=True, retries=0, max_failures=1, timeout=0.2, journal="/tmp/sp_j.jsonl", stdout=out, stderr=err)
+    print(out.getvalue(), err.getvalue())